@@ -1,9 +1,14 @@
 import json
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import streamlit as st
 from azure.storage.blob import BlobServiceClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 API_BASE_URL = os.getenv(
     "API_BASE_URL", "https://pdf-processor-functions-v2.azurewebsites.net/api"
@@ -12,22 +17,81 @@ API_KEY = os.getenv("API_KEY")
 STORAGE_CONNECTION_STRING = os.getenv("STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = os.getenv("CONTAINER_NAME", "pdfs")
 
+# Timeouts are (connect, read) seconds; retries cover both chat and uploads
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "120"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE_MB", "4")) * 1024 * 1024
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_TIMEOUT = int(os.getenv("UPLOAD_TIMEOUT", "600"))
+UPLOAD_FILE_CONCURRENCY = int(os.getenv("UPLOAD_FILE_CONCURRENCY", "4"))
+
+# Status polling backs off from the first to the max interval until done
+STATUS_POLL_FIRST_INTERVAL = float(os.getenv("STATUS_POLL_FIRST_INTERVAL", "2"))
+STATUS_POLL_MAX_INTERVAL = float(os.getenv("STATUS_POLL_MAX_INTERVAL", "30"))
+STATUS_POLL_TIMEOUT = float(os.getenv("STATUS_POLL_TIMEOUT", "360"))
+TERMINAL_STATES = ("processed", "exception", "rejected", "failed", "queued")
+STATE_ICONS = {
+    "pending": "⏳",
+    "processing": "⚙️",
+    "processed": "✅",
+    "exception": "⚠️",
+    "rejected": "❌",
+    "failed": "❌",
+    "queued": "📥",
+}
+
 st.set_page_config(page_title="Healthcare AI", page_icon="🏥")
 st.title("Centralized AI OCR Solution")
 
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Pooled HTTP session shared by every chat request of this app process"""
+    session = requests.Session()
+    # Only idempotent methods are retried on a response or read error; a
+    # chat POST updates the session and may already have run, so it is
+    # retried only when the connection was never made
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_container_client():
+    """Blob container client built once from the connection string"""
+    blob_service_client = BlobServiceClient.from_connection_string(
+        STORAGE_CONNECTION_STRING,
+        max_block_size=UPLOAD_BLOCK_SIZE,
+        max_single_put_size=UPLOAD_BLOCK_SIZE,
+        retry_total=HTTP_RETRIES,
+        connection_timeout=API_CONNECT_TIMEOUT,
+        read_timeout=API_READ_TIMEOUT,
+    )
+    return blob_service_client.get_container_client(CONTAINER_NAME)
 
 
 def query_backend(question: str):
     """Send question to your Azure Function chat endpoint"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_BASE_URL}/chat",
             headers={"Content-Type": "application/json"},
             params={"code": API_KEY},
-            json={"message": question},
+            json={"message": question, "session_id": st.session_state.session_id},
+            timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
         )
         if response.status_code == 200:
             return response.json()["formatted_response"]
@@ -37,34 +101,145 @@ def query_backend(question: str):
         return f"Connection error: {str(e)}"
 
 
-def upload_pdf_to_blob(uploaded_file):
-    """Upload PDF to Azure Blob Storage"""
+def upload_pdf_to_blob(uploaded_file, container_client=None):
+    """
+    Upload PDF to Azure Blob Storage in parallel blocks
+
+    Returns:
+        (success, message, storage time of the upload or None)
+    """
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(
-            STORAGE_CONNECTION_STRING
-        )
-        blob_client = blob_service_client.get_blob_client(
-            container=CONTAINER_NAME, blob=uploaded_file.name
+        container_client = container_client or get_container_client()
+        blob_client = container_client.get_blob_client(uploaded_file.name)
+        # Stream from the uploaded file; at most UPLOAD_CONCURRENCY blocks of
+        # UPLOAD_BLOCK_SIZE are held in memory at once
+        uploaded_file.seek(0)
+        properties = blob_client.upload_blob(
+            uploaded_file,
+            length=uploaded_file.size,
+            overwrite=True,
+            max_concurrency=UPLOAD_CONCURRENCY,
+            timeout=UPLOAD_TIMEOUT,
         )
-        blob_client.upload_blob(uploaded_file.getvalue(), overwrite=True)
-        return True, "Upload successful"
+        return True, "Upload successful", properties.get("last_modified")
     except Exception as e:
-        return False, f"Upload failed: {str(e)}"
+        return False, f"Upload failed: {str(e)}", None
+
+
+def upload_pdfs(uploaded_files) -> dict:
+    """Upload several PDFs concurrently, returning {name: upload_pdf_to_blob result}"""
+    # Resolve the cached client here; worker threads have no Streamlit context
+    container_client = get_container_client()
+    with ThreadPoolExecutor(max_workers=UPLOAD_FILE_CONCURRENCY) as executor:
+        outcomes = executor.map(
+            lambda uploaded_file: upload_pdf_to_blob(uploaded_file, container_client),
+            uploaded_files,
+        )
+        return {
+            uploaded_file.name: outcome
+            for uploaded_file, outcome in zip(uploaded_files, outcomes)
+        }
+
+
+def fetch_processing_status(filenames: list, since=None) -> dict:
+    """
+    Ask the status endpoint for the state of every file in one request
+
+    Args:
+        filenames: Uploaded file names
+        since: Upload time; documents from earlier uploads are ignored
+    """
+    body = {"filenames": filenames}
+    if since is not None:
+        body["since"] = since.isoformat()
+    response = get_http_session().post(
+        f"{API_BASE_URL}/status",
+        headers={"Content-Type": "application/json"},
+        params={"code": API_KEY},
+        json=body,
+        timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+    )
+    response.raise_for_status()
+    return response.json()["files"]
+
+
+def poll_processing_status(filenames: list, placeholder, since=None) -> dict:
+    """Poll with exponential backoff until every file is done or we time out"""
+    interval = STATUS_POLL_FIRST_INTERVAL
+    deadline = time.monotonic() + STATUS_POLL_TIMEOUT
+    statuses = {}
+
+    while True:
+        try:
+            statuses = fetch_processing_status(filenames, since)
+        except Exception as e:
+            placeholder.warning(f"Status check failed, retrying: {str(e)}")
+        else:
+            lines = []
+            for filename in filenames:
+                state = statuses.get(filename, {}).get("state", "pending")
+                line = f"{STATE_ICONS.get(state, '')} **{filename}**: {state}"
+                accuracy = statuses.get(filename, {}).get("accuracy")
+                if accuracy is not None:
+                    line += f" ({accuracy:.0f}% accuracy)"
+                details = statuses.get(filename, {}).get("error_details")
+                if details and state in ("rejected", "failed", "queued"):
+                    line += f" — {details}"
+                lines.append(line)
+            placeholder.markdown("\n\n".join(lines))
+
+            if all(
+                statuses.get(filename, {}).get("state") in TERMINAL_STATES
+                for filename in filenames
+            ):
+                return statuses
+
+        if time.monotonic() + interval > deadline:
+            return statuses
+        time.sleep(interval)
+        interval = min(interval * 2, STATUS_POLL_MAX_INTERVAL)
 
 
 with st.sidebar:
-    st.header("📄 Upload PDF")
-    uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
+    st.header("📄 Upload PDFs")
+    uploaded_files = st.file_uploader(
+        "Choose PDF files", type="pdf", accept_multiple_files=True
+    )
 
-    if uploaded_file is not None:
-        if st.button("Process PDF"):
-            with st.spinner("Uploading and processing..."):
-                success, message = upload_pdf_to_blob(uploaded_file)
+    if uploaded_files:
+        if st.button("Process PDFs"):
+            with st.spinner(f"Uploading {len(uploaded_files)} files..."):
+                results = upload_pdfs(uploaded_files)
+
+            uploaded, upload_times = [], []
+            for filename, (success, message, uploaded_at) in results.items():
                 if success:
-                    st.success(f"✅ {uploaded_file.name} uploaded successfully!")
-                    st.info("Processing will complete in the background.")
+                    uploaded.append(filename)
+                    if uploaded_at is not None:
+                        upload_times.append(uploaded_at)
                 else:
-                    st.error(f"❌ {message}")
+                    st.error(f"❌ {filename}: {message}")
+
+            if uploaded:
+                st.success(f"✅ Uploaded {len(uploaded)} files, processing...")
+                status_placeholder = st.empty()
+                # Storage time, so a re-upload isn't matched to the old row
+                statuses = poll_processing_status(
+                    uploaded,
+                    status_placeholder,
+                    min(upload_times) if len(upload_times) == len(uploaded) else None,
+                )
+                pending = [
+                    filename
+                    for filename in uploaded
+                    if statuses.get(filename, {}).get("state") not in TERMINAL_STATES
+                ]
+                if pending:
+                    st.info(
+                        "Still processing in the background: "
+                        + ", ".join(pending)
+                        + ". No need to re-upload."
+                    )
 
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -1,5 +1,33 @@
+from .analytics import AnalyticsEngine, AnalyticsSnapshot, get_analytics_engine
 from .connection import DatabaseConnection
+from .export import ExportPage
+from .lookup_filter import BloomFilter, PatientLookupFilter, get_lookup_filter
+from .name_index import NameIndex, get_name_index
 from .operations import DatabaseOperations
+from .pool import ConnectionPool, get_pool
+from .read_replica import ReadReplica, get_read_replica
+from .result_set import ResultSet, encode_json
 from .retreive_data import RetreiveData
+from .schema import SchemaMigrator
 
-__all__ = ["DatabaseConnection", "DatabaseOperations", "RetreiveData"]
+__all__ = [
+    "AnalyticsEngine",
+    "AnalyticsSnapshot",
+    "get_analytics_engine",
+    "DatabaseConnection",
+    "DatabaseOperations",
+    "ExportPage",
+    "BloomFilter",
+    "PatientLookupFilter",
+    "get_lookup_filter",
+    "NameIndex",
+    "get_name_index",
+    "ConnectionPool",
+    "get_pool",
+    "ReadReplica",
+    "get_read_replica",
+    "ResultSet",
+    "encode_json",
+    "RetreiveData",
+    "SchemaMigrator",
+]
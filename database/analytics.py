@@ -0,0 +1,827 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from shared import metrics
+
+from .pool import get_pool
+
+ANALYTICS_ENABLED = os.environ.get("ANALYTICS_ENABLED", "true").lower() == "true"
+ANALYTICS_SNAPSHOT_DIR = os.environ.get(
+    "ANALYTICS_SNAPSHOT_DIR",
+    os.path.join(tempfile.gettempdir(), "analytics-snapshot"),
+)
+ANALYTICS_REFRESH_SECONDS = float(os.environ.get("ANALYTICS_REFRESH_SECONDS", "900"))
+ANALYTICS_FETCH_SIZE = int(os.environ.get("ANALYTICS_FETCH_SIZE", "20000"))
+ANALYTICS_MAX_GROUPS = int(os.environ.get("ANALYTICS_MAX_GROUPS", "50"))
+
+# Snapshotted columns and how each is stored: "int" and "float" as-is,
+# "date" as datetime64[D] (NaT for NULL), "str" as int32 codes into a
+# per-column dictionary (-1 for NULL)
+SNAPSHOT_TABLES: Dict[str, Dict[str, str]] = {
+    "Patients": {
+        "PatientID": "int",
+        "DateOfBirth": "date",
+        "PrimaryDiagnosis": "str",
+        "AdmissionDate": "date",
+        "DischargeDate": "date",
+        "AttendingPhysician": "str",
+        "FacilityName": "str",
+    },
+    "Insurance": {"PatientID": "int", "InsuranceCompany": "str"},
+    "Documents": {
+        "DocumentID": "int",
+        "DocumentType": "str",
+        "ProcessingStatus": "str",
+        "CreatedDate": "date",
+    },
+    "ProcessTable": {
+        "DocumentID": "int",
+        "Accuracy": "float",
+        "Status": "str",
+        "Type": "str",
+    },
+}
+
+SNAPSHOT_ORDER = {
+    "Patients": "PatientID",
+    "Insurance": "InsuranceID",
+    "Documents": "DocumentID",
+    "ProcessTable": "ProcessID",
+}
+
+# Tables the analytics intent can ask about: a base table, columns looked
+# up from another table by key (first match wins), and derived columns
+ANALYTICS_VIEWS = {
+    "patients": {
+        "table": "Patients",
+        "lookups": {"InsuranceCompany": ("Insurance", "PatientID", "PatientID")},
+        "derived": ("LengthOfStay", "Age"),
+    },
+    "documents": {
+        "table": "Documents",
+        "lookups": {
+            "Accuracy": ("ProcessTable", "DocumentID", "DocumentID"),
+            "Status": ("ProcessTable", "DocumentID", "DocumentID"),
+            "Type": ("ProcessTable", "DocumentID", "DocumentID"),
+        },
+        "derived": (),
+    },
+}
+
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+DATE_BUCKETS = {"day": "D", "month": "M", "year": "Y"}
+COMPARISONS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "=": np.equal,
+    "!=": np.not_equal,
+}
+FUNCTION_PATTERN = re.compile(r"^\s*(\w+)\s*\(\s*(\w*)\s*\)\s*$")
+
+# Below this many combined groups, group ids come from arithmetic on the
+# key codes instead of a sort
+DENSE_GROUP_LIMIT = 1 << 22
+
+
+def _date_value(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return value[:10]
+    return value
+
+
+class _ColumnBuilder:
+    """Accumulates one column batch by batch, dictionary-encoding strings"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.chunks = []
+        self.codes: Dict[str, int] = {}
+
+    def append(self, values: list) -> None:
+        if self.kind == "str":
+            codes = self.codes
+            self.chunks.append(
+                np.fromiter(
+                    (
+                        (
+                            -1
+                            if value is None
+                            else codes.setdefault(str(value), len(codes))
+                        )
+                        for value in values
+                    ),
+                    dtype=np.int32,
+                    count=len(values),
+                )
+            )
+        elif self.kind == "date":
+            self.chunks.append(
+                np.array(
+                    [_date_value(value) for value in values], dtype="datetime64[D]"
+                )
+            )
+        elif self.kind == "float":
+            self.chunks.append(
+                np.array(
+                    [np.nan if value is None else float(value) for value in values],
+                    dtype=np.float64,
+                )
+            )
+        else:
+            self.chunks.append(np.array(values, dtype=np.int64))
+
+    def finish(self) -> np.ndarray:
+        dtype = {
+            "str": np.int32,
+            "date": "datetime64[D]",
+            "float": np.float64,
+            "int": np.int64,
+        }[self.kind]
+        return np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=dtype)
+
+
+def write_snapshot(
+    directory: str, columns: Dict[str, Dict[str, np.ndarray]], dictionaries: dict
+) -> str:
+    """
+    Save columns as .npy files in a new version directory and make it current
+
+    Args:
+        directory: Snapshot root
+        columns: table -> column -> array
+        dictionaries: "Table.Column" -> list of strings for "str" columns
+
+    Returns:
+        Path of the version directory
+    """
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    path = os.path.join(directory, version)
+    os.makedirs(path, exist_ok=True)
+
+    manifest = {"version": version, "built_at": time.time(), "tables": {}}
+    for table, table_columns in columns.items():
+        rows = len(next(iter(table_columns.values()))) if table_columns else 0
+        manifest["tables"][table] = {
+            "rows": rows,
+            "columns": {name: SNAPSHOT_TABLES[table][name] for name in table_columns},
+        }
+        for name, values in table_columns.items():
+            np.save(os.path.join(path, f"{table}.{name}.npy"), values)
+    with open(os.path.join(path, "dictionaries.json"), "w", encoding="utf-8") as handle:
+        json.dump(dictionaries, handle)
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle)
+
+    # Readers follow CURRENT, so the switch to the new version is atomic
+    pointer = os.path.join(directory, "CURRENT")
+    with open(pointer + ".tmp", "w", encoding="utf-8") as handle:
+        handle.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+    # Keep the previous version for processes that still have it mapped
+    versions = sorted(
+        name
+        for name in os.listdir(directory)
+        if os.path.isdir(os.path.join(directory, name))
+    )
+    for old in versions[:-2]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return path
+
+
+def build_snapshot(cursor, directory: str = ANALYTICS_SNAPSHOT_DIR) -> str:
+    """
+    Read SNAPSHOT_TABLES batch by batch and write a new snapshot version
+
+    Args:
+        cursor: pymssql dict cursor (or anything with execute/fetchmany)
+        directory: Snapshot root
+
+    Returns:
+        Path of the version directory
+    """
+    columns, dictionaries = {}, {}
+    for table, kinds in SNAPSHOT_TABLES.items():
+        builders = {name: _ColumnBuilder(kind) for name, kind in kinds.items()}
+        cursor.execute(
+            f"SELECT {', '.join(kinds)} FROM {table} ORDER BY {SNAPSHOT_ORDER[table]}"
+        )
+        while True:
+            rows = cursor.fetchmany(ANALYTICS_FETCH_SIZE)
+            if not rows:
+                break
+            for name, builder in builders.items():
+                builder.append([row[name] for row in rows])
+
+        columns[table] = {name: builder.finish() for name, builder in builders.items()}
+        for name, builder in builders.items():
+            if builder.kind == "str":
+                dictionaries[f"{table}.{name}"] = list(builder.codes)
+    return write_snapshot(directory, columns, dictionaries)
+
+
+class Column:
+    """A snapshot column: values plus the dictionary for encoded strings"""
+
+    __slots__ = ("values", "kind", "dictionary")
+
+    def __init__(self, values: np.ndarray, kind: str, dictionary=None):
+        self.values = values
+        self.kind = kind
+        self.dictionary = dictionary
+
+
+class AnalyticsSnapshot:
+    """A memory-mapped snapshot version"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as handle:
+            self.manifest = json.load(handle)
+        with open(os.path.join(path, "dictionaries.json"), encoding="utf-8") as handle:
+            self.dictionaries = json.load(handle)
+        self.path = path
+        self.version = self.manifest["version"]
+        self.built_at = self.manifest["built_at"]
+        self._columns: Dict[Tuple[str, str], Column] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def current(
+        cls, directory: str = ANALYTICS_SNAPSHOT_DIR
+    ) -> Optional["AnalyticsSnapshot"]:
+        """The version CURRENT points at, or None before the first build"""
+        try:
+            with open(os.path.join(directory, "CURRENT"), encoding="utf-8") as handle:
+                return cls(os.path.join(directory, handle.read().strip()))
+        except (OSError, ValueError):
+            return None
+
+    def rows(self, table: str) -> int:
+        return self.manifest["tables"][table]["rows"]
+
+    def column(self, table: str, name: str) -> Column:
+        key = (table, name)
+        with self._lock:
+            if key not in self._columns:
+                kind = self.manifest["tables"][table]["columns"].get(name)
+                if kind is None:
+                    raise KeyError(f"{table}.{name}")
+                values = np.load(
+                    os.path.join(self.path, f"{table}.{name}.npy"), mmap_mode="r"
+                )
+                dictionary = self.dictionaries.get(f"{table}.{name}")
+                self._columns[key] = Column(values, kind, dictionary)
+            return self._columns[key]
+
+
+def _parse_function(expression: str) -> Tuple[Optional[str], str]:
+    """Split "avg(LengthOfStay)" into ("avg", "LengthOfStay")"""
+    match = FUNCTION_PATTERN.match(str(expression))
+    if match:
+        return match.group(1).lower(), match.group(2)
+    return None, str(expression).strip()
+
+
+def _factorize(values: np.ndarray) -> Tuple[np.ndarray, int, np.ndarray]:
+    """
+    Dense group codes for one key column
+
+    Returns:
+        (codes, size, uniques) where uniques[code] is the key value
+    """
+    if values.dtype.kind in "iu" and len(values):
+        low, high = int(values.min()), int(values.max())
+        if high - low < DENSE_GROUP_LIMIT:
+            return (
+                (values - low).astype(np.int64),
+                high - low + 1,
+                np.arange(low, high + 1),
+            )
+    uniques, codes = np.unique(values, return_inverse=True)
+    return codes.astype(np.int64), len(uniques), uniques
+
+
+def _select(values: np.ndarray, mask: Optional[np.ndarray]) -> np.ndarray:
+    """Rows of values kept by mask (None keeps all, without a copy)"""
+    return np.asarray(values) if mask is None else np.asarray(values)[mask]
+
+
+class AnalyticsEngine:
+    """Vectorized filter, group-by and aggregate over an AnalyticsSnapshot"""
+
+    def __init__(self, snapshot: AnalyticsSnapshot):
+        self.snapshot = snapshot
+        self.logger = logging.getLogger(__name__)
+        self._lookup_positions: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+        self._computed: Dict[Tuple[str, str], Column] = {}
+        self._lock = threading.Lock()
+
+    def columns(self, view: str) -> List[str]:
+        spec = ANALYTICS_VIEWS[view]
+        base = self.snapshot.manifest["tables"][spec["table"]]["columns"]
+        return list(base) + list(spec["lookups"]) + list(spec["derived"])
+
+    def column(self, view: str, name: str) -> Column:
+        """Resolve a base, looked-up or derived column of a view"""
+        spec = ANALYTICS_VIEWS[view]
+        table = spec["table"]
+        if name in self.snapshot.manifest["tables"][table]["columns"]:
+            return self.snapshot.column(table, name)
+        function, source = _parse_function(name)
+        if function is not None:
+            name = f"{function.lower()}({source})"
+        # Computed once per snapshot; later queries reuse the array
+        column = self._computed.get((view, name))
+        if column is None:
+            column = self._computed.setdefault((view, name), self._compute(view, name))
+        return column
+
+    def _compute(self, view: str, name: str) -> Column:
+        spec = ANALYTICS_VIEWS[view]
+        table = spec["table"]
+        function, source = _parse_function(name)
+        if function is not None:
+            return self._date_buckets(view, function, source)
+        if name in spec["lookups"]:
+            return self._lookup(view, name)
+        if name == "LengthOfStay":
+            admitted = self.snapshot.column(table, "AdmissionDate").values
+            discharged = self.snapshot.column(table, "DischargeDate").values
+            days = (discharged - admitted).astype("timedelta64[D]").astype(np.float64)
+            days[np.isnat(admitted) | np.isnat(discharged)] = np.nan
+            return Column(days, "float")
+        if name == "Age":
+            born = self.snapshot.column(table, "DateOfBirth").values
+            today = np.datetime64(date.fromtimestamp(self.snapshot.built_at), "D")
+            years = (today - born).astype("timedelta64[D]").astype(np.float64) / 365.25
+            years = np.floor(years)
+            years[np.isnat(born)] = np.nan
+            return Column(years, "float")
+        raise ValueError(
+            f"Unknown column '{name}' for {view}; use one of {self.columns(view)}"
+        )
+
+    def _date_buckets(self, view: str, function: str, name: str) -> Column:
+        """day/month/year of a date column, encoded like a string column"""
+        if function not in DATE_BUCKETS:
+            raise ValueError(f"Unknown function '{function}'")
+        dates = self.column(view, name)
+        if dates.kind != "date":
+            raise ValueError(f"{function}() needs a date column, not {name}")
+
+        unit = DATE_BUCKETS[function]
+        buckets = np.asarray(dates.values).astype(f"datetime64[{unit}]")
+        missing = np.isnat(buckets)
+        if missing.all():
+            return Column(np.full(len(buckets), -1, dtype=np.int32), "str", [])
+        # Buckets are consecutive integers, so the code is the offset
+        numbers = buckets.view(np.int64)
+        low, high = int(numbers[~missing].min()), int(numbers[~missing].max())
+        codes = np.where(missing, -1, numbers - low).astype(np.int32)
+        labels = [str(np.datetime64(bucket, unit)) for bucket in range(low, high + 1)]
+        return Column(codes, "str", labels)
+
+    def _lookup(self, view: str, name: str) -> Column:
+        """Values of another table's column for each row, matched by key"""
+        spec = ANALYTICS_VIEWS[view]
+        other, key, other_key = spec["lookups"][name]
+        cache_key = (spec["table"], other, key)
+        with self._lock:
+            if cache_key not in self._lookup_positions:
+                keys = np.asarray(self.snapshot.column(spec["table"], key).values)
+                other_keys = np.asarray(self.snapshot.column(other, other_key).values)
+                # Stable sort keeps the lowest-ID row first for repeated keys
+                order = np.argsort(other_keys, kind="stable")
+                sorted_keys = other_keys[order]
+                position = np.searchsorted(sorted_keys, keys)
+                position = np.minimum(position, max(len(sorted_keys) - 1, 0))
+                found = (
+                    sorted_keys[position] == keys
+                    if len(sorted_keys)
+                    else np.zeros(len(keys), dtype=bool)
+                )
+                rows = order[position] if len(order) else np.zeros(len(keys), np.int64)
+                self._lookup_positions[cache_key] = (rows, found)
+            rows, found = self._lookup_positions[cache_key]
+
+        source = self.snapshot.column(other, name)
+        if len(source.values):
+            values = np.asarray(source.values)[rows]
+        else:
+            values = np.empty(len(rows), dtype=source.values.dtype)
+        if source.kind == "str":
+            values = np.where(found, values, -1).astype(np.int32)
+        elif source.kind == "float":
+            values = np.where(found, values, np.nan)
+        elif source.kind == "date":
+            values = np.where(found, values, np.datetime64("NaT"))
+        return Column(values, source.kind, source.dictionary)
+
+    def _condition(self, view: str, name: str, condition) -> np.ndarray:
+        """
+        Boolean mask for one filter
+
+        A string matches case-insensitively, "~text" matches a substring, a
+        list matches any of its entries and {op: value} compares with
+        >, >=, <, <=, = or != (dates as "YYYY-MM-DD", "YYYY-MM" or "YYYY").
+        """
+        column = self.column(view, name)
+        values = column.values
+
+        if isinstance(condition, dict):
+            mask = np.ones(len(values), dtype=bool)
+            for op, operand in condition.items():
+                if op not in COMPARISONS:
+                    raise ValueError(f"Unknown comparison '{op}' on {name}")
+                if column.kind == "str":
+                    if op not in ("=", "!="):
+                        raise ValueError(f"{name} only supports = and !=")
+                    matched = self._condition(view, name, operand)
+                    mask &= matched if op == "=" else ~matched & (values >= 0)
+                    continue
+                if column.kind == "date":
+                    operand = np.datetime64(str(operand))
+                    mask &= ~np.isnat(values)
+                else:
+                    operand = float(operand)
+                mask &= COMPARISONS[op](values, operand)
+            return mask
+
+        candidates = condition if isinstance(condition, list) else [condition]
+        if column.kind == "str":
+            codes = set()
+            for candidate in candidates:
+                text = str(candidate).strip().lower()
+                contains = text.startswith("~")
+                text = text.lstrip("~").strip()
+                codes.update(
+                    code
+                    for code, entry in enumerate(column.dictionary)
+                    if (text in entry.lower() if contains else entry.lower() == text)
+                )
+            if not codes:
+                return np.zeros(len(values), dtype=bool)
+            # One lookup per row into a table indexed by code (+1 for NULL)
+            hits = np.zeros(len(column.dictionary) + 1, dtype=bool)
+            hits[np.fromiter(codes, dtype=np.int64) + 1] = True
+            return hits[values + 1]
+
+        mask = np.zeros(len(values), dtype=bool)
+        for candidate in candidates:
+            if column.kind == "date":
+                mask |= values == np.datetime64(str(candidate), "D")
+            else:
+                mask |= values == float(candidate)
+        return mask
+
+    def _group_key(self, view: str, expression: str, mask: Optional[np.ndarray]):
+        """
+        Codes, number of codes, the label of each code and whether the key
+        is a date (so groups read best in time order) for a group-by key
+        """
+        function, name = _parse_function(expression)
+        if function is None and self.column(view, name).kind == "date":
+            function = "day"
+        column = self.column(view, f"{function}({name})" if function else name)
+        values = _select(column.values, mask)
+
+        if column.kind == "str":
+            # Code -1 (NULL) becomes group 0
+            labels = [None] + list(column.dictionary)
+            return values + 1, len(labels), labels, function in DATE_BUCKETS
+
+        missing = np.isnan(values) if column.kind == "float" else None
+        codes, size, uniques = _factorize(
+            np.where(missing, np.inf, values) if missing is not None else values
+        )
+        labels = [None if np.isinf(value) else value.item() for value in uniques]
+        return codes, size, labels, False
+
+    def run(self, query) -> dict:
+        """
+        Answer an analytics query
+
+        Args:
+            query: dict (or its JSON text) with
+                table: "patients" or "documents"
+                where: {column: condition}, see _condition
+                group_by: list of columns or day()/month()/year() of a date
+                metric: "count" or sum/avg/min/max(column)
+                limit: most groups returned (ANALYTICS_MAX_GROUPS by default)
+
+        Returns:
+            {"rows": [...], "groups": total groups, "matched": rows matched}
+
+        Raises:
+            ValueError: When the query names unknown tables, columns or
+                functions
+        """
+        if isinstance(query, str):
+            try:
+                query = json.loads(query)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Analytics query is not JSON: {query}") from e
+        if not isinstance(query, dict):
+            raise ValueError("Analytics query must be an object")
+
+        view = str(query.get("table", "patients")).lower()
+        if view not in ANALYTICS_VIEWS:
+            raise ValueError(
+                f"Unknown table '{view}'; use one of {list(ANALYTICS_VIEWS)}"
+            )
+        rows = self.snapshot.rows(ANALYTICS_VIEWS[view]["table"])
+
+        metric = str(query.get("metric", "count")).strip()
+        aggregate, metric_column = _parse_function(metric)
+        aggregate = aggregate or metric.lower()
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"Unknown metric '{metric}'")
+        if aggregate != "count" and not metric_column:
+            raise ValueError(
+                f"{aggregate} needs a column, e.g. {aggregate}(LengthOfStay)"
+            )
+
+        with metrics.timer("analytics.query"):
+            mask = None
+            for name, condition in (query.get("where") or {}).items():
+                condition_mask = self._condition(view, name, condition)
+                mask = condition_mask if mask is None else mask & condition_mask
+            matched = rows if mask is None else int(mask.sum())
+            if matched == rows:
+                mask = None
+
+            group_by = query.get("group_by") or []
+            if isinstance(group_by, str):
+                group_by = [group_by]
+
+            group = np.zeros(matched, dtype=np.int64)
+            size = 1
+            keys = []
+            for expression in group_by:
+                codes, key_size, labels, chronological = self._group_key(
+                    view, expression, mask
+                )
+                keys.append((str(expression), labels, key_size, chronological))
+                if len(keys) == 1:
+                    group = codes.astype(np.int64)
+                else:
+                    group = group * key_size + codes
+                size *= key_size
+
+            if size > DENSE_GROUP_LIMIT:
+                group_ids, group = np.unique(group, return_inverse=True)
+            else:
+                group_ids = None
+
+            bins = size if group_ids is None else len(group_ids)
+            if aggregate == "count":
+                counts = np.bincount(group, minlength=bins)
+                values = counts.astype(np.float64)
+            else:
+                measure = self.column(view, metric_column)
+                if measure.kind not in ("int", "float"):
+                    raise ValueError(
+                        f"{aggregate} needs a numeric column, not {metric_column}"
+                    )
+                numbers = _select(measure.values, mask).astype(np.float64, copy=False)
+                # Rows without a value (e.g. no discharge date) don't count
+                valid = ~np.isnan(numbers)
+                if not valid.all():
+                    group, numbers = group[valid], numbers[valid]
+                counts = np.bincount(group, minlength=bins)
+                if aggregate in ("sum", "avg"):
+                    sums = np.bincount(group, weights=numbers, minlength=bins)
+                    values = (
+                        sums if aggregate == "sum" else sums / np.maximum(counts, 1)
+                    )
+                else:
+                    start = np.inf if aggregate == "min" else -np.inf
+                    values = np.full(bins, start)
+                    reduce = np.minimum if aggregate == "min" else np.maximum
+                    reduce.at(values, group, numbers)
+
+            # An ungrouped query always answers, even when nothing matched
+            found = np.flatnonzero(counts) if keys else np.arange(1)
+            combined = found if group_ids is None else group_ids[found]
+            key_codes = []
+            for _, _, key_size, _ in reversed(keys):
+                combined, code = np.divmod(combined, key_size)
+                key_codes.insert(0, code)
+
+            # Time buckets read best in time order, everything else by size
+            time_keys = [
+                codes
+                for (_, _, _, chronological), codes in zip(keys, key_codes)
+                if chronological
+            ]
+            if time_keys:
+                order = np.lexsort(list(reversed(time_keys + key_codes)))
+            else:
+                order = np.argsort(-values[found], kind="stable")
+            limit = int(query.get("limit") or ANALYTICS_MAX_GROUPS)
+            order = order[: max(1, min(limit, ANALYTICS_MAX_GROUPS))]
+
+            result_rows = []
+            for position in order:
+                row = {
+                    expression: labels[key_codes[index][position]]
+                    for index, (expression, labels, _, _) in enumerate(keys)
+                }
+                value = float(values[found[position]])
+                if aggregate == "count":
+                    row[metric] = int(value)
+                else:
+                    row[metric] = round(value, 2) if counts[found[position]] else None
+                    row["rows"] = int(counts[found[position]])
+                result_rows.append(row)
+
+        metrics.increment("analytics.queries")
+        return {"rows": result_rows, "groups": int(found.size), "matched": matched}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def _refresh(directory: str) -> None:
+    try:
+        with metrics.timer("analytics.snapshot_build"), get_pool().connection() as (
+            conn,
+            cursor,
+        ):
+            path = build_snapshot(cursor, directory)
+        logging.getLogger(__name__).info(f"📊 Analytics snapshot written to {path}")
+    except Exception as e:
+        logging.getLogger(__name__).warning(
+            f"⚠️ Analytics snapshot build failed: {str(e)}"
+        )
+    finally:
+        _refreshing.clear()
+
+
+def _start_refresh(directory: str) -> None:
+    """Build a new snapshot on a background thread unless one is underway"""
+    if _refreshing.is_set():
+        return
+    _refreshing.set()
+    threading.Thread(
+        target=_refresh,
+        args=(directory,),
+        name="analytics-refresh",
+        daemon=True,
+    ).start()
+
+
+def get_analytics_engine(
+    directory: str = ANALYTICS_SNAPSHOT_DIR,
+) -> Optional[AnalyticsEngine]:
+    """
+    Return an engine over the newest snapshot
+
+    Processes on one host share the snapshot files. Snapshots are only
+    built by one background thread, so no request waits for a full table
+    read: until the first one exists this returns None, and afterwards a
+    stale snapshot keeps answering while its replacement is built.
+
+    Returns:
+        The engine, or None when disabled or no snapshot is built yet
+    """
+    global _engine
+    if not ANALYTICS_ENABLED:
+        return None
+
+    with _engine_lock:
+        snapshot = AnalyticsSnapshot.current(directory)
+        if snapshot is None:
+            _start_refresh(directory)
+            return None
+        if time.time() - snapshot.built_at > ANALYTICS_REFRESH_SECONDS:
+            _start_refresh(directory)
+
+        if _engine is None or _engine.snapshot.version != snapshot.version:
+            _engine = AnalyticsEngine(snapshot)
+        return _engine
+
+
+BENCH_QUERIES = {
+    "admissions per month by facility": {
+        "group_by": ["FacilityName", "month(AdmissionDate)"],
+        "where": {"AdmissionDate": {">=": "2023-01"}},
+    },
+    "average stay for pneumonia": {
+        "where": {"PrimaryDiagnosis": "~pneumonia"},
+        "metric": "avg(LengthOfStay)",
+    },
+    "patients per insurer": {"group_by": ["InsuranceCompany"]},
+    "oldest patient per physician": {
+        "group_by": ["AttendingPhysician"],
+        "metric": "max(Age)",
+    },
+    "document accuracy by type": {
+        "table": "documents",
+        "group_by": ["DocumentType"],
+        "metric": "avg(Accuracy)",
+    },
+}
+
+
+def _synthetic_snapshot(directory: str, rows: int, seed: int = 7) -> str:
+    """Write a snapshot of random patients and documents without a database"""
+    rng = np.random.default_rng(seed)
+    dictionaries = {
+        "Patients.PrimaryDiagnosis": [f"Diagnosis {i}" for i in range(400)]
+        + ["Pneumonia", "Community-acquired pneumonia"],
+        "Patients.AttendingPhysician": [f"Dr. Physician {i}" for i in range(2000)],
+        "Patients.FacilityName": [f"Facility {i}" for i in range(60)],
+        "Insurance.InsuranceCompany": [f"Insurer {i}" for i in range(40)],
+        "Documents.DocumentType": [f"Type {i}" for i in range(25)],
+        "Documents.ProcessingStatus": ["completed", "failed"],
+        "ProcessTable.Status": ["Processed", "Exception"],
+        "ProcessTable.Type": ["Auto", "Manual"],
+    }
+
+    def codes(name: str, count: int) -> np.ndarray:
+        return rng.integers(0, len(dictionaries[name]), count, dtype=np.int32)
+
+    admitted = np.datetime64("2020-01-01") + rng.integers(0, 1800, rows)
+    discharged = admitted + rng.integers(0, 30, rows)
+    discharged[rng.random(rows) < 0.05] = np.datetime64("NaT")
+    ids = np.arange(1, rows + 1, dtype=np.int64)
+    columns = {
+        "Patients": {
+            "PatientID": ids,
+            "DateOfBirth": np.datetime64("1930-01-01") + rng.integers(0, 33000, rows),
+            "PrimaryDiagnosis": codes("Patients.PrimaryDiagnosis", rows),
+            "AdmissionDate": admitted,
+            "DischargeDate": discharged,
+            "AttendingPhysician": codes("Patients.AttendingPhysician", rows),
+            "FacilityName": codes("Patients.FacilityName", rows),
+        },
+        "Insurance": {
+            "PatientID": ids,
+            "InsuranceCompany": codes("Insurance.InsuranceCompany", rows),
+        },
+        "Documents": {
+            "DocumentID": ids,
+            "DocumentType": codes("Documents.DocumentType", rows),
+            "ProcessingStatus": codes("Documents.ProcessingStatus", rows),
+            "CreatedDate": admitted,
+        },
+        "ProcessTable": {
+            "DocumentID": ids,
+            "Accuracy": rng.uniform(0.5, 1.0, rows),
+            "Status": codes("ProcessTable.Status", rows),
+            "Type": codes("ProcessTable.Type", rows),
+        },
+    }
+    return write_snapshot(directory, columns, dictionaries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark analytics queries on a synthetic snapshot"
+    )
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        path = _synthetic_snapshot(directory, args.rows)
+        print(
+            f"snapshot of {args.rows} rows written in {time.perf_counter() - started:.1f}s"
+        )
+
+        engine = AnalyticsEngine(AnalyticsSnapshot(path))
+        print(f"{'query':<34}{'first ms':>10}{'p50 ms':>9}{'groups':>8}")
+        for name, query in BENCH_QUERIES.items():
+            timings = []
+            for _ in range(args.repeat + 1):
+                started = time.perf_counter()
+                result = engine.run(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            # The first run maps the files and builds any lookup index
+            first, rest = timings[0], sorted(timings[1:])
+            print(
+                f"{name:<34}{first:>10.0f}{rest[len(rest) // 2]:>9.0f}"
+                f"{result['groups']:>8}"
+            )
@@ -5,6 +5,28 @@ from typing import Optional, Tuple
 
 import pymssql
 
+from shared import (
+    TracedCursor,
+    bounded_timeout,
+    remaining,
+    tracer,
+    whole_seconds,
+)
+
+DB_LOGIN_TIMEOUT_SECONDS = int(os.environ.get("DB_LOGIN_TIMEOUT_SECONDS", "60"))
+DB_QUERY_TIMEOUT_SECONDS = int(os.environ.get("DB_QUERY_TIMEOUT_SECONDS", "60"))
+
+
+def set_query_timeout(conn, seconds: float) -> None:
+    """
+    Set the query timeout of an open pymssql connection
+
+    pymssql applies it before each statement it sends on that connection.
+    """
+    raw = getattr(conn, "_conn", None)
+    if raw is not None and hasattr(raw, "query_timeout"):
+        raw.query_timeout = whole_seconds(seconds)
+
 
 class DatabaseConnection:
     """Manages database connections with retry logic"""
@@ -18,60 +40,79 @@ class DatabaseConnection:
         self.logger = logging.getLogger(__name__)
 
     def connect_with_retry(
-        self, max_retries: int = 5, retry_delay: int = 5
+        self, max_retries: int = 5, retry_delay: int = 5, autocommit: bool = False
     ) -> Tuple[Optional[object], Optional[object]]:
         """
         Connect to database with retry logic - exact same logic as original
 
+        Inside a request deadline the login timeout is cut to the budget left
+        and no retry is attempted once the delay alone would exceed it.
+
         Args:
             max_retries: Maximum number of connection attempts
             retry_delay: Delay between retries in seconds
+            autocommit: Open the connection in autocommit mode (read-only use)
 
         Returns:
-            Tuple of (connection, cursor) or (None, None) if failed
+            Tuple of (connection, cursor) or (None, None) if failed; the
+            cursor records a span per statement
         """
-        for attempt in range(max_retries):
-            try:
-                self.logger.info(
-                    f"🔄 Database connection attempt {attempt + 1}/{max_retries}"
-                )
-
-                # Connect with same parameters as original
-                conn = pymssql.connect(
-                    server=self.server,
-                    user=self.username,
-                    password=self.password,
-                    database=self.database,
-                    port=1433,
-                    timeout=60,  # Connection timeout
-                    login_timeout=60,  # Login timeout
-                    as_dict=True,
-                )
-
-                # Test the connection - same as original
-                cursor = conn.cursor()
-                cursor.execute("SELECT 1 as test_value")
-                result = cursor.fetchone()
-
-                if result and result["test_value"] == 1:
+        with tracer.start_span("db.connect") as span:
+            for attempt in range(max_retries):
+                try:
                     self.logger.info(
-                        f"✅ SQL Database connection successful on attempt {attempt + 1}!"
+                        f"🔄 Database connection attempt {attempt + 1}/{max_retries}"
                     )
-                    return conn, cursor
-                else:
-                    raise Exception("Connection test failed")
-
-            except Exception as e:
-                self.logger.warning(
-                    f"⚠️ Connection attempt {attempt + 1} failed: {str(e)}"
-                )
-                if attempt < max_retries - 1:
-                    self.logger.info(f"⏳ Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                else:
-                    self.logger.error(
-                        f"❌ All {max_retries} connection attempts failed"
+
+                    # Same parameters as original, bounded by the deadline
+                    login_timeout = bounded_timeout(
+                        DB_LOGIN_TIMEOUT_SECONDS, "db.connect"
+                    )
+                    conn = pymssql.connect(
+                        server=self.server,
+                        user=self.username,
+                        password=self.password,
+                        database=self.database,
+                        port=1433,
+                        timeout=whole_seconds(
+                            min(DB_QUERY_TIMEOUT_SECONDS, login_timeout)
+                        ),
+                        login_timeout=whole_seconds(login_timeout),
+                        as_dict=True,
+                        autocommit=autocommit,
+                    )
+
+                    # Test the connection - same as original
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT 1 as test_value")
+                    result = cursor.fetchone()
+
+                    if result and result["test_value"] == 1:
+                        span.set_attribute("db.attempts", attempt + 1)
+                        self.logger.info(
+                            f"✅ SQL Database connection successful on attempt {attempt + 1}!"
+                        )
+                        return conn, TracedCursor(cursor)
+                    else:
+                        raise Exception("Connection test failed")
+
+                except Exception as e:
+                    self.logger.warning(
+                        f"⚠️ Connection attempt {attempt + 1} failed: {str(e)}"
                     )
-                    raise e
+                    left = remaining()
+                    if left is not None and left <= retry_delay:
+                        self.logger.error(
+                            f"⏱️ No time left to retry the connection: {left:.1f}s"
+                        )
+                        raise e
+                    if attempt < max_retries - 1:
+                        self.logger.info(f"⏳ Retrying in {retry_delay} seconds...")
+                        time.sleep(retry_delay)
+                    else:
+                        self.logger.error(
+                            f"❌ All {max_retries} connection attempts failed"
+                        )
+                        raise e
 
         return None, None
@@ -0,0 +1,325 @@
+import argparse
+import base64
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+import tracemalloc
+import zlib
+from typing import Dict, Iterator, Optional
+
+from .schema import SchemaMigrator, to_sqlite
+
+EXPORT_PAGE_ROWS = int(os.environ.get("EXPORT_PAGE_ROWS", "50000"))
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "2000"))
+EXPORT_GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", "6"))
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Each dataset is read in key order, so a page resumes with "key > last
+# key" instead of an OFFSET that rescans everything before it. Filters use
+# the chat intent names; "all" means no filter, like in chat.
+EXPORT_DATASETS = {
+    "patients": {
+        "key": "PatientID",
+        "select": """
+            p.PatientID, p.PatientName, p.MedicalRecordNumber, p.DateOfBirth,
+            p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+            p.AttendingPhysician, p.FacilityName,
+            (SELECT MIN(i.InsuranceCompany) FROM Insurance i
+             WHERE i.PatientID = p.PatientID) as InsuranceCompany
+            """,
+        "from": "Patients p",
+        "key_column": "p.PatientID",
+        "filters": {
+            "patient_lookup": ("p.PatientName LIKE %s", True),
+            "mrn_lookup": ("p.MedicalRecordNumber = %s", False),
+            "diagnosis_search": ("p.PrimaryDiagnosis LIKE %s", True),
+            "physician_search": ("p.AttendingPhysician LIKE %s", True),
+            "facility_search": ("p.FacilityName LIKE %s", True),
+            "insurance_search": (
+                "EXISTS (SELECT 1 FROM Insurance i WHERE i.PatientID = p.PatientID "
+                "AND i.InsuranceCompany LIKE %s)",
+                True,
+            ),
+        },
+    },
+    "documents": {
+        "key": "DocumentID",
+        "select": """
+            d.DocumentID, d.Filename, d.DocumentType, d.ProcessingStatus,
+            d.CreatedDate,
+            (SELECT MIN(pd.PatientID) FROM PatientDocuments pd
+             WHERE pd.DocumentID = d.DocumentID) as PatientID
+            """,
+        "from": "Documents d",
+        "key_column": "d.DocumentID",
+        "filters": {
+            "document_search": ("(d.DocumentType LIKE %s OR d.Filename LIKE %s)", True),
+            "patient_lookup": (
+                "EXISTS (SELECT 1 FROM PatientDocuments pd "
+                "INNER JOIN Patients p ON p.PatientID = pd.PatientID "
+                "WHERE pd.DocumentID = d.DocumentID AND p.PatientName LIKE %s)",
+                True,
+            ),
+            "mrn_lookup": (
+                "EXISTS (SELECT 1 FROM PatientDocuments pd "
+                "INNER JOIN Patients p ON p.PatientID = pd.PatientID "
+                "WHERE pd.DocumentID = d.DocumentID AND p.MedicalRecordNumber = %s)",
+                False,
+            ),
+        },
+    },
+}
+
+
+def _filters_digest(dataset: str, filters: Dict[str, str]) -> str:
+    canonical = json.dumps([dataset, sorted(filters.items())])
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=6).hexdigest()
+
+
+class ExportPage:
+    """One keyset page of a dataset export, encoded batch by batch"""
+
+    def __init__(
+        self,
+        dataset: str,
+        filters: Optional[Dict[str, str]] = None,
+        export_format: str = "ndjson",
+        token: Optional[str] = None,
+        page_rows: int = EXPORT_PAGE_ROWS,
+        compress: bool = False,
+    ):
+        """
+        Validate the request and resolve where the page starts
+
+        Args:
+            dataset: "patients" or "documents"
+            filters: Chat intent name -> parameter
+            export_format: "ndjson" or "csv"
+            token: Resume token from the previous page (None for the first)
+            page_rows: Most rows in this page
+            compress: gzip the output as it is produced
+
+        Raises:
+            ValueError: On an unknown dataset, format or filter, or a token
+                issued for a different export
+        """
+        if dataset not in EXPORT_DATASETS:
+            raise ValueError(f"Unknown dataset '{dataset}'")
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown format '{export_format}'")
+
+        self.spec = EXPORT_DATASETS[dataset]
+        self.filters = {
+            name: value
+            for name, value in (filters or {}).items()
+            if value and str(value).lower() != "all"
+        }
+        unknown = set(self.filters) - set(self.spec["filters"])
+        if unknown:
+            raise ValueError(f"Unsupported filters for {dataset}: {sorted(unknown)}")
+
+        self.dataset = dataset
+        self.export_format = export_format
+        self.page_rows = max(1, int(page_rows))
+        self.compress = compress
+        self.digest = _filters_digest(dataset, self.filters)
+        self.after_key = self._decode_token(token) if token else 0
+        self.rows = 0
+        self.last_key = self.after_key
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def content_type(self) -> str:
+        return EXPORT_FORMATS[self.export_format]
+
+    def _decode_token(self, token: str) -> int:
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+            after_key = int(state["k"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError("Malformed export token") from e
+        if state.get("f") != self.digest:
+            raise ValueError("Export token belongs to a different dataset or filters")
+        return after_key
+
+    @property
+    def next_token(self) -> Optional[str]:
+        """Token for the following page, or None when this was the last one"""
+        if self.rows < self.page_rows:
+            return None
+        state = json.dumps({"k": self.last_key, "f": self.digest})
+        return base64.urlsafe_b64encode(state.encode("ascii")).decode("ascii")
+
+    def query(self) -> tuple:
+        """Return the page's (sql, params)"""
+        conditions = [f"{self.spec['key_column']} > %s"]
+        params = [self.after_key]
+        for name, value in sorted(self.filters.items()):
+            condition, like = self.spec["filters"][name]
+            conditions.append(condition)
+            params.extend([f"%{value}%" if like else value] * condition.count("%s"))
+
+        sql = (
+            f"SELECT TOP {self.page_rows} {self.spec['select']}"
+            f" FROM {self.spec['from']}"
+            f" WHERE {' AND '.join(conditions)}"
+            f" ORDER BY {self.spec['key_column']}"
+        )
+        return sql, tuple(params)
+
+    def chunks(self, cursor) -> Iterator[bytes]:
+        """
+        Run the page query and yield encoded output one fetch batch at a time
+
+        Only one batch of rows is held at once; rows, last_key and
+        next_token are up to date once the iterator is exhausted.
+        """
+        sql, params = self.query()
+        cursor.execute(sql, params)
+
+        compressor = (
+            zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+            if self.compress
+            else None
+        )
+        key = self.spec["key"]
+        buffer = io.StringIO()
+        writer = None
+
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+
+            if self.export_format == "csv":
+                if writer is None:
+                    writer = csv.DictWriter(
+                        buffer, fieldnames=list(rows[0]), lineterminator="\n"
+                    )
+                    # Pages are concatenated, so only the first has a header
+                    if not self.after_key:
+                        writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(row, default=str, separators=(",", ":")))
+                    buffer.write("\n")
+
+            self.rows += len(rows)
+            self.last_key = rows[-1][key]
+
+            chunk = buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            yield compressor.compress(chunk) if compressor else chunk
+
+        if compressor:
+            yield compressor.flush()
+
+        self.logger.info(
+            f"📤 Exported {self.rows} {self.dataset} rows after key {self.after_key}"
+        )
+
+
+class _StandInCursor:
+    """pymssql-style dict cursor over the SQLite stand-in"""
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, query: str, params: tuple = ()) -> None:
+        self.cursor.execute(to_sqlite(query), params)
+
+    def fetchmany(self, size: int) -> list:
+        return [dict(row) for row in self.cursor.fetchmany(size)]
+
+
+def _build_stand_in(patients: int):
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    SchemaMigrator(conn, conn.cursor(), dialect="sqlite").migrate()
+    conn.executemany(
+        "INSERT INTO Patients (PatientID, PatientName, MedicalRecordNumber, "
+        "DateOfBirth, PrimaryDiagnosis, AttendingPhysician, FacilityName) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                patient_id,
+                f"Patient {patient_id}",
+                f"MRN{100000 + patient_id}",
+                "1970-01-15",
+                ("Hypertension", "Type 2 Diabetes", "Asthma")[patient_id % 3],
+                "Dr. Smith",
+                "General Hospital",
+            )
+            for patient_id in range(1, patients + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO Insurance (PatientID, InsuranceCompany) VALUES (?, ?)",
+        ((patient_id, "Aetna") for patient_id in range(1, patients + 1)),
+    )
+    conn.commit()
+    return conn
+
+
+def _bench_export(conn, export_format: str, compress: bool, page_rows: int) -> dict:
+    cursor = _StandInCursor(conn)
+    rows = size = pages = 0
+    token = None
+    start = time.perf_counter()
+    while True:
+        page = ExportPage(
+            "patients",
+            export_format=export_format,
+            token=token,
+            page_rows=page_rows,
+            compress=compress,
+        )
+        for chunk in page.chunks(cursor):
+            size += len(chunk)
+        rows += page.rows
+        pages += 1
+        token = page.next_token
+        if token is None:
+            break
+    seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "pages": pages,
+        "mb": round(size / 1e6, 1),
+        "seconds": round(seconds, 2),
+        "rows_per_second": round(rows / seconds) if seconds else 0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark paged exports against the SQLite stand-in"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page-rows", type=int, default=EXPORT_PAGE_ROWS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    stand_in = _build_stand_in(args.rows)
+    print(f"{'format':<12}{'rows/s':>10}{'seconds':>9}{'MB':>8}{'peak MB':>9}")
+    for export_format in EXPORT_FORMATS:
+        for compress in (False, True):
+            result = _bench_export(stand_in, export_format, compress, args.page_rows)
+            # Traced separately since tracemalloc slows the export several-fold
+            tracemalloc.start()
+            _bench_export(stand_in, export_format, compress, args.page_rows)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            label = export_format + ("+gzip" if compress else "")
+            print(
+                f"{label:<12}{result['rows_per_second']:>10}{result['seconds']:>9}"
+                f"{result['mb']:>8}{peak / 1e6:>9.1f}"
+            )
@@ -0,0 +1,485 @@
+import argparse
+import logging
+import math
+import os
+import random
+import string
+import threading
+import time
+from typing import Iterable, Optional, Set, Tuple
+
+import numpy as np
+
+from shared import metrics
+
+from .name_index import normalize_tokens
+from .pool import get_pool
+
+LOOKUP_FILTER_ENABLED = (
+    os.environ.get("LOOKUP_FILTER_ENABLED", "true").lower() == "true"
+)
+LOOKUP_FILTER_FP_RATE = float(os.environ.get("LOOKUP_FILTER_FP_RATE", "0.01"))
+# Upper bound per filter; a larger table gets a higher false-positive rate
+LOOKUP_FILTER_MAX_BYTES = int(os.environ.get("LOOKUP_FILTER_MAX_BYTES", str(8 << 20)))
+LOOKUP_FILTER_REFRESH_SECONDS = float(
+    os.environ.get("LOOKUP_FILTER_REFRESH_SECONDS", "60")
+)
+LOOKUP_FILTER_REBUILD_SECONDS = float(
+    os.environ.get("LOOKUP_FILTER_REBUILD_SECONDS", "3600")
+)
+# Recently linked IDs are re-read each refresh, since a transaction holding
+# a lower DocumentID can commit after a higher one has already been seen
+LOOKUP_FILTER_OVERLAP_IDS = int(os.environ.get("LOOKUP_FILTER_OVERLAP_IDS", "50"))
+
+# Room for patients added between rebuilds before the rate degrades
+CAPACITY_HEADROOM = 1.25
+
+# Name tokens are indexed with all their substrings of at least this length,
+# since the name query is LIKE '%name%'; shorter query tokens are not checked
+MIN_TOKEN_LENGTH = 3
+
+# LIKE wildcards in a name make the token check meaningless
+LIKE_WILDCARDS = set("%_[")
+
+MASK_64 = (1 << 64) - 1
+
+LOAD_WATERMARK_QUERY = """
+    SELECT (SELECT MAX(DocumentID) FROM PatientDocuments) as watermark,
+        (SELECT MAX(ChangeID) FROM ChangeLog) as change_watermark
+    """
+
+LOAD_PATIENTS_QUERY = """
+    SELECT MedicalRecordNumber, PatientName FROM Patients
+    WHERE MedicalRecordNumber IS NOT NULL OR PatientName IS NOT NULL
+    """
+
+# Upserts link every ingested document to its patient, so this also picks
+# up names and MRNs filled in on existing rows by other workers
+LOAD_CHANGED_PATIENTS_QUERY = """
+    SELECT p.MedicalRecordNumber, p.PatientName, pd.DocumentID
+    FROM PatientDocuments pd
+    INNER JOIN Patients p ON p.PatientID = pd.PatientID
+    WHERE pd.DocumentID > %s
+    """
+
+# Patients rewritten in place on documents already linked, by re-extraction
+LOAD_REWRITTEN_PATIENTS_QUERY = """
+    SELECT p.MedicalRecordNumber, p.PatientName, c.ChangeID
+    FROM ChangeLog c
+    INNER JOIN Patients p ON p.PatientID = c.PatientID
+    WHERE c.ChangeID > %s
+    """
+
+
+def normalize_mrn(mrn) -> str:
+    """MRN as SQL Server compares it: case-insensitive, trailing spaces ignored"""
+    return str(mrn).rstrip().upper()
+
+
+def name_keys(name) -> Set[str]:
+    """Every substring of at least MIN_TOKEN_LENGTH of each name token"""
+    keys = set()
+    for token in normalize_tokens(name):
+        for start in range(len(token) - MIN_TOKEN_LENGTH + 1):
+            for end in range(start + MIN_TOKEN_LENGTH, len(token) + 1):
+                keys.add(token[start:end])
+    return keys
+
+
+class BloomFilter:
+    """
+    Bloom filter over strings, sized for a capacity and false-positive rate
+
+    Positions come from the built-in str hash, which is salted per
+    process, so a filter is only meaningful inside the worker that built it.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        fp_rate: float = LOOKUP_FILTER_FP_RATE,
+        max_bytes: int = LOOKUP_FILTER_MAX_BYTES,
+    ):
+        """
+        Initialize an empty filter
+
+        Args:
+            capacity: Distinct items expected
+            fp_rate: Target false-positive rate at capacity
+            max_bytes: Memory cap, taking precedence over fp_rate
+        """
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        self.size = max(64, min(bits, max_bytes * 8))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def _positions(self, item: str):
+        value = hash(item) & MASK_64
+        low, step = value & 0xFFFFFFFF, (value >> 32) | 1
+        return ((low + i * step) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def add_many(self, items: Iterable[str]) -> int:
+        """Add items in one vectorized pass; duplicates are counted once"""
+        values = np.unique(
+            np.fromiter((hash(item) for item in items), dtype=np.int64).view(np.uint64)
+        )
+        if not len(values):
+            return 0
+        low = values & np.uint64(0xFFFFFFFF)
+        step = (values >> np.uint64(32)) | np.uint64(1)
+
+        view = np.frombuffer(self._bits, dtype=np.uint8)
+        flags = np.unpackbits(view, bitorder="little")
+        for i in range(self.hashes):
+            flags[(low + np.uint64(i) * step) % np.uint64(self.size)] = 1
+        view[:] = np.packbits(flags, bitorder="little")
+        self.count += len(values)
+        return len(values)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def expected_fp_rate(self) -> float:
+        """False-positive rate expected with the items added so far"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class PatientLookupFilter:
+    """Per-worker filters that rule out MRNs and names with no patient"""
+
+    def __init__(
+        self,
+        fp_rate: float = LOOKUP_FILTER_FP_RATE,
+        max_bytes: int = LOOKUP_FILTER_MAX_BYTES,
+        overlap_ids: int = LOOKUP_FILTER_OVERLAP_IDS,
+    ):
+        """
+        Initialize an unbuilt filter, which answers "maybe" to everything
+
+        Args:
+            fp_rate: Target false-positive rate of each filter
+            max_bytes: Memory cap of each filter
+            overlap_ids: DocumentIDs below the watermark re-read on each refresh
+        """
+        self.fp_rate = fp_rate
+        self.max_bytes = max_bytes
+        self.overlap_ids = overlap_ids
+        self.mrns: Optional[BloomFilter] = None
+        self.names: Optional[BloomFilter] = None
+        # Highest PatientDocuments.DocumentID and ChangeLog.ChangeID folded in
+        self.watermark = 0
+        self.change_watermark = 0
+        self.last_build = None
+        self.last_refresh = None
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._rebuilding = False
+
+    @property
+    def ready(self) -> bool:
+        return self.mrns is not None
+
+    def load(
+        self, patients: Iterable[Tuple], watermark: int = 0, change_watermark: int = 0
+    ) -> int:
+        """
+        Replace both filters with ones built from (mrn, name) pairs
+
+        Returns:
+            Number of patients read
+        """
+        mrns, names, read = set(), [], 0
+        for mrn, name in patients:
+            if mrn:
+                mrns.add(mrn)
+            if name:
+                names.append(name)
+            read += 1
+        mrns = {normalize_mrn(mrn) for mrn in mrns}
+        # Normalization works character by character, so one pass over all
+        # names joined yields the same tokens as one pass per name
+        tokens = set(normalize_tokens(" ".join(names)))
+
+        keys = set()
+        for token in tokens:
+            keys |= name_keys(token)
+
+        mrn_filter = BloomFilter(
+            int(len(mrns) * CAPACITY_HEADROOM) + 1000, self.fp_rate, self.max_bytes
+        )
+        mrn_filter.add_many(mrns)
+        name_filter = BloomFilter(
+            int(len(keys) * CAPACITY_HEADROOM) + 1000, self.fp_rate, self.max_bytes
+        )
+        name_filter.add_many(keys)
+
+        with self._lock:
+            self.mrns, self.names = mrn_filter, name_filter
+            self.watermark = watermark
+            self.change_watermark = change_watermark
+            self.last_build = self.last_refresh = time.monotonic()
+        self._report()
+        self.logger.info(
+            f"🧮 Lookup filter built from {read} patients: {len(mrns)} MRNs, "
+            f"{len(keys)} name keys, {(mrn_filter.nbytes + name_filter.nbytes) / 1e6:.1f} MB"
+        )
+        return read
+
+    def build(self) -> int:
+        """
+        Rebuild both filters from every Patients row
+
+        Inserts linked while the table is read are picked up by the
+        refresh that follows.
+
+        Returns:
+            Number of patients read
+        """
+        with metrics.timer("lookup_filter.build"):
+            with get_pool().connection() as (conn, cursor):
+                cursor.execute(LOAD_WATERMARK_QUERY)
+                row = cursor.fetchone() or {}
+                watermark = int(row.get("watermark") or 0)
+                change_watermark = int(row.get("change_watermark") or 0)
+
+                cursor.execute(LOAD_PATIENTS_QUERY)
+                patients = []
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    patients.extend(
+                        (row["MedicalRecordNumber"], row["PatientName"]) for row in rows
+                    )
+            read = self.load(patients, watermark, change_watermark)
+        metrics.increment("lookup_filter.builds")
+        self.refresh()
+        return read
+
+    def add(self, mrn, name) -> None:
+        """Fold in a patient, skipping keys already set so re-reads don't count"""
+        with self._lock:
+            if not self.ready:
+                return
+            if mrn and normalize_mrn(mrn) not in self.mrns:
+                self.mrns.add(normalize_mrn(mrn))
+            for key in name_keys(name):
+                if key not in self.names:
+                    self.names.add(key)
+
+    def refresh(self) -> int:
+        """
+        Fold in patients linked or rewritten since the last refresh
+
+        The last overlap_ids IDs are read again, so a row that committed
+        after a higher one was seen is not missed.
+
+        Returns:
+            Number of patient rows read
+        """
+        with self._lock, metrics.timer("lookup_filter.refresh"):
+            if not self.ready:
+                return 0
+            started = time.monotonic()
+            with get_pool().connection() as (conn, cursor):
+                read, self.watermark = self._fold_in(
+                    cursor, LOAD_CHANGED_PATIENTS_QUERY, "DocumentID", self.watermark
+                )
+                rewritten, self.change_watermark = self._fold_in(
+                    cursor,
+                    LOAD_REWRITTEN_PATIENTS_QUERY,
+                    "ChangeID",
+                    self.change_watermark,
+                )
+                read += rewritten
+            self.last_refresh = started
+            self._report()
+            return read
+
+    def _fold_in(self, cursor, query: str, id_column: str, watermark: int) -> tuple:
+        """Add the patients query returns above watermark, less the overlap"""
+        cursor.execute(query, (max(watermark - self.overlap_ids, 0),))
+        read = 0
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for row in rows:
+                self.add(row["MedicalRecordNumber"], row["PatientName"])
+                watermark = max(watermark, int(row[id_column]))
+            read += len(rows)
+        return read, watermark
+
+    def _rebuild_in_background(self) -> None:
+        try:
+            self.build()
+        except Exception as e:
+            self.logger.warning(f"⚠️ Lookup filter build failed: {str(e)}")
+        finally:
+            self._rebuilding = False
+
+    def _start_rebuild(self) -> None:
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(
+            target=self._rebuild_in_background,
+            name="lookup-filter-build",
+            daemon=True,
+        ).start()
+
+    def _ensure_fresh(self) -> bool:
+        """
+        Keep the filters current
+
+        Builds and rebuilds run in the background, so lookups never wait
+        for a full table read; until the first build finishes every
+        answer is "maybe".
+
+        Returns:
+            True when the filters can be consulted
+        """
+        if not self.ready:
+            self._start_rebuild()
+            return False
+        now = time.monotonic()
+        if now - self.last_build > LOOKUP_FILTER_REBUILD_SECONDS:
+            self._start_rebuild()
+        if now - self.last_refresh > LOOKUP_FILTER_REFRESH_SECONDS:
+            self.refresh()
+        return True
+
+    def check_mrn(self, mrn) -> Optional[bool]:
+        """
+        Whether a patient may have this MRN
+
+        Returns:
+            False when none does, True when one may, None when the filter
+            cannot tell yet
+        """
+        if not str(mrn or "").strip() or not self._ensure_fresh():
+            return None
+        return normalize_mrn(mrn) in self.mrns
+
+    def check_name(self, name) -> Optional[bool]:
+        """
+        Whether a PatientName may contain this name, as LIKE '%name%' would
+
+        Returns:
+            False when none can, True when one may, None when the filter
+            cannot tell (not built yet, LIKE wildcards, only short tokens)
+        """
+        text = str(name or "")
+        if LIKE_WILDCARDS & set(text):
+            return None
+        tokens = [
+            token for token in normalize_tokens(text) if len(token) >= MIN_TOKEN_LENGTH
+        ]
+        if not tokens or not self._ensure_fresh():
+            return None
+        return all(token in self.names for token in tokens)
+
+    def _report(self) -> None:
+        for label, bloom in (("mrns", self.mrns), ("names", self.names)):
+            metrics.gauge(f"lookup_filter.{label}.bytes", bloom.nbytes)
+            metrics.gauge(f"lookup_filter.{label}.entries", bloom.count)
+            metrics.gauge(
+                f"lookup_filter.{label}.expected_fp_rate",
+                round(bloom.expected_fp_rate(), 5),
+            )
+
+
+metrics.register_ratio(
+    "lookup_filter.fp_rate", "lookup_filter.false_positives", "lookup_filter.absent"
+)
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_lookup_filter(create: bool = True) -> Optional[PatientLookupFilter]:
+    """
+    Return the worker-wide lookup filter
+
+    Args:
+        create: Create it if this worker has none yet (False only peeks)
+
+    Returns:
+        The filter, or None when LOOKUP_FILTER_ENABLED is off
+    """
+    global _filter
+    if not LOOKUP_FILTER_ENABLED:
+        return None
+    with _filter_lock:
+        if _filter is None and create:
+            _filter = PatientLookupFilter()
+        return _filter
+
+
+def _synthetic_patients(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    first = ["".join(rng.choices(string.ascii_uppercase, k=6)) for _ in range(3000)]
+    last = ["".join(rng.choices(string.ascii_uppercase, k=8)) for _ in range(20000)]
+    return [
+        (f"MRN{100000 + number}", f"{rng.choice(first)} {rng.choice(last)}")
+        for number in range(count)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the lookup filter over synthetic patients and measure it"
+    )
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--probes", type=int, default=100_000)
+    parser.add_argument("--fp-rate", type=float, default=LOOKUP_FILTER_FP_RATE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    patients = _synthetic_patients(args.patients)
+    lookup_filter = PatientLookupFilter(fp_rate=args.fp_rate)
+    start = time.perf_counter()
+    lookup_filter.load(patients)
+    build_seconds = time.perf_counter() - start
+
+    # Probes that should not exist: MRNs outside the range and random 7-letter
+    # tokens, which virtually never occur inside the synthetic names
+    rng = random.Random(11)
+    missing_mrns = [f"MRN{900000000 + number}" for number in range(args.probes)]
+    missing_names = [
+        "".join(rng.choices(string.ascii_uppercase, k=7)) for _ in range(args.probes)
+    ]
+
+    start = time.perf_counter()
+    mrn_fp = sum(normalize_mrn(mrn) in lookup_filter.mrns for mrn in missing_mrns)
+    name_fp = sum(name in lookup_filter.names for name in missing_names)
+    probe_us = (time.perf_counter() - start) / (len(missing_mrns) + len(missing_names))
+
+    print(f"patients          {args.patients}")
+    print(f"build             {build_seconds:.1f} s")
+    print(f"probe             {probe_us * 1e6:.2f} us")
+    for label, bloom, false_positives, probes in (
+        ("mrns", lookup_filter.mrns, mrn_fp, len(missing_mrns)),
+        ("names", lookup_filter.names, name_fp, len(missing_names)),
+    ):
+        print(
+            f"{label:<6} {bloom.count:>9} entries {bloom.nbytes / 1e6:>6.1f} MB "
+            f"k={bloom.hashes} expected fp {bloom.expected_fp_rate():.4f} "
+            f"measured fp {false_positives / max(1, probes):.4f}"
+        )
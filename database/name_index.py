@@ -0,0 +1,433 @@
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from shared import metrics
+
+from .pool import get_pool
+
+try:
+    from metaphone import doublemetaphone
+except ImportError:  # pragma: no cover - Soundex is used instead
+    doublemetaphone = None
+
+NAME_INDEX_ENABLED = os.environ.get("NAME_INDEX_ENABLED", "true").lower() == "true"
+NAME_INDEX_REFRESH_SECONDS = float(os.environ.get("NAME_INDEX_REFRESH_SECONDS", "60"))
+NAME_INDEX_MAX_DISTANCE = int(os.environ.get("NAME_INDEX_MAX_DISTANCE", "2"))
+NAME_INDEX_TOP_K = int(os.environ.get("NAME_INDEX_TOP_K", "5"))
+NAME_INDEX_MIN_SCORE = float(os.environ.get("NAME_INDEX_MIN_SCORE", "0.6"))
+NAME_INDEX_OVERLAP_IDS = int(os.environ.get("NAME_INDEX_OVERLAP_IDS", "50"))
+
+# Characters OCR commonly reads in place of letters in names
+OCR_CONFUSABLES = str.maketrans(
+    {"0": "O", "1": "I", "2": "Z", "3": "E", "4": "A", "5": "S", "6": "G", "8": "B", "|": "I"}
+)
+
+# SymSpell only indexes deletes within this prefix, bounding memory for
+# long tokens; the full token is still verified with the real distance
+PREFIX_LENGTH = 7
+
+# Query tokens whose matches are remembered until a new token is indexed
+MATCH_CACHE_SIZE = 4096
+
+# Score for a token that only shares a phonetic key with the query token
+PHONETIC_SCORE = 0.7
+
+LOAD_PATIENT_NAMES_QUERY = """
+    SELECT PatientID, PatientName FROM Patients
+    WHERE PatientID > %s AND PatientName IS NOT NULL
+    """
+
+LOAD_CHANGE_WATERMARK_QUERY = "SELECT MAX(ChangeID) as ChangeID FROM ChangeLog"
+
+# Patients renamed in place by an ingest merge or re-extraction
+LOAD_RENAMED_PATIENTS_QUERY = """
+    SELECT p.PatientID, p.PatientName, c.ChangeID
+    FROM ChangeLog c
+    INNER JOIN Patients p ON p.PatientID = c.PatientID
+    WHERE c.ChangeID > %s AND p.PatientName IS NOT NULL
+    """
+
+
+def normalize_tokens(name: str) -> List[str]:
+    """Uppercase name tokens with OCR digit confusions and punctuation removed"""
+    text = str(name or "").upper().translate(OCR_CONFUSABLES)
+    return re.sub(r"[^A-Z\s]", " ", text).split()
+
+
+def _soundex(token: str) -> str:
+    """Classic Soundex, the fallback when the metaphone package is missing"""
+    codes = {
+        **dict.fromkeys("BFPV", "1"),
+        **dict.fromkeys("CGJKQSXZ", "2"),
+        **dict.fromkeys("DT", "3"),
+        "L": "4",
+        **dict.fromkeys("MN", "5"),
+        "R": "6",
+    }
+    key = token[0]
+    previous = codes.get(token[0], "")
+    for char in token[1:]:
+        code = codes.get(char, "")
+        if code and code != previous:
+            key += code
+        if char not in "HW":
+            previous = code
+    return (key + "000")[:4]
+
+
+def phonetic_keys(token: str) -> Set[str]:
+    """Double Metaphone keys of a token, or its Soundex code as a fallback"""
+    if not token:
+        return set()
+    if doublemetaphone is not None:
+        return {key for key in doublemetaphone(token) if key}
+    return {_soundex(token)}
+
+
+def _deletes(token: str, max_distance: int) -> Dict[str, int]:
+    """
+    Strings reachable from the token prefix by up to max_distance deletes
+
+    Returns:
+        Mapping of each variant to the fewest deletes that reach it
+    """
+    results = {token[:PREFIX_LENGTH]: 0}
+    frontier = set(results)
+    for distance in range(1, max_distance + 1):
+        frontier = {
+            word[:i] + word[i + 1 :] for word in frontier for i in range(len(word))
+        }
+        for variant in frontier:
+            results.setdefault(variant, distance)
+    return results
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance, or limit + 1 once it is exceeded
+
+    Only the diagonal band of width 2 * limit + 1 is computed, since cells
+    outside it already cost more than limit.
+    """
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+
+    over = limit + 1
+    before = None
+    previous = [j if j <= limit else over for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        char_a = a[i - 1]
+        current = [over] * (len_b + 1)
+        if i <= limit:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - limit), min(len_b, i + limit) + 1):
+            char_b = b[j - 1]
+            value = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if (
+                before is not None
+                and j > 1
+                and char_a == b[j - 2]
+                and a[i - 2] == char_b
+                and before[j - 2] + 1 < value
+            ):
+                value = before[j - 2] + 1
+            current[j] = value if value < over else over
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return over
+        before, previous = previous, current
+    return previous[len_b]
+
+
+class NameIndex:
+    """Typo, OCR and sound-alike tolerant lookup of patient names"""
+
+    def __init__(
+        self,
+        max_distance: int = NAME_INDEX_MAX_DISTANCE,
+        overlap_ids: int = NAME_INDEX_OVERLAP_IDS,
+    ):
+        """
+        Initialize an empty index
+
+        Args:
+            max_distance: Largest edit distance a token match may have
+            overlap_ids: IDs below each watermark re-read on each refresh
+        """
+        self.max_distance = max_distance
+        self.overlap_ids = overlap_ids
+        # Highest PatientID read by refresh; local adds leave it alone, so
+        # lower IDs other workers commit meanwhile are still read
+        self.watermark = 0
+        # Highest ChangeLog.ChangeID read, None until the first refresh
+        self.change_watermark = None
+        self.last_refresh = None
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.RLock()
+        self._names: Dict[int, Tuple[str, Tuple[str, ...]]] = {}
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._deletes: Dict[str, Set[str]] = defaultdict(set)
+        self._phonetic: Dict[str, Set[str]] = defaultdict(set)
+        self._match_cache: Dict[str, Dict[str, float]] = {}
+        self._loading = False
+
+    @property
+    def ready(self) -> bool:
+        return self.last_refresh is not None
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, patient_id: int) -> bool:
+        return patient_id in self._names
+
+    def _index_token(self, token: str) -> None:
+        # Cached query matches may be missing the new token
+        self._match_cache.clear()
+        for variant in _deletes(token, self.max_distance):
+            self._deletes[variant].add(token)
+        for key in phonetic_keys(token):
+            self._phonetic[key].add(token)
+
+    def add(self, patient_id: int, name: str) -> None:
+        """Index one patient name, replacing the one indexed before if it changed"""
+        tokens = tuple(normalize_tokens(name))
+        if not tokens:
+            return
+        with self._lock:
+            if patient_id in self._names:
+                previous, previous_tokens = self._names[patient_id]
+                if previous == name:
+                    return
+                for token in set(previous_tokens):
+                    self._postings[token].remove(patient_id)
+            self._names[patient_id] = (name, tokens)
+            for token in set(tokens):
+                if token not in self._postings:
+                    self._index_token(token)
+                self._postings[token].append(patient_id)
+
+    def add_many(self, rows: Iterable[dict]) -> int:
+        added = 0
+        for row in rows:
+            patient_id = int(row["PatientID"])
+            self.add(patient_id, row["PatientName"])
+            self.watermark = max(self.watermark, patient_id)
+            added += 1
+        return added
+
+    def refresh(self) -> int:
+        """
+        Index patients inserted or renamed since the last refresh
+
+        The last overlap_ids IDs are read again, so a row that committed
+        after a higher one was seen is still picked up.
+
+        Returns:
+            Number of names read from the database
+        """
+        with self._lock, metrics.timer("name_index.refresh"):
+            started = time.monotonic()
+            added = 0
+            with get_pool().connection() as (conn, cursor):
+                if self.change_watermark is None:
+                    # The full load below already has every current name
+                    cursor.execute(LOAD_CHANGE_WATERMARK_QUERY)
+                    row = cursor.fetchone()
+                    self.change_watermark = int(row["ChangeID"] or 0) if row else 0
+                else:
+                    cursor.execute(
+                        LOAD_RENAMED_PATIENTS_QUERY,
+                        (max(self.change_watermark - self.overlap_ids, 0),),
+                    )
+                    for row in cursor.fetchall():
+                        self.add(int(row["PatientID"]), row["PatientName"])
+                        self.change_watermark = max(
+                            self.change_watermark, int(row["ChangeID"])
+                        )
+                        added += 1
+
+                cursor.execute(
+                    LOAD_PATIENT_NAMES_QUERY,
+                    (max(self.watermark - self.overlap_ids, 0),),
+                )
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    added += self.add_many(rows)
+            self.last_refresh = started
+            self.logger.info(
+                f"🔤 Name index refreshed with {added} names ({len(self)} total)"
+            )
+            return added
+
+    def _load_in_background(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            self.logger.warning(f"⚠️ Name index load failed: {str(e)}")
+        finally:
+            self._loading = False
+
+    def _start_load(self) -> None:
+        with self._lock:
+            if self._loading or self.ready:
+                return
+            self._loading = True
+        threading.Thread(
+            target=self._load_in_background, name="name-index-load", daemon=True
+        ).start()
+
+    def _ensure_fresh(self) -> bool:
+        """
+        Keep the index current
+
+        The first load reads every name, so it runs in the background and
+        searches find nothing until it finishes; later refreshes only read
+        what changed and run inline.
+
+        Returns:
+            True when the index can be searched
+        """
+        if not self.ready:
+            self._start_load()
+            return False
+        if time.monotonic() - self.last_refresh > NAME_INDEX_REFRESH_SECONDS:
+            self.refresh()
+        return True
+
+    def _token_matches(self, query_token: str) -> Dict[str, float]:
+        """Indexed tokens close to a query token, with a 0-1 similarity"""
+        cached = self._match_cache.get(query_token)
+        if cached is not None:
+            return cached
+
+        # Short tokens tolerate fewer edits, or "DOE" would match half the index
+        limit = min(self.max_distance, 1 if len(query_token) <= 5 else 2)
+        matches = {}
+
+        # Deletes on both sides bound the distance from above; a bound of 0
+        # or 1 is exact, anything else still needs the real distance
+        bounds = {}
+        for variant, query_deletes in _deletes(query_token, limit).items():
+            for token in self._deletes.get(variant, ()):
+                index_deletes = min(len(token), PREFIX_LENGTH) - len(variant)
+                if index_deletes > limit or abs(len(token) - len(query_token)) > limit:
+                    continue
+                bound = query_deletes + index_deletes
+                if bound < bounds.get(token, limit + 2):
+                    bounds[token] = bound
+
+        exact_bounds = max(len(query_token), PREFIX_LENGTH) == PREFIX_LENGTH
+        for token, bound in bounds.items():
+            if bound <= 1 and exact_bounds and len(token) <= PREFIX_LENGTH:
+                distance = bound
+            else:
+                distance = edit_distance(query_token, token, limit)
+            if distance <= limit:
+                matches[token] = 1 - distance / max(len(query_token), len(token))
+
+        for key in phonetic_keys(query_token):
+            for token in self._phonetic.get(key, ()):
+                # Sound-alikes of very different length are rarely misspellings
+                if abs(len(token) - len(query_token)) <= 2:
+                    matches[token] = max(matches.get(token, 0), PHONETIC_SCORE)
+
+        if len(self._match_cache) >= MATCH_CACHE_SIZE:
+            self._match_cache.clear()
+        self._match_cache[query_token] = matches
+        return matches
+
+    def search(
+        self, name: str, k: int = NAME_INDEX_TOP_K, min_score: float = NAME_INDEX_MIN_SCORE
+    ) -> List[dict]:
+        """
+        Return the top-k patients whose name best matches the query
+
+        Each query token is matched to indexed tokens by edit distance
+        (SymSpell deletes) and phonetic key. A name scores the mean of the
+        best match for each query token, lightly penalized for extra tokens.
+
+        Returns:
+            [{"patient_id", "name", "score"}] ordered by descending score,
+            empty until the first load has finished
+        """
+        query_tokens = normalize_tokens(name)
+        if not query_tokens or not self._ensure_fresh():
+            return []
+
+        with self._lock, metrics.timer("name_index.search"):
+            token_matches = [self._token_matches(token) for token in query_tokens]
+
+            # Patients matching every query token are found with set
+            # intersections; partial matches are only considered from the
+            # rarest token, so a common first name can't flood the scorer
+            token_sets = []
+            for matches in token_matches:
+                patients = set()
+                for token in matches:
+                    patients.update(self._postings[token])
+                token_sets.append(patients)
+            token_sets.sort(key=len)
+
+            candidates = set.intersection(*token_sets)
+            if len(candidates) < k and len(token_sets) > 1:
+                candidates |= token_sets[0]
+
+            scored = []
+            for patient_id in candidates:
+                original, tokens = self._names[patient_id]
+                best = [
+                    max((matches.get(token, 0) for token in tokens), default=0)
+                    for matches in token_matches
+                ]
+                extra = max(len(tokens) - len(query_tokens), 0)
+                score = sum(best) / (len(query_tokens) + 0.25 * extra)
+                if score >= min_score:
+                    scored.append((score, patient_id, original))
+
+        top = heapq.nlargest(k, scored)
+        return [
+            {"patient_id": patient_id, "name": original, "score": round(score, 3)}
+            for score, patient_id, original in top
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_name_index(create: bool = True) -> Optional[NameIndex]:
+    """
+    Return the worker-wide name index
+
+    Args:
+        create: Build it if this worker has none yet (False only peeks)
+
+    Returns:
+        The index, or None when NAME_INDEX_ENABLED is off or it isn't built
+    """
+    global _index
+    if not NAME_INDEX_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None and create:
+            _index = NameIndex()
+        return _index
@@ -3,6 +3,33 @@ import logging
 from datetime import datetime
 from typing import Any, Dict, Optional
 
+from shared import tracer
+
+from .lookup_filter import get_lookup_filter
+from .name_index import get_name_index
+from .text_store import DocumentTextStore
+
+# Set once per patient; later documents only fill them in when missing
+IDENTITY_COLUMNS = ["PatientName", "MedicalRecordNumber", "DateOfBirth"]
+
+# Describe the latest admission; newer documents overwrite them
+EPISODE_COLUMNS = [
+    "PrimaryDiagnosis",
+    "AdmissionDate",
+    "DischargeDate",
+    "AttendingPhysician",
+    "FacilityName",
+]
+
+PATIENT_COLUMNS = ", ".join(["PatientID"] + IDENTITY_COLUMNS + EPISODE_COLUMNS)
+
+# A patient whose identity changes keeps its PatientID, which other workers'
+# name indexes and lookup filters have already passed; they re-read it here
+RECORD_CHANGE_STATEMENT = """
+    INSERT INTO ChangeLog (DocumentID, PatientID, ChangedDate)
+    VALUES (%s, %s, %s)
+    """
+
 
 class DatabaseOperations:
     """Handles database insert operations"""
@@ -45,168 +72,357 @@ class DatabaseOperations:
             self.logger.warning(f"Could not parse date: {date_str}")
             return None
 
+    @staticmethod
+    def _clean(value: Any) -> Any:
+        """Treat the model's "null" placeholder as a missing value"""
+        if value is None or str(value).strip() in ("", "null", "None"):
+            return None
+        return value
+
+    def patient_columns(self, extracted_data: Dict[str, Any]) -> Optional[dict]:
+        """
+        Map extracted fields onto Patients columns, cleaned and truncated
+
+        Returns:
+            The column values, or None when no patient name was extracted
+        """
+        if (
+            not extracted_data.get("patient_name")
+            or extracted_data.get("patient_name") == "null"
+        ):
+            return None
+
+        return {
+            "PatientName": self.truncate_string(
+                extracted_data.get("patient_name"), 100
+            ),
+            "MedicalRecordNumber": self.truncate_string(
+                self._clean(extracted_data.get("mrn")), 50
+            ),
+            "DateOfBirth": self.format_date_field(extracted_data.get("dob")),
+            "PrimaryDiagnosis": self.truncate_string(
+                self._clean(extracted_data.get("primary_diagnosis")), 200
+            ),
+            "AdmissionDate": self.format_date_field(
+                extracted_data.get("admission_date")
+            ),
+            "DischargeDate": self.format_date_field(
+                extracted_data.get("discharge_date")
+            ),
+            "AttendingPhysician": self.truncate_string(
+                self._clean(extracted_data.get("physician")), 100
+            ),
+            "FacilityName": self.truncate_string(
+                self._clean(extracted_data.get("facility")), 100
+            ),
+        }
+
+    def insurance_column(self, extracted_data: Dict[str, Any]) -> Optional[str]:
+        """Extracted insurance company as stored in Insurance, or None"""
+        return self.truncate_string(
+            self._clean(extracted_data.get("insurance_company")), 100
+        )
+
+    def _find_patient(self, patient: Dict[str, Any]) -> Optional[dict]:
+        """
+        Find the existing row for a patient, locking it for this transaction
+
+        Matches on MRN first. Without an MRN match, falls back to the
+        normalized name plus date of birth, but never onto a row that has a
+        different MRN.
+        """
+        mrn = patient["MedicalRecordNumber"]
+        if mrn:
+            self.cursor.execute(
+                f"""
+                SELECT TOP 1 {PATIENT_COLUMNS}
+                FROM Patients WITH (UPDLOCK, HOLDLOCK)
+                WHERE MedicalRecordNumber = %s
+                ORDER BY PatientID
+            """,
+                (mrn,),
+            )
+            row = self.cursor.fetchone()
+            if row:
+                return row
+
+        if patient["PatientName"] and patient["DateOfBirth"]:
+            self.cursor.execute(
+                f"""
+                SELECT TOP 1 {PATIENT_COLUMNS}
+                FROM Patients WITH (UPDLOCK, HOLDLOCK)
+                WHERE PatientNameNormalized = UPPER(LTRIM(RTRIM(%s)))
+                  AND DateOfBirth = %s
+                  AND (MedicalRecordNumber IS NULL OR %s IS NULL)
+                ORDER BY PatientID
+            """,
+                (patient["PatientName"], patient["DateOfBirth"], mrn),
+            )
+            return self.cursor.fetchone()
+
+        return None
+
+    @staticmethod
+    def _merge_patient(existing: dict, patient: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the column changes needed to fold a new document into a row
+
+        Identity fields (name, MRN, DOB) are only filled in when missing.
+        Episode fields take the new document's non-null values, unless that
+        document describes an earlier admission than the one on record.
+        """
+        changes = {}
+        for column in IDENTITY_COLUMNS:
+            if existing.get(column) in (None, "") and patient[column]:
+                changes[column] = patient[column]
+
+        stored_admission = existing.get("AdmissionDate")
+        new_admission = patient["AdmissionDate"]
+        older_episode = (
+            stored_admission is not None
+            and new_admission is not None
+            and str(new_admission) < str(stored_admission)[:10]
+        )
+        for column in EPISODE_COLUMNS:
+            value = patient[column]
+            if value is None or value == existing.get(column):
+                continue
+            if older_episode and existing.get(column) is not None:
+                continue
+            changes[column] = value
+
+        return changes
+
+    def upsert_patient(self, patient: Dict[str, Any], document_id: int) -> int:
+        """
+        Insert a patient or merge the document into the existing row
+
+        Args:
+            patient: Patients column values extracted from the document
+            document_id: Document the values came from
+
+        Returns:
+            PatientID of the inserted or updated row
+        """
+        existing = self._find_patient(patient)
+
+        if existing is None:
+            columns = list(patient) + ["DocumentID"]
+            self.cursor.execute(
+                f"""
+                INSERT INTO Patients ({", ".join(columns)})
+                VALUES ({", ".join(["%s"] * len(columns))})
+            """,
+                tuple(patient.values()) + (document_id,),
+            )
+            self.cursor.execute("SELECT @@IDENTITY as PatientID")
+            patient_id = int(self.cursor.fetchone()["PatientID"])
+            self.logger.info(f"✅ Patient inserted with ID: {patient_id}")
+            return patient_id
+
+        patient_id = int(existing["PatientID"])
+        changes = self._merge_patient(existing, patient)
+        if any(column in EPISODE_COLUMNS for column in changes):
+            # DocumentID points at the document the episode fields came from
+            changes["DocumentID"] = document_id
+
+        if changes:
+            assignments = ", ".join(f"{column} = %s" for column in changes)
+            self.cursor.execute(
+                f"UPDATE Patients SET {assignments} WHERE PatientID = %s",
+                tuple(changes.values()) + (patient_id,),
+            )
+        if any(column in IDENTITY_COLUMNS for column in changes):
+            self.cursor.execute(
+                RECORD_CHANGE_STATEMENT,
+                (
+                    document_id,
+                    patient_id,
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            )
+        self.logger.info(
+            f"✅ Patient {patient_id} matched, {len(changes)} fields updated"
+        )
+        return patient_id
+
+    def add_insurance(
+        self, patient_id: int, insurance_company: str, document_id: int
+    ) -> None:
+        """Record an insurance company for a patient unless already on file"""
+        self.cursor.execute(
+            """
+            SELECT TOP 1 InsuranceID FROM Insurance
+            WHERE PatientID = %s
+              AND InsuranceCompanyNormalized = UPPER(LTRIM(RTRIM(%s)))
+        """,
+            (patient_id, insurance_company),
+        )
+        if self.cursor.fetchone():
+            return
+
+        self.cursor.execute(
+            """
+            INSERT INTO Insurance (PatientID, InsuranceCompany, DocumentID)
+            VALUES (%s, %s, %s)
+        """,
+            (patient_id, insurance_company, document_id),
+        )
+        self.logger.info("✅ Insurance data inserted")
+
     def insert_all_data(
         self,
         extracted_data: Dict[str, Any],
         extracted_text: str,
         filename: str,
         accuracy: float,
+        extraction_version: Optional[str] = None,
     ) -> None:
         """
-        Insert all data into database tables - exact same logic as original
+        Insert a document, upserting its patient by MRN or name and date of birth
 
         Args:
             extracted_data: Extracted healthcare data
             extracted_text: Raw extracted text
             filename: Name of the file
             accuracy: Calculated accuracy percentage
+            extraction_version: extraction_version() the data was produced
+                under (None marks it for re-extraction)
         """
-        try:
-            self.logger.info("💾 Starting database insertion...")
+        with tracer.start_span("db.insert_all_data", filename=filename):
+            try:
+                self.logger.info("💾 Starting database insertion...")
 
-            # Get current timestamp - same formatting as original
-            current_time = datetime.now()
-            formatted_datetime = current_time.strftime("%Y-%m-%d %H:%M:%S")
-            formatted_date = current_time.strftime("%Y-%m-%d")
-            formatted_time = current_time.strftime("%H:%M:%S")
-
-            # 1. Insert into Documents table
-            self.cursor.execute(
-                """
-                INSERT INTO Documents (Filename, DocumentType, ProcessingStatus, RawText, CreatedDate)
-                VALUES (%s, %s, %s, %s, %s)
-            """,
-                (
-                    self.truncate_string(filename, 255),
-                    self.truncate_string(
-                        extracted_data.get("document_type", "Unknown"), 50
-                    ),
-                    "Processed" if accuracy >= 50 else "Exception",
-                    extracted_text[:4000],  # Limit text length
-                    formatted_datetime,
-                ),
-            )
-
-            # Get the inserted DocumentID
-            self.cursor.execute("SELECT @@IDENTITY as DocumentID")
-            document_row = self.cursor.fetchone()
-            document_id = int(document_row["DocumentID"])
-            self.logger.info(f"✅ Document inserted with ID: {document_id}")
-
-            # 2. Insert into Patients table (if we have patient data)
-            if (
-                extracted_data.get("patient_name")
-                and extracted_data.get("patient_name") != "null"
-            ):
-
-                # Format dates
-                formatted_dob = self.format_date_field(extracted_data.get("dob"))
-                formatted_admission = self.format_date_field(
-                    extracted_data.get("admission_date")
-                )
-                formatted_discharge = self.format_date_field(
-                    extracted_data.get("discharge_date")
-                )
+                # Get current timestamp - same formatting as original
+                current_time = datetime.now()
+                formatted_datetime = current_time.strftime("%Y-%m-%d %H:%M:%S")
+                formatted_date = current_time.strftime("%Y-%m-%d")
+                formatted_time = current_time.strftime("%H:%M:%S")
 
+                # 1. Insert into Documents table
                 self.cursor.execute(
                     """
-                    INSERT INTO Patients (PatientName, MedicalRecordNumber, DateOfBirth, 
-                                        PrimaryDiagnosis, AdmissionDate, DischargeDate, 
-                                        AttendingPhysician, FacilityName, DocumentID)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    INSERT INTO Documents (Filename, DocumentType, ProcessingStatus, RawText, CreatedDate,
+                                           ExtractionVersion, ExtractedData)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
                 """,
                     (
-                        self.truncate_string(extracted_data.get("patient_name"), 100),
-                        self.truncate_string(extracted_data.get("mrn"), 50),
-                        formatted_dob,
+                        self.truncate_string(filename, 255),
                         self.truncate_string(
-                            extracted_data.get("primary_diagnosis"), 200
+                            extracted_data.get("document_type", "Unknown"), 50
                         ),
-                        formatted_admission,
-                        formatted_discharge,
-                        self.truncate_string(extracted_data.get("physician"), 100),
-                        self.truncate_string(extracted_data.get("facility"), 100),
-                        document_id,
+                        "Processed" if accuracy >= 50 else "Exception",
+                        None,  # Full text lives compressed in DocumentText
+                        formatted_datetime,
+                        extraction_version,
+                        json.dumps(extracted_data),
                     ),
                 )
 
-                self.cursor.execute("SELECT @@IDENTITY as PatientID")
-                patient_row = self.cursor.fetchone()
-                patient_id = int(patient_row["PatientID"])
-                self.logger.info(f"✅ Patient inserted with ID: {patient_id}")
+                # Get the inserted DocumentID
+                self.cursor.execute("SELECT @@IDENTITY as DocumentID")
+                document_row = self.cursor.fetchone()
+                document_id = int(document_row["DocumentID"])
+                self.logger.info(f"✅ Document inserted with ID: {document_id}")
 
-                # 3. Insert into Insurance table (if we have insurance data)
-                if (
-                    extracted_data.get("insurance_company")
-                    and extracted_data.get("insurance_company") != "null"
-                ):
+                # Keep the complete OCR text, compressed and off the hot row
+                DocumentTextStore(self.conn, self.cursor).save(document_id, extracted_text)
+
+                patient_id = None
+
+                # 2. Upsert the patient and link it to this document
+                patient = self.patient_columns(extracted_data)
+                if patient is not None:
+                    patient_id = self.upsert_patient(patient, document_id)
 
                     self.cursor.execute(
                         """
-                        INSERT INTO Insurance (PatientID, InsuranceCompany, DocumentID)
+                        INSERT INTO PatientDocuments (PatientID, DocumentID, LinkedDate)
                         VALUES (%s, %s, %s)
+                    """,
+                        (patient_id, document_id, formatted_datetime),
+                    )
+
+                    # 3. Insert into Insurance table (if we have new insurance data)
+                    insurance_company = self.insurance_column(extracted_data)
+                    if insurance_company:
+                        self.add_insurance(patient_id, insurance_company, document_id)
+
+                # 4. Insert into ProcessTable or ExceptionTable
+                document_type = extracted_data.get("document_type", "Unknown")
+
+                if accuracy >= 50:
+                    self.cursor.execute(
+                        """
+                        INSERT INTO ProcessTable (FileName, Accuracy, Status, Type, 
+                                                IngestedDate, IngestedTime, DocumentID)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
                     """,
                         (
-                            patient_id,
-                            self.truncate_string(
-                                extracted_data.get("insurance_company"), 100
-                            ),
+                            self.truncate_string(filename, 255),
+                            accuracy,
+                            "Success",
+                            self.truncate_string(document_type, 50),
+                            formatted_date,
+                            formatted_time,
                             document_id,
                         ),
                     )
-                    self.logger.info("✅ Insurance data inserted")
+                    self.logger.info("✅ Record added to ProcessTable")
+                else:
+                    self.cursor.execute(
+                        """
+                        INSERT INTO ExceptionTable (FileName, Accuracy, Status, Type, 
+                                                IngestedDate, IngestedTime, ErrorDetails, 
+                                                RawExtractedData, DocumentID)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                        (
+                            self.truncate_string(filename, 255),
+                            accuracy,
+                            "Low_Accuracy",
+                            self.truncate_string(document_type, 15),
+                            formatted_date,
+                            formatted_time,
+                            f"Low accuracy: {accuracy}% - Missing required fields",
+                            json.dumps(extracted_data)[:1000],  # Truncate JSON if too long
+                            document_id,
+                        ),
+                    )
+                    self.logger.info("✅ Record added to ExceptionTable")
 
-            # 4. Insert into ProcessTable or ExceptionTable
-            document_type = extracted_data.get("document_type", "Unknown")
+                # Commit all changes
+                self.conn.commit()
+                self.logger.info("🎉 DATABASE INSERTION COMPLETED SUCCESSFULLY!")
 
-            if accuracy >= 50:
-                self.cursor.execute(
-                    """
-                    INSERT INTO ProcessTable (FileName, Accuracy, Status, Type, 
-                                            IngestedDate, IngestedTime, DocumentID)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """,
-                    (
-                        self.truncate_string(filename, 255),
-                        accuracy,
-                        "Success",
-                        self.truncate_string(document_type, 50),
-                        formatted_date,
-                        formatted_time,
-                        document_id,
-                    ),
-                )
-                self.logger.info("✅ Record added to ProcessTable")
-            else:
-                self.cursor.execute(
-                    """
-                    INSERT INTO ExceptionTable (FileName, Accuracy, Status, Type, 
-                                            IngestedDate, IngestedTime, ErrorDetails, 
-                                            RawExtractedData, DocumentID)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """,
-                    (
-                        self.truncate_string(filename, 255),
-                        accuracy,
-                        "Low_Accuracy",
-                        self.truncate_string(document_type, 15),
-                        formatted_date,
-                        formatted_time,
-                        f"Low accuracy: {accuracy}% - Missing required fields",
-                        json.dumps(extracted_data)[:1000],  # Truncate JSON if too long
-                        document_id,
-                    ),
-                )
-                self.logger.info("✅ Record added to ExceptionTable")
+            except Exception as db_insert_error:
+                self.logger.error(f"❌ Database insertion failed: {str(db_insert_error)}")
+                self.conn.rollback()  # Rollback on error
+                raise db_insert_error
 
-            # Commit all changes
-            self.conn.commit()
-            self.logger.info("🎉 DATABASE INSERTION COMPLETED SUCCESSFULLY!")
+            # The document is committed, so a cache failure must not be
+            # reported as a failed write and replayed as a duplicate
+            try:
+                self._update_caches(patient_id, patient)
+            except Exception as e:
+                self.logger.warning(f"⚠️ Patient cache update failed: {str(e)}")
 
-        except Exception as db_insert_error:
-            self.logger.error(f"❌ Database insertion failed: {str(db_insert_error)}")
-            self.conn.rollback()  # Rollback on error
-            raise db_insert_error
+    def _update_caches(
+        self, patient_id: Optional[int], patient: Optional[dict]
+    ) -> None:
+        """Add an ingested patient to this worker's name index and lookup filter"""
+        if patient_id is None:
+            return
+        name_index = get_name_index(create=False)
+        # A matched patient keeps the name on record, which the index
+        # already has unless it was missing
+        if name_index is not None and patient_id not in name_index:
+            name_index.add(patient_id, patient["PatientName"])
+        lookup_filter = get_lookup_filter(create=False)
+        if lookup_filter is not None:
+            lookup_filter.add(
+                patient.get("MedicalRecordNumber"), patient.get("PatientName")
+            )
 
     def close_connection(self):
         """Close database connection"""
@@ -0,0 +1,163 @@
+import logging
+import sqlite3
+import sys
+from typing import Dict, List
+
+from .export import ExportPage
+from .retreive_data import (
+    DOCUMENTS_SEARCH_QUERY,
+    PATIENT_BY_MRN_QUERY,
+    PATIENT_BY_NAME_QUERY,
+    PATIENT_DOCUMENTS_QUERY,
+    PATIENTS_BY_DIAGNOSIS_QUERY,
+    PATIENTS_BY_IDS_QUERY,
+    PATIENTS_BY_INSURANCE_QUERY,
+    PATIENTS_BY_PHYSICIAN_QUERY,
+    PROCESSING_STATUS_QUERY,
+    TOP_DIAGNOSIS_QUERY,
+    TOTAL_DOCUMENTS_QUERY,
+    TOTAL_PATIENTS_QUERY,
+)
+from .schema import SchemaMigrator, to_sqlite
+
+# Every RetreiveData query with representative parameters, plus the tables
+# (by alias) it is allowed to scan. Leading-wildcard LIKE filters and
+# whole-table counts cannot seek, so those scans are the accepted baseline;
+# anything else that scans is a regression.
+PLAN_CHECK_QUERIES: Dict[str, dict] = {
+    "patient_by_name": {
+        "query": PATIENT_BY_NAME_QUERY,
+        "params": ("%John Doe%",),
+        "allowed_scans": {"p"},
+    },
+    "patient_by_mrn": {
+        "query": PATIENT_BY_MRN_QUERY,
+        "params": ("12345",),
+        "allowed_scans": set(),
+    },
+    "patients_by_ids": {
+        "query": PATIENTS_BY_IDS_QUERY.format(placeholders="%s, %s, %s"),
+        "params": (1, 2, 3),
+        "allowed_scans": set(),
+    },
+    "patients_by_diagnosis": {
+        "query": PATIENTS_BY_DIAGNOSIS_QUERY,
+        "params": ("%diabetes%",),
+        "allowed_scans": {"p"},
+    },
+    "patients_by_physician": {
+        "query": PATIENTS_BY_PHYSICIAN_QUERY,
+        "params": ("%Smith%",),
+        "allowed_scans": {"p"},
+    },
+    "patients_by_insurance": {
+        "query": PATIENTS_BY_INSURANCE_QUERY,
+        "params": ("%Aetna%",),
+        "allowed_scans": {"i", "p"},
+    },
+    "documents_search": {
+        "query": DOCUMENTS_SEARCH_QUERY,
+        "params": ("%Discharge%", "%Discharge%"),
+        "allowed_scans": {"d"},
+    },
+    "patient_documents": {
+        "query": PATIENT_DOCUMENTS_QUERY,
+        "params": ("12345", "%John Doe%"),
+        # The OR'd LIKE forces one scan; SQLite may drive it from either side
+        "allowed_scans": {"p", "pd"},
+    },
+    "processing_status": {
+        "query": PROCESSING_STATUS_QUERY.format(placeholders="%s, %s"),
+        "params": ("a.pdf", "b.pdf"),
+        "allowed_scans": set(),
+    },
+    "total_patients": {
+        "query": TOTAL_PATIENTS_QUERY,
+        "params": (),
+        "allowed_scans": {"Patients"},
+    },
+    "total_documents": {
+        "query": TOTAL_DOCUMENTS_QUERY,
+        "params": (),
+        "allowed_scans": {"Documents"},
+    },
+    "top_diagnosis": {
+        "query": TOP_DIAGNOSIS_QUERY,
+        "params": (),
+        "allowed_scans": {"Patients"},
+    },
+}
+
+# Export pages must seek on their key, not scan from the start of the table
+for _dataset, _filters in (
+    ("patients", {"insurance_search": "Aetna"}),
+    ("documents", {"mrn_lookup": "12345"}),
+):
+    _query, _params = ExportPage(_dataset, _filters).query()
+    PLAN_CHECK_QUERIES[f"export_{_dataset}"] = {
+        "query": _query,
+        "params": _params,
+        "allowed_scans": set(),
+    }
+
+
+class QueryPlanChecker:
+    """Captures SQLite query plans for RetreiveData queries and flags scans"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.row_factory = sqlite3.Row
+        SchemaMigrator(self.conn, self.conn.cursor(), dialect="sqlite").migrate()
+
+    def capture_plan(self, query: str, params: tuple) -> List[str]:
+        """Return the EXPLAIN QUERY PLAN detail lines for a pymssql query"""
+        cursor = self.conn.execute(f"EXPLAIN QUERY PLAN {to_sqlite(query)}", params)
+        return [row["detail"] for row in cursor.fetchall()]
+
+    def _flag(self, plan: List[str], allowed_scans: set) -> List[str]:
+        """Return the plan steps that count as regressions"""
+        problems = []
+        scans = []
+
+        for step in plan:
+            # Auto-indexes mean SQLite had to build the index we forgot
+            if "AUTOMATIC" in step:
+                problems.append(step)
+            elif step.startswith("SCAN "):
+                target = step.split()[1]
+                scans.append(step)
+                if target not in allowed_scans:
+                    problems.append(step)
+
+        # At most one table per query may fall back to a scan
+        if len(scans) > 1:
+            problems.extend(step for step in scans if step not in problems)
+
+        return problems
+
+    def check(self) -> Dict[str, dict]:
+        """
+        Capture and evaluate the plan of every query in PLAN_CHECK_QUERIES
+
+        Returns:
+            Mapping of query name to {"plan": [...], "problems": [...]}
+        """
+        report = {}
+        for name, spec in PLAN_CHECK_QUERIES.items():
+            plan = self.capture_plan(spec["query"], spec["params"])
+            problems = self._flag(plan, spec["allowed_scans"])
+            report[name] = {"plan": plan, "problems": problems}
+
+            if problems:
+                self.logger.warning(f"⚠️ {name} plan regressed: {'; '.join(problems)}")
+            else:
+                self.logger.info(f"✅ {name}: {'; '.join(plan)}")
+
+        return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    results = QueryPlanChecker().check()
+    sys.exit(1 if any(result["problems"] for result in results.values()) else 0)
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+from shared import DeadlineExceeded, metrics, remaining
+
+from .connection import DB_QUERY_TIMEOUT_SECONDS, DatabaseConnection, set_query_timeout
+
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_IDLE_SECONDS = int(os.environ.get("DB_POOL_MAX_IDLE_SECONDS", "300"))
+
+
+class ConnectionPool:
+    """Reusable autocommit connections for read queries"""
+
+    def __init__(
+        self,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        max_idle_seconds: int = DB_POOL_MAX_IDLE_SECONDS,
+    ):
+        """
+        Initialize an empty pool
+
+        Args:
+            min_size: Connections opened by warm()
+            max_size: Upper bound on connections checked out at once
+            max_idle_seconds: Idle time after which a connection is re-tested
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.logger = logging.getLogger(__name__)
+
+    def _open(self) -> tuple:
+        conn, cursor = DatabaseConnection().connect_with_retry(autocommit=True)
+        if not conn or not cursor:
+            raise Exception("Database connection failed")
+        return conn, cursor
+
+    def warm(self, count: Optional[int] = None) -> int:
+        """
+        Pre-open idle connections so first queries skip the login
+
+        Args:
+            count: Target idle connections (defaults to min_size)
+
+        Returns:
+            Number of connections opened by this call
+        """
+        target = min(count or self.min_size, self.max_size)
+        opened = 0
+        while True:
+            with self._lock:
+                if len(self._idle) >= target:
+                    break
+            conn, cursor = self._open()
+            with self._lock:
+                self._idle.append((conn, cursor, time.monotonic()))
+            opened += 1
+
+        self.logger.info(f"🔥 Connection pool warmed with {opened} new connections")
+        return opened
+
+    def _checkout(self) -> tuple:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, cursor, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used < self.max_idle_seconds:
+                return conn, cursor
+
+            # Long-idle connections may have been dropped by Azure SQL
+            try:
+                cursor.execute("SELECT 1 as test_value")
+                cursor.fetchone()
+                return conn, cursor
+            except Exception:
+                self._close(conn)
+
+        return self._open()
+
+    def _close(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Yield a (connection, cursor) pair, returning it to the pool after
+
+        Inside a request deadline the wait for a slot and the connection's
+        query timeout are both cut to the budget left.
+        """
+        left = remaining()
+        if not self._slots.acquire(timeout=None if left is None else max(0.0, left)):
+            metrics.increment("deadline.exceeded.db.pool")
+            raise DeadlineExceeded("db.pool")
+        try:
+            conn, cursor = self._checkout()
+            left = remaining()
+            shortened = left is not None and left < DB_QUERY_TIMEOUT_SECONDS
+            if shortened:
+                set_query_timeout(conn, left)
+            try:
+                yield conn, cursor
+            except Exception:
+                # The connection state is unknown after a failure
+                self._close(conn)
+                raise
+            else:
+                if shortened:
+                    set_query_timeout(conn, DB_QUERY_TIMEOUT_SECONDS)
+                with self._lock:
+                    self._idle.append((conn, cursor, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._close(conn)
+        self.logger.info("🔐 Connection pool closed")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the worker-wide read connection pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
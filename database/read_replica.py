@@ -0,0 +1,313 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, time as time_of_day
+from decimal import Decimal
+from typing import Dict, Optional
+
+from shared import metrics
+
+from .pool import get_pool
+from .result_set import ResultSet
+from .schema import TABLES, SchemaMigrator, to_sqlite
+
+READ_REPLICA_ENABLED = (
+    os.environ.get("READ_REPLICA_ENABLED", "false").lower() == "true"
+)
+READ_REPLICA_MAX_STALENESS_SECONDS = float(
+    os.environ.get("READ_REPLICA_MAX_STALENESS_SECONDS", "30")
+)
+# Recently committed IDs are re-read each sync, since a transaction holding
+# a lower DocumentID can commit after a higher one has already been seen
+READ_REPLICA_OVERLAP_IDS = int(os.environ.get("READ_REPLICA_OVERLAP_IDS", "50"))
+READ_REPLICA_FETCH_SIZE = int(os.environ.get("READ_REPLICA_FETCH_SIZE", "1000"))
+# Every table is copied afresh this often, in the background
+READ_REPLICA_FULL_SYNC_SECONDS = float(
+    os.environ.get("READ_REPLICA_FULL_SYNC_SECONDS", "3600")
+)
+
+# Chat-facing columns only; full text stays in Azure SQL
+EXCLUDED_COLUMNS = {"Documents": {"RawText"}}
+
+FULL_SYNC_QUERY = "SELECT {{columns}} FROM {table}"
+
+# Rows of each table that belong to documents above a watermark. Patients
+# are updated in place at ingest, so every patient linked to a new document
+# is re-read.
+SYNC_QUERIES = {
+    "Documents": "SELECT {columns} FROM Documents WHERE DocumentID > %s",
+    "Patients": """
+        SELECT {columns} FROM Patients
+        WHERE PatientID IN (
+            SELECT pd.PatientID FROM PatientDocuments pd WHERE pd.DocumentID > %s
+        )
+        """,
+    "Insurance": "SELECT {columns} FROM Insurance WHERE DocumentID > %s",
+    "PatientDocuments": "SELECT {columns} FROM PatientDocuments WHERE DocumentID > %s",
+    "ProcessTable": "SELECT {columns} FROM ProcessTable WHERE DocumentID > %s",
+    "ExceptionTable": "SELECT {columns} FROM ExceptionTable WHERE DocumentID > %s",
+}
+
+# Rows rewritten in place on documents already synced, found through the
+# ChangeLog entries above a change watermark
+CHANGE_SYNC_QUERIES = {
+    "Documents": """
+        SELECT {columns} FROM Documents
+        WHERE DocumentID IN (SELECT c.DocumentID FROM ChangeLog c WHERE c.ChangeID > %s)
+        """,
+    "Patients": """
+        SELECT {columns} FROM Patients
+        WHERE PatientID IN (SELECT c.PatientID FROM ChangeLog c WHERE c.ChangeID > %s)
+        """,
+    "Insurance": """
+        SELECT {columns} FROM Insurance
+        WHERE PatientID IN (SELECT c.PatientID FROM ChangeLog c WHERE c.ChangeID > %s)
+        """,
+    "PatientDocuments": """
+        SELECT {columns} FROM PatientDocuments
+        WHERE DocumentID IN (SELECT c.DocumentID FROM ChangeLog c WHERE c.ChangeID > %s)
+        """,
+}
+
+
+def _sqlite_value(value):
+    """Store driver values in forms SQLite accepts without adapters"""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (date, time_of_day)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class ReadReplica:
+    """In-memory SQLite copy of the chat tables, synced by DocumentID"""
+
+    def __init__(
+        self,
+        max_staleness_seconds: float = READ_REPLICA_MAX_STALENESS_SECONDS,
+        overlap_ids: int = READ_REPLICA_OVERLAP_IDS,
+        full_sync_seconds: float = READ_REPLICA_FULL_SYNC_SECONDS,
+    ):
+        """
+        Initialize an empty replica with the current schema
+
+        Args:
+            max_staleness_seconds: Oldest sync a query may be answered from
+            overlap_ids: IDs below each watermark re-read on each sync
+            full_sync_seconds: Interval between full resyncs
+        """
+        self.max_staleness_seconds = max_staleness_seconds
+        self.overlap_ids = overlap_ids
+        self.full_sync_seconds = full_sync_seconds
+        self.watermark = 0
+        self.change_watermark = 0
+        self.last_sync = None
+        self.last_full_sync = None
+        self.logger = logging.getLogger(__name__)
+
+        self.conn = self._new_database()
+
+        # One lock serializes reads and the sync writes on the shared handle;
+        # syncs run one at a time on a background thread
+        self._lock = threading.RLock()
+        self._syncing = False
+        self._columns = {
+            table: [
+                name
+                for name, _ in TABLES[table]
+                if name not in EXCLUDED_COLUMNS.get(table, set())
+            ]
+            for table in SYNC_QUERIES
+        }
+
+    @staticmethod
+    def _new_database() -> sqlite3.Connection:
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        SchemaMigrator(conn, conn.cursor(), dialect="sqlite").migrate()
+        return conn
+
+    @staticmethod
+    def _high_watermarks(source_cursor) -> tuple:
+        source_cursor.execute(
+            "SELECT (SELECT MAX(DocumentID) FROM Documents) as DocumentID, "
+            "(SELECT MAX(ChangeID) FROM ChangeLog) as ChangeID"
+        )
+        row = source_cursor.fetchone() or {}
+        return int(row.get("DocumentID") or 0), int(row.get("ChangeID") or 0)
+
+    def _read_rows(self, source_cursor, table: str, query: str, params: tuple):
+        """Yield batches of the table rows query selects, as SQLite tuples"""
+        columns = self._columns[table]
+        source_cursor.execute(query.format(columns=", ".join(columns)), params)
+        while True:
+            rows = source_cursor.fetchmany(READ_REPLICA_FETCH_SIZE)
+            if not rows:
+                break
+            yield [tuple(_sqlite_value(row[name]) for name in columns) for row in rows]
+
+    def _write_rows(self, target, table: str, rows: list) -> int:
+        columns = self._columns[table]
+        target.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(['?'] * len(columns))})",
+            rows,
+        )
+        return len(rows)
+
+    def full_sync(self) -> int:
+        """
+        Copy every row into a new database and swap it in
+
+        Reaches what the incremental sync cannot: rows without a
+        DocumentID, rows deleted or rewritten without a ChangeLog entry
+        (patient merges, manual fixes). Readers keep using the current
+        copy until the swap.
+
+        Returns:
+            Number of rows copied
+        """
+        with metrics.timer("replica.full_sync"):
+            started = time.monotonic()
+            target = self._new_database()
+            copied = 0
+            with get_pool().connection() as (conn, cursor):
+                high, change_high = self._high_watermarks(cursor)
+                for table in SYNC_QUERIES:
+                    query = FULL_SYNC_QUERY.format(table=table)
+                    for rows in self._read_rows(cursor, table, query, ()):
+                        copied += self._write_rows(target, table, rows)
+            target.commit()
+
+            with self._lock:
+                previous, self.conn = self.conn, target
+                self.watermark, self.change_watermark = high, change_high
+                self.last_sync = self.last_full_sync = started
+            previous.close()
+
+        metrics.increment("replica.full_syncs")
+        metrics.increment("replica.rows_synced", copied)
+        self.logger.info(
+            f"🔄 Read replica fully resynced: {copied} rows up to DocumentID {high}"
+        )
+        return copied
+
+    def sync(self) -> int:
+        """
+        Pull rows for documents above the watermark from Azure SQL, and
+        rows rewritten since the last sync
+
+        The first sync, and one every full_sync_seconds, copies every row
+        instead. Rows are read from Azure SQL without the lock, so reads
+        only wait for them to be written.
+
+        Returns:
+            Number of rows copied
+        """
+        if (
+            self.last_full_sync is None
+            or time.monotonic() - self.last_full_sync > self.full_sync_seconds
+        ):
+            return self.full_sync()
+
+        with metrics.timer("replica.sync"):
+            low = max(self.watermark - self.overlap_ids, 0)
+            change_low = max(self.change_watermark - self.overlap_ids, 0)
+            started = time.monotonic()
+            batches = []
+
+            with get_pool().connection() as (conn, cursor):
+                high, change_high = self._high_watermarks(cursor)
+                for table, query in SYNC_QUERIES.items():
+                    for rows in self._read_rows(cursor, table, query, (low,)):
+                        batches.append((table, rows))
+                for table, query in CHANGE_SYNC_QUERIES.items():
+                    for rows in self._read_rows(cursor, table, query, (change_low,)):
+                        batches.append((table, rows))
+
+            with self._lock:
+                copied = 0
+                try:
+                    for table, rows in batches:
+                        copied += self._write_rows(self.conn, table, rows)
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+                self.watermark = max(self.watermark, high)
+                self.change_watermark = max(self.change_watermark, change_high)
+                self.last_sync = started
+
+            metrics.increment("replica.rows_synced", copied)
+            self.logger.info(
+                f"🔄 Read replica synced {copied} rows up to DocumentID {self.watermark}"
+            )
+            return copied
+
+    def _sync_in_background(self) -> None:
+        try:
+            self.sync()
+        except Exception as e:
+            self.logger.warning(f"⚠️ Read replica sync failed: {str(e)}")
+        finally:
+            self._syncing = False
+
+    def _start_sync(self) -> None:
+        with self._lock:
+            if self._syncing:
+                return
+            self._syncing = True
+        threading.Thread(
+            target=self._sync_in_background, name="replica-sync", daemon=True
+        ).start()
+
+    def is_stale(self) -> bool:
+        return (
+            self.last_sync is None
+            or time.monotonic() - self.last_sync > self.max_staleness_seconds
+        )
+
+    def fetch_all(self, query: str, params: tuple = ()) -> Optional[ResultSet]:
+        """
+        Run a pymssql-style read query against the replica
+
+        When the last sync is older than the staleness window, a sync starts
+        in the background and None is returned, so the caller reads Azure SQL
+        and results are never more than max_staleness_seconds behind.
+        """
+        if self.is_stale():
+            self._start_sync()
+            return None
+        with self._lock:
+            results = ResultSet.from_cursor(
+                self.conn.execute(to_sqlite(query), params)
+            )
+        metrics.increment("replica.queries")
+        return results
+
+    def counts(self) -> Dict[str, int]:
+        """Row count per replicated table"""
+        with self._lock:
+            return {
+                table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in SYNC_QUERIES
+            }
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def get_read_replica() -> Optional[ReadReplica]:
+    """Return the worker-wide replica, or None unless READ_REPLICA_ENABLED"""
+    global _replica
+    if not READ_REPLICA_ENABLED:
+        return None
+    with _replica_lock:
+        if _replica is None:
+            _replica = ReadReplica()
+        return _replica
@@ -0,0 +1,278 @@
+import argparse
+import json
+import time
+from datetime import date, timedelta
+from datetime import time as time_of_day
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Sequence
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# Values the JSON encoder cannot write natively. They are turned into the
+# same strings json.dumps(default=str) produced, once, when rows are read.
+STRINGIFIED_TYPES = (date, time_of_day, Decimal, UUID)
+
+
+def _normalized(rows: List[tuple]) -> List[tuple]:
+    """Stringify date, Decimal and UUID columns, leaving other rows untouched"""
+    if not rows:
+        return rows
+    # A column's type is fixed by the query, so its first non-NULL value
+    # decides whether it needs converting
+    unresolved = set(range(len(rows[0])))
+    positions = set()
+    for row in rows:
+        for position in list(unresolved):
+            value = row[position]
+            if value is not None:
+                unresolved.discard(position)
+                if isinstance(value, STRINGIFIED_TYPES):
+                    positions.add(position)
+        if not unresolved:
+            break
+    if not positions:
+        return rows
+    positions = sorted(positions)
+    normalized = []
+    for row in rows:
+        values = list(row)
+        for position in positions:
+            if values[position] is not None:
+                values[position] = str(values[position])
+        normalized.append(tuple(values))
+    return normalized
+
+
+class ResultSet:
+    """
+    Query rows as tuples under one shared header
+
+    Iterating or indexing yields dict rows for code that reads columns by
+    name; the tuples themselves are what gets stored and serialized.
+    """
+
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, columns: Sequence[str], rows: List[tuple]):
+        self.columns = tuple(columns)
+        self.rows = rows
+
+    @classmethod
+    def from_cursor(cls, cursor) -> "ResultSet":
+        """Fetch every row of an executed DB-API cursor"""
+        rows = cursor.fetchall()
+        if rows and isinstance(rows[0], dict):
+            return cls.from_records(rows)
+        if rows and not isinstance(rows[0], tuple):
+            # sqlite3.Row from the replica and stand-ins
+            rows = [tuple(row) for row in rows]
+        columns = [column[0] for column in cursor.description or ()]
+        return cls(columns, _normalized(rows))
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "ResultSet":
+        """Build from dict rows, with columns in first-seen order"""
+        records = list(records)
+        columns = list(dict.fromkeys(key for record in records for key in record))
+        rows = [tuple(record.get(column) for column in columns) for record in records]
+        return cls(columns, _normalized(rows))
+
+    @classmethod
+    def concat(cls, parts: Iterable) -> "ResultSet":
+        """
+        Stack result sets under the union of their columns
+
+        Lists of dicts and single dicts are accepted too; columns a part
+        lacks are None in its rows.
+        """
+        sets = []
+        for part in parts:
+            if isinstance(part, ResultSet):
+                sets.append(part)
+            elif part:
+                sets.append(
+                    cls.from_records(part if isinstance(part, list) else [part])
+                )
+        if len(sets) == 1:
+            return sets[0]
+
+        columns = tuple(
+            dict.fromkeys(column for part in sets for column in part.columns)
+        )
+        rows = []
+        for part in sets:
+            if part.columns == columns:
+                rows.extend(part.rows)
+                continue
+            index = {column: position for position, column in enumerate(part.columns)}
+            positions = [index.get(column) for column in columns]
+            rows.extend(
+                tuple(
+                    None if position is None else row[position]
+                    for position in positions
+                )
+                for row in part.rows
+            )
+        return cls(columns, rows)
+
+    def without(self, column: str) -> "ResultSet":
+        """The same rows minus one column"""
+        if column not in self.columns:
+            return self
+        position = self.columns.index(column)
+        return ResultSet(
+            self.columns[:position] + self.columns[position + 1 :],
+            [row[:position] + row[position + 1 :] for row in self.rows],
+        )
+
+    def column(self, name: str) -> list:
+        position = self.columns.index(name)
+        return [row[position] for row in self.rows]
+
+    def records(self) -> List[dict]:
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+    def to_columnar(self) -> dict:
+        """Wire form: the header once, then one array per row"""
+        return {"columns": list(self.columns), "rows": self.rows}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[dict]:
+        columns = self.columns
+        return (dict(zip(columns, row)) for row in self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ResultSet(self.columns, self.rows[index])
+        return dict(zip(self.columns, self.rows[index]))
+
+    def __repr__(self) -> str:
+        # Prompts embed results with str(); keep them reading as dict rows
+        return repr(self.records())
+
+
+def _columnar_default(value):
+    if isinstance(value, ResultSet):
+        return value.to_columnar()
+    return str(value)
+
+
+def _records_default(value):
+    if isinstance(value, ResultSet):
+        return value.records()
+    return str(value)
+
+
+def encode_json(payload, columnar: bool = True) -> bytes:
+    """
+    Serialize a response payload, with orjson when it is installed
+
+    Result sets are written as {"columns": [...], "rows": [[...]]}, or as
+    a list of objects with columnar=False. Other values the encoder cannot
+    write natively become str(), as with json.dumps(default=str).
+    """
+    default = _columnar_default if columnar else _records_default
+    if orjson is not None:
+        # Dates outside result sets keep the str() form instead of ISO 8601
+        return orjson.dumps(
+            payload,
+            default=default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(payload, default=default).encode("utf-8")
+
+
+def _sample_rows(count: int) -> List[tuple]:
+    admitted = date(2024, 1, 1)
+    return [
+        (
+            f"Patient {number}",
+            f"MRN{100000 + number}",
+            date(1950 + number % 50, 1 + number % 12, 1 + number % 28),
+            ("Hypertension", "Type 2 Diabetes", "Asthma")[number % 3],
+            admitted + timedelta(days=number % 365),
+            admitted + timedelta(days=number % 365 + 3),
+            "Dr. Smith",
+            "General Hospital",
+            "Aetna" if number % 4 else None,
+        )
+        for number in range(count)
+    ]
+
+
+SAMPLE_COLUMNS = (
+    "PatientName",
+    "MedicalRecordNumber",
+    "DateOfBirth",
+    "PrimaryDiagnosis",
+    "AdmissionDate",
+    "DischargeDate",
+    "AttendingPhysician",
+    "FacilityName",
+    "InsuranceCompany",
+)
+
+
+def _bench(label: str, encode, repeat: int) -> None:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    size = f"{len(body) / 1e6:.2f}" if isinstance(body, bytes) else "-"
+    print(f"{label:<28}{timings[len(timings) // 2]:>10.1f}{size:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare chat payload serialization: dict rows vs result sets"
+    )
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    raw = _sample_rows(args.rows)
+    records = [dict(zip(SAMPLE_COLUMNS, row)) for row in raw]
+    result_set = ResultSet(SAMPLE_COLUMNS, _normalized(raw))
+
+    def response(data) -> dict:
+        return {"status": "success", "data": data, "count": args.rows}
+
+    print(f"{'payload':<28}{'ms p50':>10}{'MB':>10}")
+    _bench(
+        "dict rows, json",
+        lambda: json.dumps(response(records), default=str).encode("utf-8"),
+        args.repeat,
+    )
+    _bench(
+        "result set, build",
+        lambda: ResultSet(SAMPLE_COLUMNS, _normalized(raw)),
+        args.repeat,
+    )
+    if orjson is not None:
+        _bench(
+            "result set, orjson",
+            lambda: encode_json(response(result_set)),
+            args.repeat,
+        )
+        _bench(
+            "result set records, orjson",
+            lambda: encode_json(response(result_set), columnar=False),
+            args.repeat,
+        )
+    # The same payloads through the standard library encoder
+    orjson = None
+    _bench("result set, json", lambda: encode_json(response(result_set)), args.repeat)
+    _bench(
+        "result set records, json",
+        lambda: encode_json(response(result_set), columnar=False),
+        args.repeat,
+    )
@@ -1,40 +1,233 @@
 import logging
 from datetime import datetime, timedelta
 
-from . import DatabaseConnection
+from shared import DeadlineExceeded, TracedCursor, metrics
+
+from .analytics import ANALYTICS_ENABLED, get_analytics_engine
+from .lookup_filter import get_lookup_filter
+from .name_index import get_name_index
+from .pool import get_pool
+from .read_replica import get_read_replica
+from .result_set import ResultSet
+from .text_store import DocumentTextStore
+
+PATIENT_BY_NAME_QUERY = """
+    SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
+           p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+           p.AttendingPhysician, p.FacilityName,
+           i.InsuranceCompany
+    FROM Patients p
+    LEFT JOIN Insurance i ON p.PatientID = i.PatientID
+    WHERE p.PatientName LIKE %s
+    """
+
+PATIENT_BY_MRN_QUERY = """
+    SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
+           p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+           p.AttendingPhysician, p.FacilityName,
+           i.InsuranceCompany
+    FROM Patients p
+    LEFT JOIN Insurance i ON p.PatientID = i.PatientID
+    WHERE p.MedicalRecordNumber = %s
+    """
+
+# Expanded with one placeholder per PatientID by _get_fuzzy_patients
+PATIENTS_BY_IDS_QUERY = """
+    SELECT p.PatientID, p.PatientName, p.MedicalRecordNumber, p.DateOfBirth,
+           p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+           p.AttendingPhysician, p.FacilityName,
+           i.InsuranceCompany
+    FROM Patients p
+    LEFT JOIN Insurance i ON p.PatientID = i.PatientID
+    WHERE p.PatientID IN ({placeholders})
+    """
+
+PATIENTS_BY_DIAGNOSIS_QUERY = """
+    SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
+           p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+           p.AttendingPhysician, p.FacilityName,
+           i.InsuranceCompany
+    FROM Patients p
+    LEFT JOIN Insurance i ON p.PatientID = i.PatientID
+    WHERE p.PrimaryDiagnosis LIKE %s
+    """
+
+PATIENTS_BY_PHYSICIAN_QUERY = """
+    SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
+           p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+           p.AttendingPhysician, p.FacilityName,
+           i.InsuranceCompany
+    FROM Patients p
+    LEFT JOIN Insurance i ON p.PatientID = i.PatientID
+    WHERE p.AttendingPhysician LIKE %s
+    """
+
+PATIENTS_BY_INSURANCE_QUERY = """
+    SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
+           p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
+           p.AttendingPhysician, p.FacilityName,
+           i.InsuranceCompany
+    FROM Patients p
+    INNER JOIN Insurance i ON p.PatientID = i.PatientID
+    WHERE i.InsuranceCompany LIKE %s
+    """
+
+DOCUMENTS_SEARCH_QUERY = """
+    SELECT d.Filename, d.DocumentType, d.ProcessingStatus, d.CreatedDate,
+           pt.Accuracy, pt.Status
+    FROM Documents d
+    LEFT JOIN ProcessTable pt ON d.DocumentID = pt.DocumentID
+    WHERE d.DocumentType LIKE %s OR d.Filename LIKE %s
+    """
+
+# One row per linked document; counts come from here instead of from
+# duplicate Patients rows
+PATIENT_DOCUMENTS_QUERY = """
+    SELECT p.PatientName, p.MedicalRecordNumber,
+           d.DocumentID, d.Filename, d.DocumentType, d.ProcessingStatus,
+           d.CreatedDate
+    FROM Patients p
+    INNER JOIN PatientDocuments pd ON pd.PatientID = p.PatientID
+    INNER JOIN Documents d ON d.DocumentID = pd.DocumentID
+    WHERE p.MedicalRecordNumber = %s OR p.PatientName LIKE %s
+    ORDER BY d.CreatedDate DESC
+    """
+
+# Expanded with one placeholder per filename by _get_processing_status
+PROCESSING_STATUS_QUERY = """
+    SELECT d.DocumentID, d.Filename, d.ProcessingStatus, d.CreatedDate,
+           pt.Accuracy as ProcessAccuracy, pt.Status as ProcessStatus,
+           et.Accuracy as ExceptionAccuracy, et.Status as ExceptionStatus,
+           et.ErrorDetails
+    FROM Documents d
+    LEFT JOIN ProcessTable pt ON d.DocumentID = pt.DocumentID
+    LEFT JOIN ExceptionTable et ON d.DocumentID = et.DocumentID
+    WHERE d.Filename IN ({placeholders})
+    """
+
+STATUS_MAX_FILENAMES = 100
+
+TOTAL_PATIENTS_QUERY = "SELECT COUNT(*) as total_patients FROM Patients"
+
+TOTAL_DOCUMENTS_QUERY = "SELECT COUNT(*) as total_documents FROM Documents"
+
+TOP_DIAGNOSIS_QUERY = """
+    SELECT TOP 1 PrimaryDiagnosis, COUNT(*) as count 
+    FROM Patients 
+    WHERE PrimaryDiagnosis IS NOT NULL 
+    GROUP BY PrimaryDiagnosis 
+    ORDER BY count DESC
+    """
 
 
 class RetreiveData:
 
-    def __init__(self):
+    def __init__(self, name_index=None, lookup_filter=None):
+        """
+        Initialize the query layer
+
+        Args:
+            name_index: NameIndex for fuzzy lookups (the worker-wide one if None)
+            lookup_filter: PatientLookupFilter that rules out unknown MRNs and
+                names (the worker-wide one if None)
+        """
         self.logger = logging.getLogger(__name__)
+        self.name_index = name_index
+        self.lookup_filter = lookup_filter
+
+    def _lookup_verdict(self, mrn=None, name=None):
+        """
+        Ask the lookup filter whether a patient can match an MRN or name
+
+        With both given, a patient matching either one counts.
+
+        Returns:
+            False when no patient can match, True when one may, None when
+            the filter is off, not built yet or cannot tell
+        """
+        lookup_filter = self.lookup_filter
+        if lookup_filter is None:
+            lookup_filter = get_lookup_filter()
+        if lookup_filter is None:
+            return None
+
+        try:
+            verdicts = []
+            if mrn is not None:
+                verdicts.append(lookup_filter.check_mrn(mrn))
+            if name is not None:
+                verdicts.append(lookup_filter.check_name(name))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            # A filter that cannot refresh must not block the lookup itself
+            self.logger.warning(f"⚠️ Lookup filter unavailable: {str(e)}")
+            return None
+
+        metrics.increment("lookup_filter.checks")
+        if True in verdicts:
+            return True
+        if None in verdicts:
+            return None
+        metrics.increment("lookup_filter.skipped")
+        metrics.increment("lookup_filter.absent")
+        return False
+
+    def _record_lookup_miss(self, verdict) -> None:
+        """Count a "maybe" from the filter that the database answered with no rows"""
+        if verdict:
+            metrics.increment("lookup_filter.false_positives")
+            metrics.increment("lookup_filter.absent")
+
+    def _fetch_all(
+        self, query: str, params: tuple = (), allow_replica: bool = True
+    ) -> ResultSet:
+        """
+        Run a read query and return all rows
+
+        Served from the local read replica when it is enabled and current,
+        otherwise (or if the replica fails) on a pooled Azure SQL connection.
+        """
+        replica = get_read_replica() if allow_replica else None
+        if replica is not None:
+            try:
+                results = replica.fetch_all(query, params)
+                if results is not None:
+                    return results
+                metrics.increment("replica.stale_reads")
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                metrics.increment("replica.fallbacks")
+                self.logger.warning(f"⚠️ Read replica unavailable: {str(e)}")
+
+        with get_pool().connection() as (conn, _):
+            # Tuple rows under one header instead of a dict per row
+            cursor = TracedCursor(conn.cursor(as_dict=False))
+            cursor.execute(query, params)
+            return ResultSet.from_cursor(cursor)
 
     def _get_patient_by_name(self, name: str) -> dict:
         """Query database for patient by name"""
-        conn = None
         try:
             self.logger.info(f"🔍 Searching for patient: {name}")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
-            query = """
-            SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
-                   p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
-                   p.AttendingPhysician, p.FacilityName,
-                   i.InsuranceCompany
-            FROM Patients p
-            LEFT JOIN Insurance i ON p.PatientID = i.PatientID
-            WHERE p.PatientName LIKE %s
-            """
-
-            cursor.execute(query, (f"%{name}%",))
-            results = cursor.fetchall()
+            verdict = self._lookup_verdict(name=name)
+            if verdict is False:
+                self.logger.info(f"🚫 No patient name contains '{name}', skipping SQL")
+                results = ResultSet((), [])
+            else:
+                results = self._fetch_all(PATIENT_BY_NAME_QUERY, (f"%{name}%",))
+                self.logger.info(
+                    f"✅ Found {len(results)} patients matching '{name}'"
+                )
 
-            self.logger.info(f"✅ Found {len(results)} patients matching '{name}'")
+            if not results:
+                self._record_lookup_miss(verdict)
+                # OCR variants and typos ("Jon D0e") miss LIKE entirely
+                fuzzy = self._get_fuzzy_patients(name)
+                if fuzzy is not None:
+                    return fuzzy
 
             return {
                 "status": "success",
@@ -43,41 +236,72 @@ class RetreiveData:
                 "query_type": "patient_lookup",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Patient lookup failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
+    def _get_fuzzy_patients(self, name: str):
+        """
+        Look a name up in the fuzzy name index
+
+        Returns:
+            A patient_lookup result with "match": "fuzzy" and the ranked
+            candidates, or None when the index is off or finds nothing
+        """
+        name_index = self.name_index
+        if name_index is None:
+            name_index = get_name_index()
+        if name_index is None:
+            return None
+
+        matches = name_index.search(name)
+        metrics.increment("name_index.fallbacks")
+        if not matches:
+            return None
+        metrics.increment("name_index.fallback_hits")
+
+        patient_ids = [match["patient_id"] for match in matches]
+        query = PATIENTS_BY_IDS_QUERY.format(
+            placeholders=", ".join(["%s"] * len(patient_ids))
+        )
+        rank = {patient_id: position for position, patient_id in enumerate(patient_ids)}
+        found = self._fetch_all(query, tuple(patient_ids))
+        key = found.columns.index("PatientID")
+        found.rows.sort(key=lambda row: rank.get(row[key], len(rank)))
+        results = found.without("PatientID")
+
+        self.logger.info(
+            f"🔤 Fuzzy name match for '{name}': "
+            + ", ".join(f"{match['name']} ({match['score']})" for match in matches)
+        )
+
+        return {
+            "status": "success",
+            "data": results,
+            "count": len(results),
+            "query_type": "patient_lookup",
+            "match": "fuzzy",
+            "candidates": [
+                {"name": match["name"], "score": match["score"]} for match in matches
+            ],
+        }
 
     def _get_patient_by_mrn(self, mrn: str) -> dict:
         """Query database for patient by MRN"""
-        conn = None
         try:
             self.logger.info(f"🔍 Searching for patient with MRN: {mrn}")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
-            query = """
-            SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
-                   p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
-                   p.AttendingPhysician, p.FacilityName,
-                   i.InsuranceCompany
-            FROM Patients p
-            LEFT JOIN Insurance i ON p.PatientID = i.PatientID
-            WHERE p.MedicalRecordNumber = %s
-            """
-
-            cursor.execute(query, (mrn,))
-            results = cursor.fetchall()
-
-            self.logger.info(f"✅ Found {len(results)} patients with MRN '{mrn}'")
+            verdict = self._lookup_verdict(mrn=mrn)
+            if verdict is False:
+                self.logger.info(f"🚫 No patient has MRN '{mrn}', skipping SQL")
+                results = ResultSet((), [])
+            else:
+                results = self._fetch_all(PATIENT_BY_MRN_QUERY, (mrn,))
+                self.logger.info(f"✅ Found {len(results)} patients with MRN '{mrn}'")
+                if not results:
+                    self._record_lookup_miss(verdict)
 
             return {
                 "status": "success",
@@ -86,39 +310,18 @@ class RetreiveData:
                 "query_type": "mrn_lookup",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ MRN lookup failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
-
     def _get_patients_by_diagnosis(self, diagnosis: str) -> dict:
         """Query database for patients with specific diagnosis"""
-        conn = None
         try:
             self.logger.info(f"🔍 Searching for patients with diagnosis: {diagnosis}")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
-            query = """
-            SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
-                   p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
-                   p.AttendingPhysician, p.FacilityName,
-                   i.InsuranceCompany
-            FROM Patients p
-            LEFT JOIN Insurance i ON p.PatientID = i.PatientID
-            WHERE p.PrimaryDiagnosis LIKE %s
-            """
-
-            cursor.execute(query, (f"%{diagnosis}%",))
-            results = cursor.fetchall()
+            results = self._fetch_all(PATIENTS_BY_DIAGNOSIS_QUERY, (f"%{diagnosis}%",))
 
             self.logger.info(
                 f"✅ Found {len(results)} patients with diagnosis '{diagnosis}'"
@@ -131,39 +334,18 @@ class RetreiveData:
                 "query_type": "diagnosis_search",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Diagnosis search failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
-
     def _get_patients_by_physician(self, physician: str) -> dict:
         """Query database for patients treated by specific physician"""
-        conn = None
         try:
             self.logger.info(f"🔍 Searching for patients treated by: {physician}")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
-            query = """
-            SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
-                   p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
-                   p.AttendingPhysician, p.FacilityName,
-                   i.InsuranceCompany
-            FROM Patients p
-            LEFT JOIN Insurance i ON p.PatientID = i.PatientID
-            WHERE p.AttendingPhysician LIKE %s
-            """
-
-            cursor.execute(query, (f"%{physician}%",))
-            results = cursor.fetchall()
+            results = self._fetch_all(PATIENTS_BY_PHYSICIAN_QUERY, (f"%{physician}%",))
 
             self.logger.info(
                 f"✅ Found {len(results)} patients treated by '{physician}'"
@@ -176,39 +358,18 @@ class RetreiveData:
                 "query_type": "physician_search",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Physician search failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
-
     def _get_patients_by_insurance(self, insurance: str) -> dict:
         """Query database for patients with specific insurance"""
-        conn = None
         try:
             self.logger.info(f"🔍 Searching for patients with insurance: {insurance}")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
-            query = """
-            SELECT p.PatientName, p.MedicalRecordNumber, p.DateOfBirth, 
-                   p.PrimaryDiagnosis, p.AdmissionDate, p.DischargeDate,
-                   p.AttendingPhysician, p.FacilityName,
-                   i.InsuranceCompany
-            FROM Patients p
-            INNER JOIN Insurance i ON p.PatientID = i.PatientID
-            WHERE i.InsuranceCompany LIKE %s
-            """
-
-            cursor.execute(query, (f"%{insurance}%",))
-            results = cursor.fetchall()
+            results = self._fetch_all(PATIENTS_BY_INSURANCE_QUERY, (f"%{insurance}%",))
 
             self.logger.info(
                 f"✅ Found {len(results)} patients with insurance '{insurance}'"
@@ -221,38 +382,21 @@ class RetreiveData:
                 "query_type": "insurance_search",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Insurance search failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
-
     def _get_documents_search(self, search_param: str) -> dict:
         """Query database for documents by type or filename"""
-        conn = None
         try:
             self.logger.info(f"🔍 Searching for documents: {search_param}")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
-            query = """
-            SELECT d.Filename, d.DocumentType, d.ProcessingStatus, d.CreatedDate,
-                   pt.Accuracy, pt.Status
-            FROM Documents d
-            LEFT JOIN ProcessTable pt ON d.DocumentID = pt.DocumentID
-            WHERE d.DocumentType LIKE %s OR d.Filename LIKE %s
-            """
-
             search_pattern = f"%{search_param}%"
-            cursor.execute(query, (search_pattern, search_pattern))
-            results = cursor.fetchall()
+            results = self._fetch_all(
+                DOCUMENTS_SEARCH_QUERY, (search_pattern, search_pattern)
+            )
 
             self.logger.info(
                 f"✅ Found {len(results)} documents matching '{search_param}'"
@@ -265,51 +409,129 @@ class RetreiveData:
                 "query_type": "document_search",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Document search failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
+    def _get_patient_documents(self, patient: str) -> dict:
+        """Query database for the documents linked to a patient (name or MRN)"""
+        try:
+            self.logger.info(f"🔍 Listing documents for patient: {patient}")
+
+            # Patients without documents also return no rows, so misses
+            # here say nothing about the filter's false-positive rate
+            if self._lookup_verdict(mrn=patient, name=patient) is False:
+                self.logger.info(f"🚫 No patient matches '{patient}', skipping SQL")
+                results = ResultSet((), [])
+            else:
+                results = self._fetch_all(
+                    PATIENT_DOCUMENTS_QUERY, (patient, f"%{patient}%")
+                )
+                self.logger.info(f"✅ Found {len(results)} documents for '{patient}'")
+
+            return {
+                "status": "success",
+                "data": results,
+                "count": len(results),
+                "query_type": "patient_documents",
+            }
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.logger.error(f"❌ Patient documents lookup failed: {str(e)}")
+            return {"status": "error", "message": str(e)}
+
+    def _get_processing_status(self, filenames: list, since: str = None) -> dict:
+        """
+        Report ingestion state for many uploaded files in one query
+
+        Args:
+            filenames: Uploaded file names
+            since: Only documents created at or after this time count, so a
+                re-upload doesn't report the previous upload's state
+        """
+        try:
+            filenames = list(dict.fromkeys(filenames))[:STATUS_MAX_FILENAMES]
+            self.logger.info(f"🔍 Checking processing status of {len(filenames)} files")
+
+            statuses = {
+                filename: {"state": "pending", "document_id": None}
+                for filename in filenames
+            }
+            if not filenames:
+                return {
+                    "status": "success",
+                    "data": statuses,
+                    "count": 0,
+                    "query_type": "processing_status",
+                }
+
+            query = PROCESSING_STATUS_QUERY.format(
+                placeholders=", ".join(["%s"] * len(filenames))
+            )
+            params = tuple(filenames)
+            if since:
+                query += "AND d.CreatedDate >= %s"
+                params += (since,)
+            # Upload polling needs the current state, never a replica copy
+            results = self._fetch_all(query, params, allow_replica=False)
+
+            # Re-uploads create new Documents rows; the newest one wins
+            for row in sorted(results, key=lambda row: row["DocumentID"]):
+                if row["ProcessStatus"]:
+                    state, accuracy = "processed", row["ProcessAccuracy"]
+                elif row["ExceptionStatus"]:
+                    state, accuracy = "exception", row["ExceptionAccuracy"]
+                else:
+                    state, accuracy = "processing", None
+
+                statuses[row["Filename"]] = {
+                    "state": state,
+                    "document_id": row["DocumentID"],
+                    "accuracy": accuracy,
+                    "processing_status": row["ProcessingStatus"],
+                    "error_details": row["ErrorDetails"],
+                    "created_date": row["CreatedDate"],
+                }
+
+            self.logger.info(f"✅ Found {len(results)} documents for status check")
+
+            return {
+                "status": "success",
+                "data": statuses,
+                "count": len(results),
+                "query_type": "processing_status",
+            }
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.logger.error(f"❌ Processing status check failed: {str(e)}")
+            return {"status": "error", "message": str(e)}
 
     def _get_stats_summary(self, param: str) -> dict:
         """Query database for basic statistics"""
-        conn = None
         try:
             self.logger.info(f"🔍 Getting statistics summary")
 
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if not conn or not cursor:
-                return {"status": "error", "message": "Database connection failed"}
-
             # Get basic counts
             stats = {}
 
             # Total patients
-            cursor.execute("SELECT COUNT(*) as total_patients FROM Patients")
-            result = cursor.fetchone()
+            result = self._fetch_all(TOTAL_PATIENTS_QUERY)[0]
             stats["total_patients"] = result["total_patients"]
 
             # Total documents
-            cursor.execute("SELECT COUNT(*) as total_documents FROM Documents")
-            result = cursor.fetchone()
+            result = self._fetch_all(TOTAL_DOCUMENTS_QUERY)[0]
             stats["total_documents"] = result["total_documents"]
 
             # Top diagnosis
-            cursor.execute(
-                """
-                SELECT TOP 1 PrimaryDiagnosis, COUNT(*) as count 
-                FROM Patients 
-                WHERE PrimaryDiagnosis IS NOT NULL 
-                GROUP BY PrimaryDiagnosis 
-                ORDER BY count DESC
-            """
-            )
-            result = cursor.fetchone()
+            rows = self._fetch_all(TOP_DIAGNOSIS_QUERY)
+            result = rows[0] if rows else None
+
             if result:
                 stats["top_diagnosis"] = (
                     f"{result['PrimaryDiagnosis']} ({result['count']} cases)"
@@ -326,11 +548,72 @@ class RetreiveData:
                 "query_type": "stats_summary",
             }
 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Stats summary failed: {str(e)}")
             return {"status": "error", "message": str(e)}
 
-        finally:
-            if conn:
-                conn.close()
-                self.logger.info("🔐 Database connection closed")
+    def _get_analytics(self, query) -> dict:
+        """Answer an aggregate question from the columnar analytics snapshot"""
+        try:
+            self.logger.info(f"🔍 Running analytics query: {query}")
+
+            engine = get_analytics_engine()
+            if engine is None and not ANALYTICS_ENABLED:
+                return {
+                    "status": "unsupported",
+                    "message": "Analytics questions are turned off on this service",
+                }
+            if engine is None:
+                # The first snapshot is being built in the background
+                return {
+                    "status": "unsupported",
+                    "message": (
+                        "Analytics are still being prepared, "
+                        "please ask again in a minute"
+                    ),
+                }
+            result = engine.run(query)
+
+            self.logger.info(
+                f"✅ Analytics query matched {result['matched']} rows "
+                f"in {result['groups']} groups"
+            )
+
+            return {
+                "status": "success",
+                "data": result["rows"],
+                "count": len(result["rows"]),
+                "groups": result["groups"],
+                "matched": result["matched"],
+                "snapshot_version": engine.snapshot.version,
+                "query_type": "analytics_query",
+            }
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.logger.error(f"❌ Analytics query failed: {str(e)}")
+            return {"status": "error", "message": str(e)}
+
+    def _get_document_text(self, document_id: int) -> dict:
+        """Load the full OCR text of one document on demand"""
+        try:
+            self.logger.info(f"🔍 Loading text for document: {document_id}")
+
+            with get_pool().connection() as (conn, cursor):
+                text = DocumentTextStore(conn, cursor).load(document_id)
+
+            return {
+                "status": "success",
+                "data": text,
+                "count": 1 if text is not None else 0,
+                "query_type": "document_text",
+            }
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            self.logger.error(f"❌ Document text load failed: {str(e)}")
+            return {"status": "error", "message": str(e)}
@@ -0,0 +1,536 @@
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+# Column definitions use SQL Server types; the SQLite stand-in derives its
+# types from them in _sqlite_column_type.
+TABLES: Dict[str, List[Tuple[str, str]]] = {
+    "Documents": [
+        ("DocumentID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("Filename", "NVARCHAR(255) NOT NULL"),
+        ("DocumentType", "NVARCHAR(50) NULL"),
+        ("ProcessingStatus", "NVARCHAR(50) NULL"),
+        ("RawText", "NVARCHAR(MAX) NULL"),
+        ("CreatedDate", "DATETIME2 NOT NULL"),
+    ],
+    "Patients": [
+        ("PatientID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("PatientName", "NVARCHAR(100) NULL"),
+        ("MedicalRecordNumber", "NVARCHAR(50) NULL"),
+        ("DateOfBirth", "DATE NULL"),
+        ("PrimaryDiagnosis", "NVARCHAR(200) NULL"),
+        ("AdmissionDate", "DATE NULL"),
+        ("DischargeDate", "DATE NULL"),
+        ("AttendingPhysician", "NVARCHAR(100) NULL"),
+        ("FacilityName", "NVARCHAR(100) NULL"),
+        ("DocumentID", "INT NULL REFERENCES Documents(DocumentID)"),
+    ],
+    "Insurance": [
+        ("InsuranceID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("PatientID", "INT NOT NULL REFERENCES Patients(PatientID)"),
+        ("InsuranceCompany", "NVARCHAR(100) NULL"),
+        ("DocumentID", "INT NULL REFERENCES Documents(DocumentID)"),
+    ],
+    "ProcessTable": [
+        ("ProcessID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("FileName", "NVARCHAR(255) NOT NULL"),
+        ("Accuracy", "FLOAT NULL"),
+        ("Status", "NVARCHAR(50) NULL"),
+        ("Type", "NVARCHAR(50) NULL"),
+        ("IngestedDate", "DATE NULL"),
+        ("IngestedTime", "TIME NULL"),
+        ("DocumentID", "INT NULL REFERENCES Documents(DocumentID)"),
+    ],
+    "ExceptionTable": [
+        ("ExceptionID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("FileName", "NVARCHAR(255) NOT NULL"),
+        ("Accuracy", "FLOAT NULL"),
+        ("Status", "NVARCHAR(50) NULL"),
+        ("Type", "NVARCHAR(15) NULL"),
+        ("IngestedDate", "DATE NULL"),
+        ("IngestedTime", "TIME NULL"),
+        ("ErrorDetails", "NVARCHAR(500) NULL"),
+        ("RawExtractedData", "NVARCHAR(1000) NULL"),
+        ("DocumentID", "INT NULL REFERENCES Documents(DocumentID)"),
+    ],
+    "DocumentText": [
+        ("DocumentID", "INT NOT NULL PRIMARY KEY REFERENCES Documents(DocumentID)"),
+        ("Codec", "NVARCHAR(10) NOT NULL"),
+        ("TextLength", "INT NOT NULL"),
+        ("CompressedText", "VARBINARY(MAX) NOT NULL"),
+    ],
+    "PatientDocuments": [
+        ("PatientDocumentID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("PatientID", "INT NOT NULL REFERENCES Patients(PatientID)"),
+        ("DocumentID", "INT NOT NULL REFERENCES Documents(DocumentID)"),
+        ("LinkedDate", "DATETIME2 NOT NULL"),
+    ],
+    # One row per document rewritten in place, so caches synced by
+    # DocumentID can pick up changes to rows they have already read
+    "ChangeLog": [
+        ("ChangeID", "INT IDENTITY(1,1) PRIMARY KEY"),
+        ("DocumentID", "INT NULL REFERENCES Documents(DocumentID)"),
+        ("PatientID", "INT NULL REFERENCES Patients(PatientID)"),
+        ("ChangedDate", "DATETIME2 NOT NULL"),
+    ],
+}
+
+# Normalized name expression shared by the persisted computed columns.
+# Both SQL Server and SQLite understand UPPER/LTRIM/RTRIM.
+NORMALIZED_NAME_EXPRESSION = "UPPER(LTRIM(RTRIM({column})))"
+
+# Patient columns merged into the surviving row when duplicates collapse
+PATIENT_MERGE_COLUMNS = [
+    "PatientName",
+    "DateOfBirth",
+    "PrimaryDiagnosis",
+    "AdmissionDate",
+    "DischargeDate",
+    "AttendingPhysician",
+    "FacilityName",
+    "DocumentID",
+]
+
+# What ingest stored for a missing MRN before DatabaseOperations._clean;
+# these must not group unrelated patients as if they shared an MRN
+PLACEHOLDER_MRNS = ("", "null", "none")
+
+# Lowest PatientID sharing the MRN of the outer Patients row
+_CANONICAL_PATIENT = (
+    "(SELECT MIN(c.PatientID) FROM Patients c "
+    "WHERE c.MedicalRecordNumber = Patients.MedicalRecordNumber)"
+)
+_LATEST_PATIENT = (
+    "(SELECT MAX(c.PatientID) FROM Patients c "
+    "WHERE c.MedicalRecordNumber = Patients.MedicalRecordNumber)"
+)
+
+
+def _repoint_to_canonical(table: str) -> str:
+    """Move rows of table from duplicate patients onto the canonical one"""
+    return (
+        f"UPDATE {table} SET PatientID = ("
+        "SELECT MIN(c.PatientID) FROM Patients c "
+        "INNER JOIN Patients p ON c.MedicalRecordNumber = p.MedicalRecordNumber "
+        f"WHERE p.PatientID = {table}.PatientID) "
+        "WHERE PatientID IN ("
+        "SELECT p.PatientID FROM Patients p WHERE p.MedicalRecordNumber IS NOT NULL)"
+    )
+
+
+class Migration:
+    """A numbered, forward-only schema change"""
+
+    def __init__(self, version: int, description: str, operations: List[tuple]):
+        self.version = version
+        self.description = description
+        self.operations = operations
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        "Base tables",
+        [
+            ("create_table", name)
+            for name in [
+                "Documents",
+                "Patients",
+                "Insurance",
+                "ProcessTable",
+                "ExceptionTable",
+            ]
+        ],
+    ),
+    Migration(
+        2,
+        "Lookup indexes for RetreiveData queries",
+        [
+            (
+                "create_index",
+                "IX_Patients_MedicalRecordNumber",
+                "Patients",
+                ["MedicalRecordNumber"],
+            ),
+            ("create_index", "IX_Insurance_PatientID", "Insurance", ["PatientID"]),
+            (
+                "create_index",
+                "IX_ProcessTable_DocumentID",
+                "ProcessTable",
+                ["DocumentID"],
+            ),
+            (
+                "create_index",
+                "IX_ExceptionTable_DocumentID",
+                "ExceptionTable",
+                ["DocumentID"],
+            ),
+        ],
+    ),
+    Migration(
+        3,
+        "Persisted normalized name columns",
+        [
+            (
+                "add_computed_column",
+                "Patients",
+                "PatientNameNormalized",
+                NORMALIZED_NAME_EXPRESSION.format(column="PatientName"),
+            ),
+            (
+                "add_computed_column",
+                "Patients",
+                "AttendingPhysicianNormalized",
+                NORMALIZED_NAME_EXPRESSION.format(column="AttendingPhysician"),
+            ),
+            (
+                "add_computed_column",
+                "Insurance",
+                "InsuranceCompanyNormalized",
+                NORMALIZED_NAME_EXPRESSION.format(column="InsuranceCompany"),
+            ),
+            (
+                "create_index",
+                "IX_Patients_PatientNameNormalized",
+                "Patients",
+                ["PatientNameNormalized"],
+            ),
+            (
+                "create_index",
+                "IX_Patients_AttendingPhysicianNormalized",
+                "Patients",
+                ["AttendingPhysicianNormalized"],
+            ),
+            (
+                "create_index",
+                "IX_Insurance_InsuranceCompanyNormalized",
+                "Insurance",
+                ["InsuranceCompanyNormalized"],
+            ),
+        ],
+    ),
+    Migration(
+        4,
+        "Compressed full OCR text kept off the Documents row",
+        [("create_table", "DocumentText")],
+    ),
+    Migration(
+        5,
+        "Filename index for processing-status lookups",
+        [("create_index", "IX_Documents_Filename", "Documents", ["Filename"])],
+    ),
+    Migration(
+        6,
+        "Patient to document link table",
+        [
+            ("create_table", "PatientDocuments"),
+            (
+                "create_unique_index",
+                "UX_PatientDocuments_PatientID_DocumentID",
+                "PatientDocuments",
+                ["PatientID", "DocumentID"],
+            ),
+            (
+                "create_index",
+                "IX_PatientDocuments_DocumentID",
+                "PatientDocuments",
+                ["DocumentID"],
+            ),
+            (
+                "execute",
+                "INSERT INTO PatientDocuments (PatientID, DocumentID, LinkedDate) "
+                "SELECT p.PatientID, p.DocumentID, d.CreatedDate "
+                "FROM Patients p "
+                "INNER JOIN Documents d ON d.DocumentID = p.DocumentID "
+                "WHERE NOT EXISTS (SELECT 1 FROM PatientDocuments pd "
+                "WHERE pd.PatientID = p.PatientID AND pd.DocumentID = p.DocumentID)",
+            ),
+        ],
+    ),
+    Migration(
+        7,
+        "Merge duplicate patient rows sharing an MRN",
+        # The most recently ingested non-null value wins, matching the
+        # merge rule DatabaseOperations applies at ingest
+        [
+            (
+                "execute",
+                "UPDATE Patients SET MedicalRecordNumber = NULL "
+                "WHERE LOWER(LTRIM(RTRIM(MedicalRecordNumber))) IN ("
+                + ", ".join(f"'{placeholder}'" for placeholder in PLACEHOLDER_MRNS)
+                + ")",
+            ),
+            (
+                "execute",
+                "UPDATE Patients SET "
+                + ", ".join(
+                    f"{column} = COALESCE((SELECT n.{column} FROM Patients n "
+                    f"WHERE n.PatientID = {_LATEST_PATIENT}), {column})"
+                    for column in PATIENT_MERGE_COLUMNS
+                )
+                + f" WHERE MedicalRecordNumber IS NOT NULL "
+                f"AND PatientID = {_CANONICAL_PATIENT}",
+            ),
+            ("execute", _repoint_to_canonical("PatientDocuments")),
+            ("execute", _repoint_to_canonical("Insurance")),
+            (
+                "execute",
+                "DELETE FROM Insurance WHERE InsuranceID > ("
+                "SELECT MIN(i.InsuranceID) FROM Insurance i "
+                "WHERE i.PatientID = Insurance.PatientID "
+                "AND i.InsuranceCompanyNormalized = Insurance.InsuranceCompanyNormalized)",
+            ),
+            (
+                "execute",
+                "DELETE FROM Patients WHERE MedicalRecordNumber IS NOT NULL "
+                f"AND PatientID > {_CANONICAL_PATIENT}",
+            ),
+        ],
+    ),
+    Migration(
+        8,
+        "Extraction version and extracted fields on Documents",
+        [
+            ("add_column", "Documents", "ExtractionVersion", "NVARCHAR(16) NULL"),
+            ("add_column", "Documents", "ExtractedData", "NVARCHAR(MAX) NULL"),
+        ],
+    ),
+    Migration(
+        9,
+        "Change log of rows rewritten in place",
+        [("create_table", "ChangeLog")],
+    ),
+]
+
+
+def _sqlite_column_type(mssql_type: str) -> str:
+    """Map a SQL Server column definition to its SQLite stand-in"""
+    if "IDENTITY" in mssql_type:
+        return "INTEGER PRIMARY KEY AUTOINCREMENT"
+    definition = re.sub(r"N?VARCHAR\((\d+|MAX)\)", "TEXT", mssql_type)
+    definition = re.sub(r"VARBINARY\((\d+|MAX)\)", "BLOB", definition)
+    definition = definition.replace("DATETIME2", "DATETIME")
+    definition = definition.replace("FLOAT", "REAL")
+    definition = re.sub(r"\bTIME\b", "TEXT", definition)
+    return re.sub(r"\bINT\b", "INTEGER", definition)
+
+
+def _render_mssql(operation: tuple) -> str:
+    """Render an idempotent T-SQL statement for one migration operation"""
+    kind = operation[0]
+
+    if kind == "create_table":
+        table = operation[1]
+        columns = ",\n    ".join(f"{name} {ctype}" for name, ctype in TABLES[table])
+        return (
+            f"IF OBJECT_ID('{table}', 'U') IS NULL\n"
+            f"CREATE TABLE {table} (\n    {columns}\n)"
+        )
+
+    if kind == "create_index":
+        _, index, table, columns = operation
+        return (
+            f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{index}' "
+            f"AND object_id = OBJECT_ID('{table}'))\n"
+            f"CREATE INDEX {index} ON {table} ({', '.join(columns)})"
+        )
+
+    if kind == "create_unique_index":
+        _, index, table, columns = operation
+        return (
+            f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{index}' "
+            f"AND object_id = OBJECT_ID('{table}'))\n"
+            f"CREATE UNIQUE INDEX {index} ON {table} ({', '.join(columns)})"
+        )
+
+    if kind == "execute":
+        # Data migrations are written in SQL both dialects accept
+        return operation[1]
+
+    if kind == "add_column":
+        _, table, column, ctype = operation
+        return (
+            f"IF COL_LENGTH('{table}', '{column}') IS NULL\n"
+            f"ALTER TABLE {table} ADD {column} {ctype}"
+        )
+
+    if kind == "add_computed_column":
+        _, table, column, expression = operation
+        return (
+            f"IF COL_LENGTH('{table}', '{column}') IS NULL\n"
+            f"ALTER TABLE {table} ADD {column} AS {expression} PERSISTED"
+        )
+
+    raise ValueError(f"Unknown migration operation: {kind}")
+
+
+def _render_sqlite(operation: tuple) -> str:
+    """Render the SQLite stand-in statement for one migration operation"""
+    kind = operation[0]
+
+    if kind == "create_table":
+        table = operation[1]
+        columns = ",\n    ".join(
+            f"{name} {_sqlite_column_type(ctype)}" for name, ctype in TABLES[table]
+        )
+        return f"CREATE TABLE IF NOT EXISTS {table} (\n    {columns}\n)"
+
+    if kind == "create_index":
+        _, index, table, columns = operation
+        return f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({', '.join(columns)})"
+
+    if kind == "create_unique_index":
+        _, index, table, columns = operation
+        return (
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {index} "
+            f"ON {table} ({', '.join(columns)})"
+        )
+
+    if kind == "execute":
+        return operation[1]
+
+    if kind == "add_column":
+        _, table, column, ctype = operation
+        return f"ALTER TABLE {table} ADD COLUMN {column} {_sqlite_column_type(ctype)}"
+
+    if kind == "add_computed_column":
+        # SQLite can only add VIRTUAL generated columns to an existing table,
+        # which is enough for the planner to use an index on them
+        _, table, column, expression = operation
+        return (
+            f"ALTER TABLE {table} ADD COLUMN {column} TEXT "
+            f"GENERATED ALWAYS AS ({expression}) VIRTUAL"
+        )
+
+    raise ValueError(f"Unknown migration operation: {kind}")
+
+
+def to_sqlite(query: str) -> str:
+    """Translate a pymssql query to the SQLite stand-in dialect"""
+    query = query.replace("%s", "?")
+    top = re.search(r"\bSELECT\s+TOP\s+(\d+)\s", query, re.IGNORECASE)
+    if top:
+        query = query[: top.start()] + "SELECT " + query[top.end() :]
+        query = query.rstrip() + f"\n    LIMIT {top.group(1)}"
+    return query
+
+
+class SchemaMigrator:
+    """Applies pending MIGRATIONS and records them in SchemaVersion"""
+
+    def __init__(self, connection, cursor, dialect: str = "mssql"):
+        """
+        Initialize with an open connection
+
+        Args:
+            connection: pymssql or sqlite3 connection
+            cursor: Cursor on that connection
+            dialect: "mssql" for Azure SQL, "sqlite" for the local stand-in
+        """
+        if dialect not in ("mssql", "sqlite"):
+            raise ValueError(f"Unsupported dialect: {dialect}")
+
+        self.conn = connection
+        self.cursor = cursor
+        self.dialect = dialect
+        self.placeholder = "%s" if dialect == "mssql" else "?"
+        self.logger = logging.getLogger(__name__)
+
+    def render(self, operation: tuple) -> str:
+        if self.dialect == "mssql":
+            return _render_mssql(operation)
+        return _render_sqlite(operation)
+
+    def _ensure_version_table(self) -> None:
+        if self.dialect == "mssql":
+            self.cursor.execute(
+                """
+                IF OBJECT_ID('SchemaVersion', 'U') IS NULL
+                CREATE TABLE SchemaVersion (
+                    Version INT PRIMARY KEY,
+                    Description NVARCHAR(200) NOT NULL,
+                    AppliedDate DATETIME2 NOT NULL
+                )
+            """
+            )
+        else:
+            self.cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS SchemaVersion (
+                    Version INTEGER PRIMARY KEY,
+                    Description TEXT NOT NULL,
+                    AppliedDate DATETIME NOT NULL
+                )
+            """
+            )
+        self.conn.commit()
+
+    def current_version(self) -> int:
+        """Return the highest applied migration version (0 for a new database)"""
+        self._ensure_version_table()
+        self.cursor.execute("SELECT MAX(Version) as Version FROM SchemaVersion")
+        row = self.cursor.fetchone()
+        return int(row["Version"] or 0) if row else 0
+
+    def migrate(self, target_version: int = None) -> List[int]:
+        """
+        Apply all pending migrations up to target_version
+
+        Args:
+            target_version: Last version to apply (defaults to the newest)
+
+        Returns:
+            List of versions applied by this call
+        """
+        current = self.current_version()
+        applied = []
+
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            if target_version is not None and migration.version > target_version:
+                break
+
+            self.logger.info(
+                f"🛠️ Applying schema migration {migration.version}: {migration.description}"
+            )
+            try:
+                for operation in migration.operations:
+                    self.cursor.execute(self.render(operation))
+
+                self.cursor.execute(
+                    "INSERT INTO SchemaVersion (Version, Description, AppliedDate) "
+                    f"VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder})",
+                    (
+                        migration.version,
+                        migration.description,
+                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    ),
+                )
+                self.conn.commit()
+                applied.append(migration.version)
+
+            except Exception as e:
+                self.logger.error(
+                    f"❌ Schema migration {migration.version} failed: {str(e)}"
+                )
+                self.conn.rollback()
+                raise e
+
+        if applied:
+            self.logger.info(f"✅ Schema now at version {applied[-1]}")
+        else:
+            self.logger.info(f"✅ Schema up to date at version {current}")
+        return applied
+
+
+if __name__ == "__main__":
+    from .connection import DatabaseConnection
+
+    logging.basicConfig(level=logging.INFO)
+    conn, cursor = DatabaseConnection().connect_with_retry()
+    try:
+        SchemaMigrator(conn, cursor).migrate()
+    finally:
+        conn.close()
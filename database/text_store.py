@@ -0,0 +1,122 @@
+import logging
+import os
+import zlib
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+ZLIB_LEVEL = int(os.environ.get("DOCUMENT_TEXT_ZLIB_LEVEL", "6"))
+ZSTD_LEVEL = int(os.environ.get("DOCUMENT_TEXT_ZSTD_LEVEL", "10"))
+
+
+def compress_text(text: str) -> Tuple[str, bytes]:
+    """Compress OCR text with zstd when installed, zlib otherwise"""
+    raw = text.encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress_text(codec: str, payload: bytes) -> str:
+    """Reverse compress_text for a stored (codec, payload) pair"""
+    if codec == "zlib":
+        return zlib.decompress(payload).decode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd document text")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown document text codec: {codec}")
+
+
+class DocumentTextStore:
+    """Stores full OCR text compressed in DocumentText, away from Documents"""
+
+    def __init__(self, connection, cursor):
+        """Initialize with database connection and cursor"""
+        self.conn = connection
+        self.cursor = cursor
+        self.logger = logging.getLogger(__name__)
+
+    def save(self, document_id: int, text: str) -> None:
+        """
+        Insert the compressed text for a document (caller commits)
+
+        Args:
+            document_id: Documents.DocumentID the text belongs to
+            text: Full extracted OCR text
+        """
+        codec, payload = compress_text(text)
+        self.cursor.execute(
+            """
+            INSERT INTO DocumentText (DocumentID, Codec, TextLength, CompressedText)
+            VALUES (%s, %s, %s, %s)
+        """,
+            (document_id, codec, len(text), payload),
+        )
+        self.logger.info(
+            f"✅ Stored {len(text)} characters of text as {len(payload)} {codec} bytes"
+        )
+
+    def load(self, document_id: int) -> Optional[str]:
+        """
+        Load the full text for a document
+
+        Falls back to the legacy Documents.RawText column for rows ingested
+        before DocumentText existed.
+        """
+        self.cursor.execute(
+            "SELECT Codec, CompressedText FROM DocumentText WHERE DocumentID = %s",
+            (document_id,),
+        )
+        row = self.cursor.fetchone()
+        if row:
+            return decompress_text(row["Codec"], bytes(row["CompressedText"]))
+
+        self.cursor.execute(
+            "SELECT RawText FROM Documents WHERE DocumentID = %s", (document_id,)
+        )
+        row = self.cursor.fetchone()
+        return row["RawText"] if row else None
+
+    def load_many(self, document_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Load the full text of several documents in two queries
+
+        Returns:
+            Text by DocumentID; documents without any stored text are absent
+        """
+        document_ids = list(document_ids)
+        if not document_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(document_ids))
+
+        self.cursor.execute(
+            "SELECT DocumentID, Codec, CompressedText FROM DocumentText "
+            f"WHERE DocumentID IN ({placeholders})",
+            tuple(document_ids),
+        )
+        texts = {
+            int(row["DocumentID"]): decompress_text(
+                row["Codec"], bytes(row["CompressedText"])
+            )
+            for row in self.cursor.fetchall()
+        }
+
+        legacy = [
+            document_id for document_id in document_ids if document_id not in texts
+        ]
+        if legacy:
+            self.cursor.execute(
+                "SELECT DocumentID, RawText FROM Documents "
+                f"WHERE DocumentID IN ({', '.join(['%s'] * len(legacy))}) "
+                "AND RawText IS NOT NULL",
+                tuple(legacy),
+            )
+            texts.update(
+                (int(row["DocumentID"]), row["RawText"])
+                for row in self.cursor.fetchall()
+            )
+        return texts
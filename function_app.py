@@ -1,23 +1,59 @@
 import json
 import logging
 import os
+import resource
+from datetime import datetime, timezone
 
 import azure.functions as func
 
-from database import DatabaseConnection, DatabaseOperations
+from database import (
+    DatabaseConnection,
+    DatabaseOperations,
+    ExportPage,
+    RetreiveData,
+    encode_json,
+    get_pool,
+)
+from database.export import EXPORT_PAGE_ROWS
 from processors import (
     ChatProcessor,
     DataValidator,
     DocumentIntelligenceProcessor,
-    OpenAIExtractor,
+    RuleExtractor,
+)
+from processors.checkpoints import (
+    IngestCheckpoints,
+    IngestOutcomes,
+    ReplayQueue,
+    spool_and_hash,
+)
+from processors.document_intelligence import MAX_BLOB_BYTES
+from processors.openai_extractor import extraction_version
+from processors.warmup import WorkerWarmup, warm_up_in_background
+from shared import (
+    DeadlineExceeded,
+    Overloaded,
+    chat_admission,
+    chat_recorder,
+    deadline,
+    install_log_correlation,
+    metrics,
+    tracer,
 )
+from shared.deadline import CHAT_DEADLINE_SECONDS
 
 # Configure logging properly for Azure Functions
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Prefix log lines with the active trace id so one request can be followed
+install_log_correlation()
 
 app = func.FunctionApp()
 
+# Opt-in: pay connection, TLS and client setup costs as the worker starts
+if os.environ.get("WARMUP_ON_START", "false").lower() == "true":
+    warm_up_in_background()
+
 
 @app.blob_trigger(
     arg_name="myblob", path="pdfs/{name}", connection="pdfstorageci0001_STORAGE"
@@ -27,45 +63,222 @@ def ProcessPdfBlob(myblob: func.InputStream):
     logger.info(f"Name: {myblob.name}")
     logger.info(f"Blob Size: {myblob.length} bytes")
 
+    if myblob.length and myblob.length > MAX_BLOB_BYTES:
+        # Retrying cannot help, so don't raise into the platform retry loop
+        logger.error(
+            f"❌ Blob is {myblob.length} bytes, over the {MAX_BLOB_BYTES} byte ceiling"
+        )
+        _record_outcome(
+            myblob.name.split("/")[-1],
+            "rejected",
+            f"File is {myblob.length / 1e6:.0f} MB, over the "
+            f"{MAX_BLOB_BYTES / 1e6:.0f} MB limit",
+        )
+        return
+
+    with tracer.start_span(
+        "ProcessPdfBlob", **{"blob.name": myblob.name, "blob.size": myblob.length}
+    ):
+        try:
+            # extract file name
+            filename = myblob.name.split("/")[-1]  # Gets filename from 'pdfs/filename.pdf'
+
+            # hash while spooling, so retries can find this version's checkpoints
+            content_hash, document = spool_and_hash(myblob)
+            checkpoints = _open_checkpoints(myblob.name, content_hash)
+
+            if checkpoints is not None and checkpoints.completed("persisted"):
+                logger.info(f"⏭️ {filename} was already persisted, nothing to do")
+                return
+
+            # extract text with doc intelligence, unless a previous run did
+            extracted_text = _load_checkpoint(checkpoints, "ocr")
+            if extracted_text is None:
+                doc_processor = DocumentIntelligenceProcessor()
+                extracted_text = doc_processor.extract_text(document, filename)
+                ocr_saved = _save_checkpoint(checkpoints, "ocr", extracted_text)
+            else:
+                metrics.increment("checkpoint.ocr_reused")
+                ocr_saved = True
+
+            # structure data: labeled fields by rule, the rest with ai
+            extraction = _load_checkpoint(checkpoints, "extraction")
+            if extraction is None:
+                extracted_data = RuleExtractor().extract_document(
+                    extracted_text, filename
+                )
+
+                # validate results
+                validator = DataValidator()
+                accuracy, is_success = validator.validate_data(extracted_data)
+                version = extraction_version()
+                extraction_saved = _save_checkpoint(
+                    checkpoints,
+                    "extraction",
+                    {"data": extracted_data, "accuracy": accuracy, "version": version},
+                )
+            else:
+                metrics.increment("checkpoint.extraction_reused")
+                extracted_data = extraction["data"]
+                accuracy = extraction["accuracy"]
+                # Checkpoints written before versioning leave it for re-extraction
+                version = extraction.get("version")
+                extraction_saved = True
+
+            # db
+            try:
+                _persist(extracted_data, extracted_text, filename, accuracy, version)
+                _save_checkpoint(checkpoints, "persisted", {"filename": filename})
+
+            except Exception as db_error:
+                logger.error(f"❌ Database operation failed: {str(db_error)}")
+                logger.error(f"Error type: {type(db_error).__name__}")
+                if not (ocr_saved and extraction_saved):
+                    # The drain job would find nothing to write; rerun instead
+                    raise
+                # OCR and extraction are paid for; the drain job retries the write
+                ReplayQueue(checkpoints.container).enqueue(
+                    checkpoints, filename, accuracy
+                )
+                metrics.increment("replay.queued")
+                _record_outcome(
+                    filename, "queued", "Extracted; saving once the database is back"
+                )
+
+        except Exception as e:
+            logger.error(f"❌ Error in PDF processing pipeline: {str(e)}")
+            logger.error(f"Error type: {type(e).__name__}")
+            _record_outcome(
+                myblob.name.split("/")[-1],
+                "failed",
+                f"Processing failed ({type(e).__name__}), retrying",
+            )
+            raise e
+
+        finally:
+            # ru_maxrss is reported in KiB on Linux
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            logger.info(f"📈 Worker peak RSS after {myblob.name}: {peak_rss_mb:.1f} MB")
+
+
+def _open_checkpoints(blob_name: str, content_hash: str):
+    """Checkpoints for this blob version, or None when storage is unavailable"""
     try:
-        # extract file name
-        filename = myblob.name.split("/")[-1]  # Gets filename from 'pdfs/filename.pdf'
+        return IngestCheckpoints(blob_name, content_hash)
+    except Exception as e:
+        logger.warning(f"⚠️ Checkpoints unavailable, running without: {str(e)}")
+        return None
 
-        # extract text with doc intelligence
-        doc_processor = DocumentIntelligenceProcessor()
-        blob_data = myblob.read()
-        extracted_text = doc_processor.extract_text(blob_data, filename)
 
-        # structure data with ai
-        openai_extractor = OpenAIExtractor()
-        extracted_data = openai_extractor.extract_data(extracted_text, filename)
+def _record_outcome(filename: str, state: str, details: str) -> None:
+    """Tell status polling why a file has no Documents row; never raises"""
+    try:
+        IngestOutcomes().record(filename, state, details)
+    except Exception as e:
+        logger.warning(
+            f"⚠️ Could not record {state} outcome for {filename}: {str(e)}"
+        )
 
-        # validate results
-        validator = DataValidator()
-        accuracy, is_success = validator.validate_data(extracted_data)
 
-        # db
-        try:
-            db_connection = DatabaseConnection()
-            conn, cursor = db_connection.connect_with_retry()
-
-            if conn and cursor:
-                try:
-                    db_operations = DatabaseOperations(conn, cursor)
-                    db_operations.insert_all_data(
-                        extracted_data, extracted_text, filename, accuracy
-                    )
-                finally:
-                    db_operations.close_connection()
-
-        except Exception as db_error:
-            logger.error(f"❌ Database operation failed: {str(db_error)}")
-            logger.error(f"Error type: {type(db_error).__name__}")
+def _load_checkpoint(checkpoints, stage: str):
+    if checkpoints is None:
+        return None
+    try:
+        return checkpoints.load(stage)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not read {stage} checkpoint: {str(e)}")
+        return None
 
+
+def _save_checkpoint(checkpoints, stage: str, result) -> bool:
+    """True once the stage is stored, so a replay can rely on it"""
+    if checkpoints is None:
+        return False
+    try:
+        checkpoints.save(stage, result)
+        return True
     except Exception as e:
-        logger.error(f"❌ Error in PDF processing pipeline: {str(e)}")
-        logger.error(f"Error type: {type(e).__name__}")
-        raise e
+        # A missing checkpoint only costs a repeat of this stage on retry
+        logger.warning(f"⚠️ Could not save {stage} checkpoint: {str(e)}")
+        return False
+
+
+def _persist(
+    extracted_data, extracted_text, filename, accuracy, version=None, db_operations=None
+):
+    """Write one document's results, on a new connection unless one is given"""
+    if db_operations is not None:
+        db_operations.insert_all_data(
+            extracted_data, extracted_text, filename, accuracy, version
+        )
+        return
+
+    db_connection = DatabaseConnection()
+    conn, cursor = db_connection.connect_with_retry()
+    if not (conn and cursor):
+        raise ConnectionError("Could not connect to the database")
+    db_operations = DatabaseOperations(conn, cursor)
+    try:
+        db_operations.insert_all_data(
+            extracted_data, extracted_text, filename, accuracy, version
+        )
+    finally:
+        db_operations.close_connection()
+
+
+@app.timer_trigger(arg_name="timer", schedule="0 */5 * * * *", run_on_startup=False)
+def drain_replay_queue(timer: func.TimerRequest) -> None:
+    """Retry queued DB writes in batches over one connection"""
+    queue = ReplayQueue()
+    items = queue.pending()
+    if not items:
+        return
+
+    logger.info(f"📤 Replaying {len(items)} queued database writes")
+    try:
+        conn, cursor = DatabaseConnection().connect_with_retry(max_retries=2)
+    except Exception as e:
+        logger.warning(f"⚠️ Database still unavailable, replay postponed: {str(e)}")
+        return
+    db_operations = DatabaseOperations(conn, cursor)
+    replayed = 0
+    try:
+        for queue_blob_name, item in items:
+            checkpoints = IngestCheckpoints(
+                item["blob_name"], item["content_hash"], queue.container
+            )
+            if checkpoints.completed("persisted"):
+                queue.remove(queue_blob_name)
+                continue
+
+            extracted_text = checkpoints.load("ocr")
+            extraction = checkpoints.load("extraction")
+            if extracted_text is None or extraction is None:
+                logger.error(f"❌ Checkpoints missing for {item['filename']}, dropping")
+                queue.remove(queue_blob_name)
+                continue
+
+            try:
+                _persist(
+                    extraction["data"],
+                    extracted_text,
+                    item["filename"],
+                    extraction["accuracy"],
+                    extraction.get("version"),
+                    db_operations,
+                )
+            except Exception as e:
+                # SQL is likely still unavailable; the next run picks up here
+                logger.error(f"❌ Replay of {item['filename']} failed: {str(e)}")
+                break
+
+            checkpoints.save("persisted", {"filename": item["filename"]})
+            queue.remove(queue_blob_name)
+            replayed += 1
+    finally:
+        db_operations.close_connection()
+        metrics.increment("replay.persisted", replayed)
+        logger.info(f"✅ Replayed {replayed}/{len(items)} queued database writes")
 
 
 @app.route(route="chat", methods=["POST"])
@@ -88,21 +301,64 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
             )
 
         user_message = req_body["message"]
+        session_id = req_body.get("session_id")
+        # Rows go out as {"columns", "rows"}; "records" keeps one object per row
+        columnar = req_body.get("format", "columnar") != "records"
 
         chat_processor = ChatProcessor()
 
-        response_data = chat_processor.process_message(user_message)
+        # The budget starts on arrival, so time spent queued counts against it
+        with deadline(CHAT_DEADLINE_SECONDS), chat_admission.admit(), tracer.start_span(
+            "chat_endpoint"
+        ) as span, metrics.timer("chat.latency"), chat_recorder.record(
+            user_message, session_id
+        ):
+            response_data = chat_processor.process_message(user_message, session_id)
+            trace_id = span.trace_id
+        with metrics.timer("chat.serialize"):
+            body = encode_json(response_data, columnar)
+        metrics.increment("chat.response_bytes", len(body))
         return func.HttpResponse(
-            json.dumps(response_data, default=str),
+            body,
             status_code=200,
             mimetype="application/json",
             headers={
                 "Access-Control-Allow-Origin": "*",
                 "Access-Control-Allow-Methods": "POST, OPTIONS",
                 "Access-Control-Allow-Headers": "Content-Type",
+                "X-Trace-Id": trace_id,
             },
         )
 
+    except Overloaded as e:
+        logger.warning(f"🚦 Chat request shed: {str(e)}")
+        return func.HttpResponse(
+            json.dumps(
+                {
+                    "status": "error",
+                    "error": str(e),
+                    "formatted_response": "The service is busy. Please try again shortly.",
+                }
+            ),
+            status_code=503,
+            mimetype="application/json",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+    except DeadlineExceeded as e:
+        logger.error(f"⏱️ Chat request abandoned: {str(e)}")
+        return func.HttpResponse(
+            json.dumps(
+                {
+                    "status": "error",
+                    "error": str(e),
+                    "formatted_response": "Sorry, that took too long. Please try again.",
+                }
+            ),
+            status_code=504,
+            mimetype="application/json",
+        )
+
     except Exception as e:
         logger.error(f"❌ Chat endpoint error: {str(e)}")
 
@@ -117,3 +373,161 @@ def chat_endpoint(req: func.HttpRequest) -> func.HttpResponse:
             status_code=500,
             mimetype="application/json",
         )
+
+
+@app.route(route="status", methods=["GET", "POST"])
+def status_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """Per-file ingestion state for uploaded PDFs, looked up in one query"""
+    try:
+        body = req.get_json() if req.get_body() else {}
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        return _status_error("The request body must be a JSON object")
+
+    filenames = body.get("filenames") or [
+        name for name in req.params.get("filenames", "").split(",") if name
+    ]
+    if not isinstance(filenames, list) or not all(
+        isinstance(name, str) for name in filenames
+    ):
+        return _status_error("'filenames' must be a list of file names")
+    if not filenames:
+        return _status_error("Provide 'filenames' in the body or query string")
+
+    # Upload time, so an earlier upload of the same file isn't reported.
+    # CreatedDate is written in the host's clock, which is UTC on Azure.
+    since = body.get("since") or req.params.get("since")
+    if since is not None:
+        try:
+            uploaded_at = datetime.fromisoformat(str(since))
+        except ValueError:
+            return _status_error("'since' must be an ISO 8601 timestamp")
+        if uploaded_at.tzinfo is not None:
+            uploaded_at = uploaded_at.astimezone(timezone.utc)
+        since = uploaded_at.strftime("%Y-%m-%d %H:%M:%S")
+
+    status_results = RetreiveData()._get_processing_status(filenames, since)
+    if status_results["status"] != "success":
+        return func.HttpResponse(
+            json.dumps(status_results, default=str),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    # Rejected, failed and replay-queued uploads leave no Documents row
+    waiting = [
+        (filename, status)
+        for filename, status in status_results["data"].items()
+        if status["state"] in ("pending", "processing")
+    ]
+    try:
+        outcomes = IngestOutcomes() if waiting else None
+        for filename, status in waiting:
+            outcome = outcomes.load(filename)
+            if outcome is None or (since and outcome["recorded_at"] < since):
+                continue
+            if str(status.get("created_date") or "")[:19] > outcome["recorded_at"]:
+                continue
+            status.update(
+                state=outcome["state"], error_details=outcome["error_details"]
+            )
+    except Exception as e:
+        # Polling falls back to the database state alone
+        logger.warning(f"⚠️ Could not read ingest outcomes: {str(e)}")
+
+    return func.HttpResponse(
+        json.dumps(
+            {"status": "success", "files": status_results["data"]}, default=str
+        ),
+        status_code=200,
+        mimetype="application/json",
+    )
+
+
+def _status_error(message: str) -> func.HttpResponse:
+    return func.HttpResponse(
+        json.dumps({"error": message, "status": "error"}),
+        status_code=400,
+        mimetype="application/json",
+    )
+
+
+@app.route(route="export/{dataset}", methods=["GET"])
+def export_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    One page of a patients or documents export as NDJSON or CSV
+
+    Query parameters other than format, token, page_rows and gzip are chat
+    intent filters, e.g. ?diagnosis_search=asthma. While X-Export-Next-Token
+    is returned, request the next page with ?token=<value>.
+    """
+    params = dict(req.params)
+    export_format = params.pop("format", "ndjson")
+    token = params.pop("token", None)
+    compress = params.pop("gzip", "").lower() == "true" or (
+        "gzip" in req.headers.get("Accept-Encoding", "")
+    )
+
+    try:
+        page_rows = min(
+            int(params.pop("page_rows", EXPORT_PAGE_ROWS)), EXPORT_PAGE_ROWS
+        )
+        page = ExportPage(
+            req.route_params.get("dataset"),
+            params,
+            export_format=export_format,
+            token=token,
+            page_rows=page_rows,
+            compress=compress,
+        )
+    except ValueError as e:
+        return func.HttpResponse(
+            json.dumps({"error": str(e), "status": "error"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    try:
+        # The response is buffered by the host, so a page's encoded (and
+        # gzipped) bytes bound the memory used, not the dataset size
+        with metrics.timer("export.page"), get_pool().connection() as (_, cursor):
+            body = b"".join(page.chunks(cursor))
+    except Exception as e:
+        logger.error(f"❌ Export failed: {str(e)}")
+        return func.HttpResponse(
+            json.dumps({"error": str(e), "status": "error"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    metrics.increment("export.rows", page.rows)
+    headers = {"X-Export-Rows": str(page.rows)}
+    if page.next_token:
+        headers["X-Export-Next-Token"] = page.next_token
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return func.HttpResponse(
+        body, status_code=200, mimetype=page.content_type, headers=headers
+    )
+
+
+@app.route(route="metrics", methods=["GET"])
+def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """Report this worker's counters and latency percentiles"""
+    return func.HttpResponse(
+        json.dumps(metrics.snapshot(), default=str),
+        status_code=200,
+        mimetype="application/json",
+    )
+
+
+@app.route(route="warmup", methods=["GET", "POST"])
+def warmup_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """Warm this worker on demand and report per-step startup timings"""
+    timings = WorkerWarmup().run()
+    return func.HttpResponse(
+        json.dumps({"status": "success", "timings": timings}, default=str),
+        status_code=200,
+        mimetype="application/json",
+    )
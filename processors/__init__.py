@@ -2,10 +2,12 @@ from .chat_processor import ChatProcessor
 from .data_validator import DataValidator
 from .document_intelligence import DocumentIntelligenceProcessor
 from .openai_extractor import OpenAIExtractor
+from .rule_extractor import RuleExtractor
 
 __all__ = [
     "DocumentIntelligenceProcessor",
     "OpenAIExtractor",
     "DataValidator",
+    "RuleExtractor",
     "ChatProcessor",
 ]
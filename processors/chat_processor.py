@@ -1,62 +1,148 @@
 import json
 import logging
 
-from database import DatabaseConnection, DatabaseOperations, RetreiveData
+from database import DatabaseConnection, DatabaseOperations, ResultSet, RetreiveData
+from shared import chat_recorder, check_deadline, metrics, remaining, sampled_debug
 
 from .openai_extractor import OpenAIExtractor
+from .response_templates import ResponseTemplates
+from .session_store import ChatSession, session_store
+from .speculative import SpeculativeRetrieval
+
+# Intents whose "all" parameter means "this attribute of the patient found"
+ATTRIBUTE_INTENTS = ("diagnosis_search", "insurance_search", "physician_search")
+
+# Reply to greetings and small talk, which carry no intent to query
+NO_INTENT_RESPONSE = (
+    "What would you like to look up? You can ask about a patient by name "
+    "or MRN, a diagnosis, a physician, insurance or documents."
+)
 
 
 class ChatProcessor:
 
-    def __init__(self):
+    def __init__(
+        self,
+        openai_extractor: OpenAIExtractor = None,
+        retreive_data: RetreiveData = None,
+    ):
+        """
+        Initialize the processor
+
+        Args:
+            openai_extractor: Extractor to use (a new one per message if None)
+            retreive_data: Query layer to use (a new one per message if None)
+        """
         self.logger = logging.getLogger(__name__)
+        self.templates = ResponseTemplates()
+        self._openai_extractor = openai_extractor
+        self._retreive_data = retreive_data
 
-    def process_message(self, user_message: str) -> dict:
+    def process_message(self, user_message: str, session_id: str = None) -> dict:
 
-        self.logger.info(f"💬 User message: {user_message}")
-        self.openai_extractor = OpenAIExtractor()
-        self.retreive_data = RetreiveData()
-        intent_list = self._identify_intent(user_message)
+        self.logger.info(f"💬 User message received: {len(user_message)} characters")
+        sampled_debug(self.logger, f"User message: {user_message}")
+        self.openai_extractor = self._openai_extractor or OpenAIExtractor()
+        self.retreive_data = self._retreive_data or RetreiveData()
+        session = session_store.get_or_create(session_id)
+
+        # Obvious MRNs and quoted names are looked up while the model decides
+        speculation = SpeculativeRetrieval(self.retreive_data).start(
+            user_message,
+            skip=lambda intent, parameter: (
+                ChatSession.result_key(intent, parameter) in session.results
+            ),
+        )
+        try:
+            return self._process(user_message, session, speculation)
+        finally:
+            speculation.discard()
 
+    def _process(
+        self, user_message: str, session: ChatSession, speculation: SpeculativeRetrieval
+    ) -> dict:
+        intent_list = self._identify_intent(user_message, session.context_summary())
+        speculation.intent_done()
+        self.intent_list = intent_list
+        chat_recorder.annotate(session=session.session_id, intents=intent_list)
+
+        if not intent_list:
+            metrics.increment("chat.requests")
+            session_store.remember_turn(session, user_message, {})
+            return {
+                "status": "success",
+                "session_id": session.session_id,
+                "user_message": user_message,
+                "formatted_response": NO_INTENT_RESPONSE,
+                "data": ResultSet.concat([]),
+                "count": 0,
+            }
+
+        self.intent = None
+        self.parameter = None
         all_results = []
         total_count = 0
-        all_data = []
+        patient_rows = []
 
         for intent_pair in intent_list:
             self.intent = list(intent_pair.keys())[0]
             self.parameter = intent_pair[self.intent]
 
-            if self.intent == "patient_lookup":
-                query_results = self.retreive_data._get_patient_by_name(self.parameter)
-            elif self.intent == "mrn_lookup":
-                query_results = self.retreive_data._get_patient_by_mrn(self.parameter)
-            elif self.intent == "diagnosis_search":
-                query_results = self.retreive_data._get_patients_by_diagnosis(
-                    self.parameter
-                )
-            elif self.intent == "physician_search":
-                query_results = self.retreive_data._get_patients_by_physician(
-                    self.parameter
-                )
-            elif self.intent == "insurance_search":
-                query_results = self.retreive_data._get_patients_by_insurance(
-                    self.parameter
-                )
-            elif self.intent == "document_search":
-                query_results = self.retreive_data._get_documents_search(self.parameter)
-            elif self.intent == "stats_summary":
-                query_results = self.retreive_data._get_stats_summary(self.parameter)
-            else:
+            query_results = session_store.get_result(
+                session, self.intent, self.parameter
+            )
+            if (
+                query_results is None
+                and not patient_rows
+                and self._is_attribute_query()
+            ):
+                # A later "and his insurance?" is about the patient
+                # remembered from earlier turns
+                patient_rows = self._remembered_patient_rows(session)
+                if not patient_rows:
+                    # Searching for the word "all" would match at random
+                    query_results = {
+                        "status": "unsupported",
+                        "message": (
+                            "Which patient do you mean? Please give a name or MRN."
+                        ),
+                    }
+            if query_results is None and patient_rows and self._is_attribute_query():
+                # "and his diagnosis?" is answered from the patient rows
                 query_results = {
-                    "status": "unsupported",
-                    "message": f"Intent '{self.intent}' not recognized or supported yet",
+                    "status": "success",
+                    "data": patient_rows,
+                    "count": len(patient_rows),
+                    "query_type": self.intent,
                 }
+                metrics.increment("session.sql_round_trips_saved")
+            if query_results is None:
+                query_results = speculation.take(self.intent, self.parameter)
+                if query_results is None:
+                    check_deadline("intent")
+                    query_results = self._run_intent_query()
+                session_store.put_result(
+                    session, self.intent, self.parameter, query_results
+                )
+
+            if self.intent in ("patient_lookup", "mrn_lookup"):
+                patient_rows = query_results.get("data") or []
 
             all_results.append(query_results)
             if query_results.get("count"):
                 total_count += query_results["count"]
-            if query_results.get("data"):
-                all_data.extend(query_results["data"])
+
+        # Result sets share their row tuples; only the header is rebuilt
+        all_data = ResultSet.concat(result.get("data") for result in all_results)
+
+        # Rows per request are what the response prompt has to carry
+        metrics.increment("chat.requests")
+        metrics.increment("chat.result_rows", len(all_data))
+        chat_recorder.annotate(rows=len(all_data))
+
+        session_store.remember_turn(
+            session, user_message, self._resolved_entities(patient_rows)
+        )
 
         combined_query_results = {
             "status": "success",
@@ -69,15 +155,81 @@ class ChatProcessor:
 
         return {
             "status": "success",
+            "session_id": session.session_id,
             "user_message": user_message,
             "formatted_response": response,
             "data": all_data,
             "count": total_count,
         }
 
-    def _identify_intent(self, message: str):
-        extracted_data = self.openai_extractor.extract_intent(message)
-        self.logger.info(extracted_data)
+    def _run_intent_query(self) -> dict:
+        """Dispatch the current intent to its RetreiveData query"""
+        if self.intent == "patient_lookup":
+            return self.retreive_data._get_patient_by_name(self.parameter)
+        elif self.intent == "mrn_lookup":
+            return self.retreive_data._get_patient_by_mrn(self.parameter)
+        elif self.intent == "diagnosis_search":
+            return self.retreive_data._get_patients_by_diagnosis(self.parameter)
+        elif self.intent == "physician_search":
+            return self.retreive_data._get_patients_by_physician(self.parameter)
+        elif self.intent == "insurance_search":
+            return self.retreive_data._get_patients_by_insurance(self.parameter)
+        elif self.intent == "document_search":
+            return self.retreive_data._get_documents_search(self.parameter)
+        elif self.intent == "stats_summary":
+            return self.retreive_data._get_stats_summary(self.parameter)
+        elif self.intent == "patient_documents":
+            return self.retreive_data._get_patient_documents(self.parameter)
+        elif self.intent == "analytics_query":
+            return self.retreive_data._get_analytics(self.parameter)
+        else:
+            return {
+                "status": "unsupported",
+                "message": f"Intent '{self.intent}' not recognized or supported yet",
+            }
+
+    def _remembered_patient_rows(self, session: ChatSession) -> list:
+        """Rows of the patient resolved in an earlier turn, if there is one"""
+        mrn = session.entities.get("mrn")
+        name = session.entities.get("patient_name")
+        if mrn:
+            intent, parameter = "mrn_lookup", mrn
+            lookup = self.retreive_data._get_patient_by_mrn
+        elif name:
+            intent, parameter = "patient_lookup", name
+            lookup = self.retreive_data._get_patient_by_name
+        else:
+            return []
+
+        results = session_store.get_result(session, intent, parameter)
+        if results is None:
+            check_deadline("intent")
+            results = lookup(parameter)
+            session_store.put_result(session, intent, parameter, results)
+        return results.get("data") or []
+
+    def _is_attribute_query(self) -> bool:
+        """True for "all"-style intents that ask about an already found patient"""
+        return (
+            self.intent in ATTRIBUTE_INTENTS
+            and str(self.parameter).strip().lower() == "all"
+        )
+
+    @staticmethod
+    def _resolved_entities(patient_rows: list) -> dict:
+        """Remember the patient only when the turn resolved exactly one"""
+        identities = {
+            (row.get("PatientName"), row.get("MedicalRecordNumber"))
+            for row in patient_rows
+        }
+        if len(identities) != 1:
+            return {}
+        name, mrn = identities.pop()
+        return {"patient_name": name, "mrn": mrn}
+
+    def _identify_intent(self, message: str, context: str = ""):
+        extracted_data = self.openai_extractor.extract_intent(message, context)
+        sampled_debug(self.logger, f"Intents: {extracted_data}")
         return extracted_data
 
     def _generate_response(self, query, query_results: dict) -> str:
@@ -92,12 +244,28 @@ class ChatProcessor:
                 "patient_lookup",
                 "diagnosis_search",
                 "physician_search",
+                "analytics_query",
             ]
 
+            left = remaining()
+            if left is not None and left <= 0:
+                # Out of time for a model call; the rows are still worth sending
+                metrics.increment("deadline.exceeded.format_response")
+                return self._format_simple_response(query_results)
+
             if len(query_results["all_results"]) > 1 or self.intent in openai_intents:
+                templated = self.templates.render(
+                    query, self.intent_list, query_results
+                )
+                if templated is not None:
+                    metrics.increment("response.template")
+                    return templated
+
+                metrics.increment("response.llm")
                 response = self.openai_extractor.format_response(query, query_results)
                 return response
             else:
+                metrics.increment("response.template")
                 return self._format_simple_response(query_results)
 
         except Exception as e:
@@ -141,8 +309,19 @@ class ChatProcessor:
                 return f"Found {count} documents. Document types include: {types_str}"
             return f"Found {count} documents matching your search."
 
+        elif self.intent == "patient_documents":
+            count = query_results["count"]
+            names = {doc.get("PatientName") for doc in query_results["data"]}
+            if len(names) == 1:
+                latest = query_results["data"][0]
+                return (
+                    f"{names.pop()} has {count} documents on file. "
+                    f"Latest: {latest.get('Filename')} ({latest.get('DocumentType')})"
+                )
+            return f"Found {count} documents across {len(names)} matching patients."
+
         elif self.intent == "stats_summary":
-            data = query_results["data"]
+            data = query_results["data"][0]
             total_patients = data.get("total_patients", 0)
             total_docs = data.get("total_documents", 0)
             top_diagnosis = data.get("top_diagnosis", "No data")
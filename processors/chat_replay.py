@@ -0,0 +1,472 @@
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from database import NameIndex, PatientLookupFilter, ResultSet, RetreiveData
+from database.schema import SchemaMigrator, to_sqlite
+from shared import ChatRecorder, Metrics, TracedCursor
+from shared.recorder import IDENTIFYING_INTENTS, PSEUDONYM_PREFIX, RECORD_VERSION
+
+from .chat_processor import ChatProcessor
+from .openai_extractor import OpenAIExtractor, estimate_tokens
+
+FIRST_NAMES = (
+    "James Mary Robert Patricia John Jennifer Michael Linda "
+    "David Elizabeth William Barbara Richard Susan Joseph Jessica"
+).split()
+LAST_NAMES = (
+    "Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez "
+    "Hernandez Lopez Gonzalez Wilson Anderson Thomas Taylor Moore Jackson Martin"
+).split()
+DIAGNOSES = [
+    "Type 2 diabetes",
+    "Hypertension",
+    "Pneumonia",
+    "Asthma",
+    "Heart failure",
+    "COPD",
+    "Sepsis",
+    "Chronic kidney disease",
+]
+PHYSICIANS = ["Dr. Smith", "Dr. Patel", "Dr. Nguyen", "Dr. Cohen", "Dr. Okafor"]
+INSURERS = ["Aetna", "Cigna", "Humana", "UnitedHealthcare", "Medicare", "Blue Cross"]
+DOCUMENT_TYPES = ["Discharge Summary", "Admission Note", "Progress Note", "Lab Report"]
+
+REPLAY_RESPONSE = "Replayed response."
+
+
+def load_recording(path: str) -> List[dict]:
+    """Read recorded chat requests, skipping torn or foreign lines"""
+    records = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("v") == RECORD_VERSION and record.get("intents") is not None:
+                records.append(record)
+    return records
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    return Metrics._pick(samples, percentile) if samples else 0.0
+
+
+def summarize(records: List[dict], wall_seconds: Optional[float] = None) -> dict:
+    """
+    Latency, throughput and per-request work of a set of records
+
+    Args:
+        records: Recorded or replayed chat records
+        wall_seconds: Duration of the replay; for a recording the offered
+            rate over its time span is reported instead
+    """
+    if not records:
+        return {"requests": 0}
+
+    latencies = sorted(record["ms"] for record in records)
+    count = len(records)
+    if wall_seconds is None:
+        wall_seconds = (
+            max(record["ts"] + record["ms"] / 1000 for record in records)
+            - min(record["ts"] for record in records)
+        )
+
+    def per_request(values) -> float:
+        return round(sum(values) / count, 2)
+
+    return {
+        "requests": count,
+        "errors": sum(record["status"] != "ok" for record in records),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2),
+        "throughput_rps": round(count / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "sql_ms": per_request(sum(sql[1] for sql in r["sql"]) for r in records),
+        "sql_statements": per_request(len(r["sql"]) for r in records),
+        "llm_calls": per_request(len(r["llm"]) for r in records),
+        "prompt_tokens": per_request(sum(llm[2] for llm in r["llm"]) for r in records),
+        "completion_tokens": per_request(
+            sum(llm[3] for llm in r["llm"]) for r in records
+        ),
+        "rows": per_request(r["rows"] for r in records),
+    }
+
+
+def compare(baseline: dict, replay: dict) -> Dict[str, dict]:
+    """Side-by-side numbers with the relative change of each"""
+    comparison = {}
+    for key, value in replay.items():
+        before = baseline.get(key)
+        change = None
+        if isinstance(before, (int, float)) and before:
+            change = round((value - before) / before * 100, 1)
+        comparison[key] = {"baseline": before, "replay": value, "change_pct": change}
+    return comparison
+
+
+class ReplayLLMClient:
+    """Chat completions stand-in that answers from one recorded request"""
+
+    def __init__(
+        self,
+        intents: list,
+        recorded_calls: list,
+        default_ms: Dict[str, float],
+        llm_latency: bool = True,
+    ):
+        """
+        Initialize the client
+
+        Args:
+            intents: Intents the intent call should return
+            recorded_calls: The record's [call_site, ms, prompt, completion] list
+            default_ms: Typical latency per call site, for calls not recorded
+            llm_latency: Sleep for the recorded latency of each call
+        """
+        self.intents = intents
+        self.default_ms = default_ms
+        self.llm_latency = llm_latency
+        self._recorded = defaultdict(deque)
+        for call_site, ms, _, completion_tokens in recorded_calls:
+            self._recorded[call_site].append((ms, completion_tokens))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        # Only the intent call asks for JSON; the rest are response formatting
+        json_mode = (kwargs.get("response_format") or {}).get("type") == "json_object"
+        call_site = "extract_intent" if json_mode else "format_response"
+        if json_mode:
+            content = json.dumps({"intents": self.intents})
+        else:
+            content = REPLAY_RESPONSE
+
+        recorded = self._recorded[call_site]
+        ms, completion_tokens = (
+            recorded.popleft()
+            if recorded
+            else (self.default_ms.get(call_site, 0.0), estimate_tokens(content))
+        )
+        if self.llm_latency:
+            time.sleep(ms / 1000)
+
+        prompt = " ".join(message["content"] for message in kwargs.get("messages", []))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=estimate_tokens(prompt),
+                completion_tokens=completion_tokens,
+            ),
+        )
+
+
+class StandInNameIndex(NameIndex):
+    """Name index over the stand-in patients; never reads Azure SQL"""
+
+    def refresh(self) -> int:
+        self.last_refresh = time.monotonic()
+        return 0
+
+
+class StandInLookupFilter(PatientLookupFilter):
+    """Lookup filter over the stand-in patients; never reads Azure SQL"""
+
+    def build(self) -> int:
+        self.last_build = time.monotonic()
+        return 0
+
+    def refresh(self) -> int:
+        self.last_refresh = time.monotonic()
+        return 0
+
+
+class StandInRetreiveData(RetreiveData):
+    """RetreiveData running its queries on the shared in-memory stand-in"""
+
+    def __init__(
+        self, uri: str, name_index: NameIndex, lookup_filter: PatientLookupFilter
+    ):
+        super().__init__(name_index=name_index, lookup_filter=lookup_filter)
+        self.uri = uri
+        self._local = threading.local()
+
+    def _fetch_all(
+        self, query: str, params: tuple = (), allow_replica: bool = True
+    ) -> ResultSet:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        cursor = TracedCursor(conn.cursor())
+        cursor.execute(to_sqlite(query), params)
+        return ResultSet.from_cursor(cursor)
+
+
+class ChatReplay:
+    """Replays a recorded chat workload against the current code"""
+
+    def __init__(
+        self,
+        records: List[dict],
+        patients: int = 5000,
+        concurrency: int = 4,
+        llm_latency: bool = True,
+        seed: int = 7,
+    ):
+        """
+        Initialize the replay
+
+        Args:
+            records: Recorded chat requests, in recorded order
+            patients: Synthetic patients in the SQLite stand-in
+            concurrency: Conversations replayed at once
+            llm_latency: Sleep for each recorded model call's latency
+            seed: Seed for the synthetic data
+        """
+        self.records = records
+        self.patients = patients
+        self.concurrency = concurrency
+        self.llm_latency = llm_latency
+        self.seed = seed
+        self.logger = logging.getLogger(__name__)
+        self.uri = f"file:chat_replay_{id(self)}?mode=memory&cache=shared"
+        self.name_index = StandInNameIndex()
+        self.lookup_filter = StandInLookupFilter()
+        # Shared by all requests; each replay thread keeps its own connection
+        self.retreive_data = StandInRetreiveData(
+            self.uri, self.name_index, self.lookup_filter
+        )
+        self._names: List[str] = []
+        self._mrns: List[str] = []
+
+        latencies = defaultdict(list)
+        for record in records:
+            for call_site, ms, _, _ in record["llm"]:
+                latencies[call_site].append(ms)
+        self.default_ms = {site: median(values) for site, values in latencies.items()}
+
+    def build_stand_in(self) -> sqlite3.Connection:
+        """
+        Create and fill the stand-in database
+
+        Returns:
+            A connection that keeps the shared in-memory database alive
+        """
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        SchemaMigrator(conn, conn.cursor(), dialect="sqlite").migrate()
+        rng = random.Random(self.seed)
+
+        documents, patients, links, insurance = [], [], [], []
+        for patient_id in range(1, self.patients + 1):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            mrn = f"MRN{100000 + patient_id}"
+            self._names.append(name)
+            self._mrns.append(mrn)
+            for _ in range(rng.randint(1, 3)):
+                document_id = len(documents) + 1
+                documents.append(
+                    (
+                        document_id,
+                        f"doc_{document_id}.pdf",
+                        rng.choice(DOCUMENT_TYPES),
+                        "completed",
+                        "2024-01-01 00:00:00",
+                    )
+                )
+                links.append((patient_id, document_id, "2024-01-01 00:00:00"))
+            patients.append(
+                (
+                    patient_id,
+                    name,
+                    mrn,
+                    f"19{rng.randint(40, 99)}-0{rng.randint(1, 9)}-15",
+                    rng.choice(DIAGNOSES),
+                    rng.choice(PHYSICIANS),
+                    "General Hospital",
+                    document_id,
+                )
+            )
+            insurance.append((patient_id, rng.choice(INSURERS), document_id))
+
+        conn.executemany(
+            "INSERT INTO Documents (DocumentID, Filename, DocumentType, "
+            "ProcessingStatus, CreatedDate) VALUES (?, ?, ?, ?, ?)",
+            documents,
+        )
+        conn.executemany(
+            "INSERT INTO Patients (PatientID, PatientName, MedicalRecordNumber, "
+            "DateOfBirth, PrimaryDiagnosis, AttendingPhysician, FacilityName, "
+            "DocumentID) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            patients,
+        )
+        conn.executemany(
+            "INSERT INTO PatientDocuments (PatientID, DocumentID, LinkedDate) "
+            "VALUES (?, ?, ?)",
+            links,
+        )
+        conn.executemany(
+            "INSERT INTO Insurance (PatientID, InsuranceCompany, DocumentID) "
+            "VALUES (?, ?, ?)",
+            insurance,
+        )
+        conn.commit()
+
+        for patient_id, name in enumerate(self._names, start=1):
+            self.name_index.add(patient_id, name)
+        self.name_index.refresh()
+        self.lookup_filter.load(zip(self._mrns, self._names))
+        self.logger.info(
+            f"🧪 Stand-in ready: {len(patients)} patients, {len(documents)} documents"
+        )
+        return conn
+
+    def _stand_in_value(self, intent: str, parameter):
+        """Map a pseudonymized parameter onto a stand-in patient"""
+        if not str(parameter).startswith(PSEUDONYM_PREFIX):
+            return parameter
+        position = int(str(parameter)[len(PSEUDONYM_PREFIX) :], 16) % self.patients
+        return self._mrns[position] if intent == "mrn_lookup" else self._names[position]
+
+    def _prepare(self, record: dict) -> tuple:
+        """Return the replay message and intents for one record"""
+        message = record["message"]
+        intents = []
+        for intent_pair in record["intents"]:
+            prepared = {}
+            for intent, parameter in intent_pair.items():
+                prepared[intent] = self._stand_in_value(intent, parameter)
+                placeholder = IDENTIFYING_INTENTS.get(intent)
+                if placeholder and prepared[intent] != parameter:
+                    message = message.replace(placeholder, str(prepared[intent]), 1)
+            intents.append(prepared)
+        return message, intents
+
+    def _replay_conversation(self, records: List[dict], recorder: ChatRecorder) -> None:
+        for record in records:
+            message, intents = self._prepare(record)
+            client = ReplayLLMClient(
+                intents, record["llm"], self.default_ms, self.llm_latency
+            )
+            processor = ChatProcessor(
+                OpenAIExtractor(client=client),
+                self.retreive_data,
+            )
+            session_id = record["session"] and f"replay-{id(self)}-{record['session']}"
+            try:
+                with recorder.record(message, session_id):
+                    processor.process_message(message, session_id)
+            except Exception as e:
+                self.logger.warning(f"⚠️ Replayed request failed: {str(e)}")
+
+    def run(self) -> dict:
+        """
+        Replay every record and compare against the recording
+
+        Requests of one session are replayed in order; sessions and
+        session-less requests run concurrently.
+
+        Returns:
+            {"baseline", "replay", "comparison"} summaries
+        """
+        keeper = self.build_stand_in()
+        replayed = []
+        recorder = ChatRecorder(sink=replayed.append)
+
+        conversations = defaultdict(list)
+        for position, record in enumerate(self.records):
+            conversations[record["session"] or f"single-{position}"].append(record)
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for future in [
+                    pool.submit(self._replay_conversation, records, recorder)
+                    for records in conversations.values()
+                ]:
+                    future.result()
+        finally:
+            wall_seconds = time.perf_counter() - started
+            keeper.close()
+
+        baseline = summarize(self.records)
+        replay = summarize(replayed, wall_seconds)
+        return {
+            "baseline": baseline,
+            "replay": replay,
+            "comparison": compare(baseline, replay),
+        }
+
+
+def _print_comparison(comparison: Dict[str, dict]) -> None:
+    print(f"{'metric':<20}{'baseline':>14}{'replay':>14}{'change':>10}")
+    for key, values in comparison.items():
+        change = values["change_pct"]
+        print(
+            f"{key:<20}{str(values['baseline']):>14}{str(values['replay']):>14}"
+            f"{(f'{change:+.1f}%' if change is not None else '-'):>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay recorded chat traffic against the current code"
+    )
+    parser.add_argument("recording", help="File written with CHAT_RECORD_PATH")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument(
+        "--no-llm-latency",
+        action="store_true",
+        help="Answer model calls immediately instead of at recorded latency",
+    )
+    parser.add_argument(
+        "--baseline", help="Compare against an earlier --output report instead"
+    )
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument(
+        "--max-p95-regression",
+        type=float,
+        help="Exit non-zero when replay p95 exceeds baseline p95 by this fraction",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    records = load_recording(args.recording)
+    if not records:
+        sys.exit(f"No replayable records in {args.recording}")
+
+    report = ChatReplay(
+        records,
+        patients=args.patients,
+        concurrency=args.concurrency,
+        llm_latency=not args.no_llm_latency,
+    ).run()
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            report["baseline"] = json.load(handle)["replay"]
+        report["comparison"] = compare(report["baseline"], report["replay"])
+
+    _print_comparison(report["comparison"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+
+    limit = args.max_p95_regression
+    if limit is not None and report["replay"]["p95_ms"] > report["baseline"].get(
+        "p95_ms", 0
+    ) * (1 + limit):
+        sys.exit(1)
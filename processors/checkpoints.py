@@ -0,0 +1,190 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime
+from typing import IO, Any, Dict, List, Optional, Tuple
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient, ContainerClient
+
+from database.text_store import compress_text, decompress_text
+
+# The blob trigger's storage account also holds checkpoints
+CHECKPOINT_CONNECTION_SETTING = "pdfstorageci0001_STORAGE"
+CHECKPOINT_CONTAINER = os.environ.get("CHECKPOINT_CONTAINER", "ingest-checkpoints")
+# Blobs up to this size are hashed in memory, larger ones spill to disk
+SPOOL_MAX_MEMORY_BYTES = int(
+    os.environ.get("SPOOL_MAX_MEMORY_BYTES", str(16 * 1024 * 1024))
+)
+REPLAY_BATCH_SIZE = int(os.environ.get("REPLAY_BATCH_SIZE", "20"))
+
+STAGES = ("ocr", "extraction", "persisted")
+
+_container = None
+
+
+def get_checkpoint_container() -> ContainerClient:
+    """Return the worker-wide checkpoint container, creating it on first use"""
+    global _container
+    if _container is None:
+        service = BlobServiceClient.from_connection_string(
+            os.environ[CHECKPOINT_CONNECTION_SETTING]
+        )
+        container = service.get_container_client(CHECKPOINT_CONTAINER)
+        try:
+            container.create_container()
+        except ResourceExistsError:
+            pass
+        _container = container
+    return _container
+
+
+def spool_and_hash(stream: IO[bytes], chunk_size: int = 1024 * 1024) -> Tuple[str, IO]:
+    """
+    Copy a stream into a spooled temp file while hashing it
+
+    Returns:
+        (sha256 hex digest, temp file rewound to the start)
+    """
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return digest.hexdigest(), spool
+
+
+def _blob_key(blob_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._\-]", "_", blob_name)
+
+
+class IngestCheckpoints:
+    """Durable per-blob stage results, keyed by blob name and content hash"""
+
+    def __init__(self, blob_name: str, content_hash: str, container=None):
+        """
+        Initialize the checkpoints of one blob version
+
+        Args:
+            blob_name: Name of the uploaded blob
+            content_hash: sha256 of its content, so a re-upload starts over
+            container: Container client (defaults to the checkpoint container)
+        """
+        self.blob_name = blob_name
+        self.content_hash = content_hash
+        self.prefix = f"{_blob_key(blob_name)}/{content_hash}"
+        self.container = container or get_checkpoint_container()
+        self.logger = logging.getLogger(__name__)
+
+    def _blob(self, stage: str):
+        return self.container.get_blob_client(f"{self.prefix}/{stage}")
+
+    def load(self, stage: str) -> Optional[Any]:
+        """Return a completed stage's result, or None if it hasn't completed"""
+        try:
+            downloader = self._blob(stage).download_blob()
+            payload = downloader.readall()
+            codec = downloader.properties.metadata.get("codec", "json")
+        except ResourceNotFoundError:
+            return None
+
+        if codec == "json":
+            return json.loads(payload)
+        return decompress_text(codec, payload)
+
+    def save(self, stage: str, result: Any) -> None:
+        """Record a stage as completed; text results are stored compressed"""
+        if isinstance(result, str):
+            codec, payload = compress_text(result)
+        else:
+            codec, payload = "json", json.dumps(result, default=str).encode("utf-8")
+        self._blob(stage).upload_blob(payload, overwrite=True, metadata={"codec": codec})
+        self.logger.info(f"💾 Checkpoint {stage} saved for {self.blob_name}")
+
+    def completed(self, stage: str) -> bool:
+        return self._blob(stage).exists()
+
+
+class ReplayQueue:
+    """Durable queue of DB writes that failed after extraction finished"""
+
+    PREFIX = "replay/"
+
+    def __init__(self, container=None):
+        self.container = container or get_checkpoint_container()
+        self.logger = logging.getLogger(__name__)
+
+    def enqueue(self, checkpoints: IngestCheckpoints, filename: str, accuracy: float):
+        """Queue a blob whose OCR and extraction checkpoints are already saved"""
+        item = {
+            "blob_name": checkpoints.blob_name,
+            "content_hash": checkpoints.content_hash,
+            "filename": filename,
+            "accuracy": accuracy,
+            "queued_at": datetime.now().isoformat(),
+        }
+        self.container.get_blob_client(
+            f"{self.PREFIX}{checkpoints.prefix.replace('/', '__')}.json"
+        ).upload_blob(json.dumps(item), overwrite=True)
+        self.logger.warning(f"📥 Queued {filename} for database replay")
+
+    def pending(self, limit: int = REPLAY_BATCH_SIZE) -> List[Tuple[str, Dict]]:
+        """Return up to limit queued items as (queue blob name, item)"""
+        items = []
+        for blob in self.container.list_blobs(name_starts_with=self.PREFIX):
+            payload = self.container.get_blob_client(blob.name).download_blob()
+            items.append((blob.name, json.loads(payload.readall())))
+            if len(items) >= limit:
+                break
+        return items
+
+    def remove(self, queue_blob_name: str) -> None:
+        try:
+            self.container.delete_blob(queue_blob_name)
+        except ResourceNotFoundError:
+            pass
+
+
+class IngestOutcomes:
+    """Latest outcome of uploads that end without a Documents row"""
+
+    PREFIX = "outcomes/"
+
+    def __init__(self, container=None):
+        self.container = container or get_checkpoint_container()
+        self.logger = logging.getLogger(__name__)
+
+    def record(self, filename: str, state: str, details: Optional[str] = None):
+        """
+        Record why a file has no Documents row (yet)
+
+        Args:
+            filename: Uploaded file name, as the status endpoint sees it
+            state: "rejected", "failed" or "queued"
+            details: Reason shown to the uploader
+        """
+        outcome = {
+            "state": state,
+            "error_details": details,
+            # Same clock and format as Documents.CreatedDate
+            "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.container.get_blob_client(
+            f"{self.PREFIX}{_blob_key(filename)}.json"
+        ).upload_blob(json.dumps(outcome), overwrite=True)
+
+    def load(self, filename: str) -> Optional[Dict]:
+        try:
+            payload = self.container.get_blob_client(
+                f"{self.PREFIX}{_blob_key(filename)}.json"
+            ).download_blob()
+        except ResourceNotFoundError:
+            return None
+        return json.loads(payload.readall())
@@ -0,0 +1,88 @@
+import json
+import re
+from typing import Any
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+
+
+def strip_code_fences(text: str) -> str:
+    """Return the body of the first ``` fenced block, or the text unchanged"""
+    match = _FENCE_PATTERN.search(text)
+    return match.group(1) if match else text
+
+
+def remove_trailing_commas(text: str) -> str:
+    """Drop commas that directly precede } or ], ignoring string contents"""
+    result = []
+    in_string = False
+    escaped = False
+    pending_comma = None
+
+    for char in text:
+        if in_string:
+            result.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if pending_comma is not None:
+            if char.isspace():
+                pending_comma.append(char)
+                continue
+            if char not in "}]":
+                result.extend(pending_comma)
+            else:
+                # Keep the whitespace, lose the comma
+                result.extend(pending_comma[1:])
+            pending_comma = None
+
+        if char == ",":
+            pending_comma = [char]
+        else:
+            if char == '"':
+                in_string = True
+            result.append(char)
+
+    if pending_comma is not None:
+        result.extend(pending_comma)
+    return "".join(result)
+
+
+def extract_first_json_value(text: str) -> Any:
+    """Decode the first JSON object or array embedded anywhere in the text"""
+    decoder = json.JSONDecoder()
+    for index, char in enumerate(text):
+        if char in "{[":
+            try:
+                value, _ = decoder.raw_decode(text, index)
+                return value
+            except json.JSONDecodeError:
+                continue
+    raise json.JSONDecodeError("No JSON value found", text, 0)
+
+
+def parse_json_response(text: str) -> Any:
+    """
+    Parse model output that should be JSON but may carry prose or fences
+
+    Tries, in order: the fence body as-is, the fence body without trailing
+    commas, then the first JSON value found in the cleaned text.
+
+    Raises:
+        json.JSONDecodeError: If no JSON value can be recovered locally
+    """
+    body = strip_code_fences(text).strip()
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        pass
+
+    cleaned = remove_trailing_commas(body)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        return extract_first_json_value(cleaned)
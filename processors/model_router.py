@@ -0,0 +1,132 @@
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from shared import DeadlineExceeded, metrics
+
+# The large deployment answers everything when no small one is configured
+LARGE_DEPLOYMENT = os.environ.get("AZURE_OPENAI_DEPLOYMENT", "healthcare-extractor")
+SMALL_DEPLOYMENT = os.environ.get("AZURE_OPENAI_SMALL_DEPLOYMENT", "")
+
+# Responses with more rows than this skip the small model
+ROUTE_SMALL_MAX_ROWS = int(os.environ.get("ROUTE_SMALL_MAX_ROWS", "5"))
+
+# (max_tokens, timeout seconds) per task and tier, cheapest tier first.
+# Intent JSON is a few dozen tokens; extraction stays on the large model.
+TASK_LIMITS: Dict[str, Dict[str, tuple]] = {
+    "extract_intent": {"small": (200, 8.0), "large": (300, 20.0)},
+    "format_response": {"small": (300, 10.0), "large": (600, 30.0)},
+    "extract_data": {"large": (600, 60.0)},
+    "repair_json": {"small": (1000, 15.0), "large": (1000, 30.0)},
+}
+
+TIER_DEPLOYMENTS = {"small": SMALL_DEPLOYMENT, "large": LARGE_DEPLOYMENT}
+
+
+class ModelRoute:
+    """One deployment with the limits a task uses on it"""
+
+    __slots__ = ("tier", "deployment", "max_tokens", "timeout")
+
+    def __init__(self, tier: str, deployment: str, max_tokens: int, timeout: float):
+        self.tier = tier
+        self.deployment = deployment
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+
+
+class ModelRouter:
+    """Sends each task to the cheapest deployment that gives a usable answer"""
+
+    def __init__(self, task_limits: Dict[str, Dict[str, tuple]] = TASK_LIMITS):
+        self.logger = logging.getLogger(__name__)
+        self._routes: Dict[str, List[ModelRoute]] = {}
+        for task, tiers in task_limits.items():
+            self._routes[task] = [
+                ModelRoute(tier, TIER_DEPLOYMENTS[tier], max_tokens, timeout)
+                for tier, (max_tokens, timeout) in tiers.items()
+                if TIER_DEPLOYMENTS[tier]
+            ]
+            metrics.register_ratio(
+                f"route.{task}.escalation_rate",
+                f"route.{task}.escalations",
+                f"route.{task}.requests",
+            )
+
+    def routes(self, task: str, skip_small: bool = False) -> List[ModelRoute]:
+        routes = self._routes.get(task) or [
+            ModelRoute("large", LARGE_DEPLOYMENT, 1000, 60.0)
+        ]
+        if skip_small and len(routes) > 1:
+            return [route for route in routes if route.tier != "small"] or routes
+        return routes
+
+    def complete(
+        self,
+        task: str,
+        create: Callable[[ModelRoute], Any],
+        validate: Optional[Callable[[Any], bool]] = None,
+        skip_small: bool = False,
+    ):
+        """
+        Run a task on each route in turn until one gives a usable response
+
+        Args:
+            task: Call site name, e.g. "extract_intent"
+            create: Makes the call on a route and returns the response
+            validate: Returns False for output that should be escalated;
+                the last route's response is returned either way
+            skip_small: Start at the large deployment
+
+        Returns:
+            The response of the first route that passed validation
+        """
+        routes = self.routes(task, skip_small)
+        prefix = f"route.{task}"
+        metrics.increment(f"{prefix}.requests")
+
+        with metrics.timer(prefix):
+            for position, route in enumerate(routes):
+                final = position == len(routes) - 1
+                start = time.perf_counter()
+                try:
+                    with metrics.timer(f"{prefix}.{route.tier}"):
+                        metrics.increment(f"{prefix}.{route.tier}.calls")
+                        response = create(route)
+                except DeadlineExceeded:
+                    # A larger model would only start later
+                    raise
+                except Exception as e:
+                    if final:
+                        raise
+                    self._escalate(prefix, route, "error", str(e))
+                    continue
+
+                if final or validate is None or validate(response):
+                    metrics.increment(f"{prefix}.{route.tier}.served")
+                    return response
+                self._escalate(
+                    prefix,
+                    route,
+                    "invalid",
+                    f"after {(time.perf_counter() - start) * 1000:.0f} ms",
+                )
+
+    def _escalate(self, prefix: str, route: ModelRoute, reason: str, detail: str):
+        metrics.increment(f"{prefix}.escalations")
+        metrics.increment(f"{prefix}.escalated.{reason}")
+        self.logger.warning(
+            f"⬆️ {prefix} escalated from {route.deployment} ({reason}): {detail}"
+        )
+
+
+_router = None
+
+
+def get_model_router() -> ModelRouter:
+    """Return the worker-wide router"""
+    global _router
+    if _router is None:
+        _router = ModelRouter()
+    return _router
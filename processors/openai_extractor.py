@@ -1,246 +1,544 @@
+import hashlib
 import json
 import logging
 import os
-from typing import Any, Dict
+import re
+import textwrap
+import threading
+import time
+from typing import Any, Dict, List, Optional
 
 from openai import AzureOpenAI
 
+from shared import bounded_timeout, metrics, remaining, sampled_debug, tracer
+
+from .json_repair import parse_json_response
+from .model_router import ROUTE_SMALL_MAX_ROWS, ModelRouter, get_model_router
+
+EXTRACTION_SCHEMA_HINT = (
+    '{"patient_name": "...", "mrn": "...", "dob": "...", "admission_date": "...", '
+    '"discharge_date": "...", "primary_diagnosis": "...", "physician": "...", '
+    '"insurance_company": "...", "facility": "...", "document_type": "..."}'
+)
+
+EXTRACTION_FIELDS = [
+    "patient_name",
+    "mrn",
+    "dob",
+    "admission_date",
+    "discharge_date",
+    "primary_diagnosis",
+    "physician",
+    "insurance_company",
+    "facility",
+    "document_type",
+]
+
+# Not visible in the deployment name: bump it when a deployment's model is
+# upgraded in place or the extraction rules change, so documents extracted
+# before are picked up for re-extraction
+EXTRACTION_MODEL_VERSION = os.environ.get("EXTRACTION_MODEL_VERSION", "")
+
+# Prompts are split into static instructions, sent first as the system
+# message, and a user message holding only the per-request content. The
+# instructions are byte-identical on every call, so Azure OpenAI can serve
+# them from its prompt cache. All of them are built once at import.
+
+INTENT_DETECTION_INSTRUCTIONS = textwrap.dedent(
+    """\
+    You are a query intent detection specialist. Extract ALL applicable intents from the query and return as JSON array. Return only valid JSON.
+
+    Instructions:
+    1. Extract ALL intents that apply (can be one or many)
+    2. Return array of key-value pairs: intent category → parameter
+    3. Order by relevance (most important first)
+    4. Read the entire query and determine what the subject is reffering to based on the context
+        example query: "Who is John Doe's physician name?"
+        Here, John Doe is clearly the patient and we are looking up the physician
+    5. Use the conversation context, when given, to resolve references like "his", "her" or "that patient"
+
+    Intent Categories:
+    a) "patient_lookup" - Finding patient by name ("Show John Doe")
+    b) "diagnosis_search" - Finding patients by diagnosis ("diabetes patients")
+    c) "mrn_lookup" - Finding by MRN ("MRN 12345")
+    d) "facility_search" - Finding by facility ("patients at Mayo Clinic")
+    e) "physician_search" - Finding by doctor ("Dr. Smith's patients")
+    f) "date_range_search" - Finding by dates ("admitted last month")
+    g) "insurance_search" - Finding by insurance ("Aetna patients")
+    h) "document_search" - Finding documents ("processed documents")
+    i) "stats_summary" - Statistics/counts ("How many patients?")
+    j) "recent_activity" - Recent info ("recent admissions")
+    k) "patient_documents" - A patient's documents or document count ("How many documents does John Doe have?")
+    l) "analytics_query" - Aggregates over many patients or documents: counts, averages, minimums or maximums, optionally per group or per time period ("admissions per month by facility", "average length of stay for pneumonia")
+
+    Parameters:
+    - patient_lookup → patient name
+    - diagnosis_search → diagnosis name
+    - mrn_lookup → MRN number
+    - facility_search → facility name
+    - physician_search → doctor name
+    - date_range_search → date/range
+    - insurance_search → insurance name
+    - document_search → doc type or "all"
+    - stats_summary → stat type or "general"
+    - recent_activity → time period or "recent"
+    - patient_documents → patient name or MRN
+    - analytics_query → a query object:
+        "table": "patients" (columns PrimaryDiagnosis, AttendingPhysician, FacilityName, InsuranceCompany, DateOfBirth, AdmissionDate, DischargeDate, LengthOfStay in days, Age in years) or "documents" (columns DocumentType, ProcessingStatus, CreatedDate, Accuracy, Status)
+        "where": {column: value}, where value is a name, "~text" for contains, a list of names, or {">=": "2024-01", "<": "2024-04"} for dates and numbers
+        "group_by": list of columns, or day(column), month(column), year(column) for dates
+        "metric": "count", "avg(column)", "sum(column)", "min(column)" or "max(column)"
+
+    Required JSON format:
+    {"intents": [{"intent_name": "parameter_value"}]}
+
+    Examples:
+    "Show Dr. Smith's diabetes patients"
+    {"intents": [{"physician_search": "Dr. Smith"}, {"diagnosis_search": "diabetes"}]}
+
+    "What are newborn baby names born in General Hospital?"
+    {"intents": [{"facility_search": "General Hospital"}, {"diagnosis_search": "newborn"}]}
+
+    "How many patients admitted last month at General Hospital?"
+    {"intents": [{"stats_summary": "patient count"}, {"date_range_search": "last month"}, {"facility_search": "General Hospital"}]}
+
+    "Admissions per month by facility since January 2024"
+    {"intents": [{"analytics_query": {"table": "patients", "where": {"AdmissionDate": {">=": "2024-01-01"}}, "group_by": ["FacilityName", "month(AdmissionDate)"], "metric": "count"}}]}
+
+    "Average length of stay for pneumonia patients"
+    {"intents": [{"analytics_query": {"table": "patients", "where": {"PrimaryDiagnosis": "~pneumonia"}, "metric": "avg(LengthOfStay)"}}]}
+
+    "Find John Doe's insurance and diagnosis"
+    {"intents": [{"patient_lookup": "John Doe"}, {"insurance_search": "all"}, {"diagnosis_search": "all"}]}
+
+    Return {"intents": []} if no intents detected.
+    """
+)
+
+INTENT_NAMES = (
+    "patient_lookup",
+    "diagnosis_search",
+    "mrn_lookup",
+    "facility_search",
+    "physician_search",
+    "date_range_search",
+    "insurance_search",
+    "document_search",
+    "stats_summary",
+    "recent_activity",
+    "patient_documents",
+    "analytics_query",
+)
+
+INTENT_DETECTION_TEMPLATE = (
+    "Conversation context:\n{context}\n\nQuery to analyze:\n{query}"
+)
+
+HEALTHCARE_EXTRACTION_INSTRUCTIONS = textwrap.dedent(
+    """\
+    You are a healthcare data extraction specialist. Extract patient information from the medical document text in the user message and return it as a JSON object.
+
+    Instructions:
+    1. Extract ALL available information, even if some fields are missing, but do not make up any data.
+    2. For "patient_name", remove any periods and collapse multiple spaces into a single space (e.g. “MARY.   JANE” → “MARY JANE”).
+    3. Use "null" for missing information
+    4. Keep original formatting for names and text (aside from the cleaning rule for patient_name)
+    5. For dates, use MM/DD/YYYY format when possible
+    6. Return only valid JSON, no additional text
+
+    Required JSON structure:
+    {
+      "patient_name": "string or null",
+      "mrn": "string or null",
+      "dob": "string or null",
+      "admission_date": "string or null",
+      "discharge_date": "string or null",
+      "primary_diagnosis": "string or null",
+      "physician": "string or null",
+      "insurance_company": "string or null",
+      "facility": "string or null",
+      "document_type": "string or null"
+    }
+    """
+)
+
+HEALTHCARE_EXTRACTION_TEMPLATE = "Document text:\n{document_text}"
+
+# Used when the rule extractor already has some fields; only the rest are
+# asked for, with the same formatting rules
+PARTIAL_EXTRACTION_INSTRUCTIONS = textwrap.dedent(
+    """\
+    You are a healthcare data extraction expert. Extract only the requested fields from the medical document text in the user message and return them as a JSON object with exactly those keys.
+    Use "null" for missing information and do not make up any data. Dates as MM/DD/YYYY. For "patient_name", remove periods and collapse spaces. Return only valid JSON.
+    """
+)
+
+PARTIAL_EXTRACTION_TEMPLATE = "Fields: {fields}\n\nDocument text:\n{document_text}"
+
+RESPONSE_INSTRUCTIONS = textwrap.dedent(
+    """\
+    You are a healthcare data assistant. Your job is to directly answer the user's specific question using the provided query results.
+
+    CRITICAL INSTRUCTIONS:
+    1. **Answer the question directly FIRST** - Start with the exact information the user asked for
+    2. **Be specific to the query type** - Focus on what they actually want to know
+    3. **Use the most relevant data** - Prioritize results that directly answer their question
+    4. **Provide context secondarily** - Add related helpful information after the main answer
+    5. **Handle multiple results intelligently** - If multiple patients found, clarify which one or list them
+
+    RESPONSE STRUCTURE:
+    - **Direct Answer**: Start with the specific information requested
+    - **Context**: Add relevant supporting details (patient info, dates, etc.)
+    - **Closing**: Simple offer to help with more information
+
+    QUERY TYPE EXAMPLES:
+    - Insurance questions → Lead with insurance company name
+    - Diagnosis questions → Lead with diagnosis information
+    - Patient lookup → Lead with patient identification details
+    - Doctor questions → Lead with physician information
+    - Date questions → Lead with relevant dates
+
+    FORMATTING RULES:
+    - **Tone**: Professional but conversational
+    - **Length**: 2-3 sentences maximum
+    - **Format**: Single paragraph, no bullet points
+    - **Names**: Use proper names and titles (Dr., Patient, etc.)
+    - **Null handling**: Skip any null/empty fields entirely
+    - **Multiple results**: Be clear about which patient/result you're referencing
+
+    If multiple patients match, either:
+    - Focus on the most relevant one if context makes it clear
+    - Briefly mention all matches if ambiguous
+
+    Provide a direct, helpful response that answers the user's specific question.
+    """
+)
+
+RESPONSE_TEMPLATE = "User Query: {query}\nQuery Results: {query_results}"
+
+REPAIR_JSON_INSTRUCTIONS = (
+    "Rewrite the user's text as valid JSON matching the given shape. Return only JSON."
+)
+
+
+# A formatted answer saying nothing was found when rows were passed in is
+# treated as low confidence
+NO_DATA_ANSWER = re.compile(
+    r"\b(no (results|records|data|information)"
+    r"|could ?n[o']t find|unable to (find|answer))\b",
+    re.IGNORECASE,
+)
+
+
+def build_messages(instructions: str, content: str) -> List[Dict[str, str]]:
+    """Static instructions first, per-request content last"""
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": content},
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English)"""
+    return (len(text) + 3) // 4
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+def extraction_messages(
+    document_text: str, fields: Optional[List[str]] = None
+) -> List[Dict[str, str]]:
+    """Messages for a full extraction, or for only the given fields"""
+    if fields:
+        return build_messages(
+            PARTIAL_EXTRACTION_INSTRUCTIONS,
+            PARTIAL_EXTRACTION_TEMPLATE.format(
+                fields=", ".join(fields), document_text=document_text
+            ),
+        )
+    return build_messages(
+        HEALTHCARE_EXTRACTION_INSTRUCTIONS,
+        HEALTHCARE_EXTRACTION_TEMPLATE.format(document_text=document_text),
+    )
+
+
+def extraction_version(router: Optional[ModelRouter] = None) -> str:
+    """
+    Hash of everything that shapes extracted data
+
+    Covers the extraction prompts and fields, the extract_data deployments
+    and EXTRACTION_MODEL_VERSION. It is stored with each document's data,
+    so documents extracted under an older prompt or model can be found.
+    """
+    router = router or get_model_router()
+    parts = [
+        HEALTHCARE_EXTRACTION_INSTRUCTIONS,
+        HEALTHCARE_EXTRACTION_TEMPLATE,
+        PARTIAL_EXTRACTION_INSTRUCTIONS,
+        PARTIAL_EXTRACTION_TEMPLATE,
+        EXTRACTION_SCHEMA_HINT,
+        ",".join(EXTRACTION_FIELDS),
+        EXTRACTION_MODEL_VERSION,
+    ]
+    parts.extend(
+        f"{route.deployment}:{route.max_tokens}"
+        for route in router.routes("extract_data")
+    )
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _truncated(response) -> bool:
+    return getattr(response.choices[0], "finish_reason", None) == "length"
+
+
+def _valid_intents(response) -> bool:
+    """
+    Complete, locally parseable list of known intents
+
+    An empty list is a valid answer (a greeting or small talk asks for no
+    data), so it is not escalated to a larger model.
+    """
+    if _truncated(response):
+        return False
+    try:
+        parsed = parse_json_response(response.choices[0].message.content or "")
+    except json.JSONDecodeError:
+        return False
+    intents = parsed.get("intents") if isinstance(parsed, dict) else parsed
+    if not isinstance(intents, list):
+        return False
+    known = set(INTENT_NAMES)
+    return all(
+        isinstance(intent, dict) and len(intent) == 1 and next(iter(intent)) in known
+        for intent in intents
+    )
+
+
+def _valid_json(response) -> bool:
+    if _truncated(response):
+        return False
+    try:
+        parse_json_response(response.choices[0].message.content or "")
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_openai_client(endpoint: str, key: str) -> AzureOpenAI:
+    """Return the worker-wide client so its connection pool is reused"""
+    with _clients_lock:
+        client = _clients.get((endpoint, key))
+        if client is None:
+            client = AzureOpenAI(
+                azure_endpoint=endpoint,
+                api_key=key,
+                api_version="2025-01-01-preview",
+            )
+            _clients[(endpoint, key)] = client
+        return client
+
 
 class OpenAIExtractor:
     """Extracts structured healthcare data using Azure OpenAI"""
 
-    def __init__(self):
-        """Initialize the OpenAI client"""
+    def __init__(self, client=None, router: Optional[ModelRouter] = None):
+        """
+        Initialize the OpenAI client
+
+        Args:
+            client: Chat completions client to use instead of Azure OpenAI
+                (offline replay)
+            router: Picks the deployment and limits per call site
+        """
+        self.router = router or get_model_router()
         self.endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
         self.key = os.environ.get("AZURE_OPENAI_KEY")
 
-        if not self.endpoint or not self.key:
+        if client is not None:
+            self.client = client
+        elif not self.endpoint or not self.key:
             raise ValueError(
                 "Azure OpenAI credentials not found in environment variables"
             )
-
-        self.client = AzureOpenAI(
-            azure_endpoint=self.endpoint,
-            api_key=self.key,
-            api_version="2025-01-01-preview",
-        )
+        else:
+            self.client = get_openai_client(self.endpoint, self.key)
 
         self.logger = logging.getLogger(__name__)
 
-        self.intent_detection_template = """
-        You are a query intent detection specialist. Extract ALL applicable intents from the query and return as JSON array.
-
-        Instructions:
-        1. Extract ALL intents that apply (can be one or many)
-        2. Return array of key-value pairs: intent category → parameter
-        3. Order by relevance (most important first)
-        4. Read the entire query and determine what the subject is reffering to based on the context
-            example query: "Who is John Doe's physician name?" 
-            Here, John Doe is clearly the patient and we are looking up the physician
-
-        Intent Categories:
-        a) "patient_lookup" - Finding patient by name ("Show John Doe")
-        b) "diagnosis_search" - Finding patients by diagnosis ("diabetes patients")
-        c) "mrn_lookup" - Finding by MRN ("MRN 12345")
-        d) "facility_search" - Finding by facility ("patients at Mayo Clinic")
-        e) "physician_search" - Finding by doctor ("Dr. Smith's patients")
-        f) "date_range_search" - Finding by dates ("admitted last month")
-        g) "insurance_search" - Finding by insurance ("Aetna patients")
-        h) "document_search" - Finding documents ("processed documents")
-        i) "stats_summary" - Statistics/counts ("How many patients?")
-        j) "recent_activity" - Recent info ("recent admissions")
-
-        Parameters:
-        - patient_lookup → patient name
-        - diagnosis_search → diagnosis name
-        - mrn_lookup → MRN number
-        - facility_search → facility name
-        - physician_search → doctor name
-        - date_range_search → date/range
-        - insurance_search → insurance name
-        - document_search → doc type or "all"
-        - stats_summary → stat type or "general"
-        - recent_activity → time period or "recent"
-
-        Required format:
-        [{{"intent_name": "parameter_value"}}]
-
-        Examples:
-        "Show Dr. Smith's diabetes patients"
-        [{{"physician_search": "Dr. Smith"}}, {{"diagnosis_search": "diabetes"}}]
-
-        "What are newborn baby names born in General Hospital?"
-        [{{"facility_search": "General Hospital"}}, {{"diagnosis_search": "newborn"}}]
-
-        "How many patients admitted last month at General Hospital?"
-        [{{"stats_summary": "patient count"}}, {{"date_range_search": "last month"}}, {{"facility_search": "General Hospital"}}]
-
-        "Find John Doe's insurance and diagnosis"
-        [{{"patient_lookup": "John Doe"}}, {{"insurance_search": "all"}}, {{"diagnosis_search": "all"}}]
-
-        Return empty array [] if no intents detected.
-
-        Query to analyze:
-        {query}
-        """
-
-        self.healthcare_prompt_template = """
-        You are a healthcare data extraction specialist. Extract patient information from the following medical document text and return it as a JSON object.
-
-        Instructions:
-        1. Extract ALL available information, even if some fields are missing, but do not make up any data.
-        2. For "patient_name", remove any periods and collapse multiple spaces into a single space (e.g. “MARY.   JANE” → “MARY JANE”).
-        3. Use "null" for missing information
-        4. Keep original formatting for names and text (aside from the cleaning rule for patient_name)
-        5. For dates, use MM/DD/YYYY format when possible
-        6. Return only valid JSON, no additional text
-
-        Required JSON structure:
-        {{
-          "patient_name": "string or null",
-          "mrn": "string or null", 
-          "dob": "string or null",
-          "admission_date": "string or null",
-          "discharge_date": "string or null",
-          "primary_diagnosis": "string or null",
-          "physician": "string or null",
-          "insurance_company": "string or null",
-          "facility": "string or null",
-          "document_type": "string or null"
-        }}
-
-        Query text to analyze:
-        {document_text}
-        """
-
-        self.response_prompt_template = """
-        You are a healthcare data assistant. Your job is to directly answer the user's specific question using the provided query results.
-
-        CRITICAL INSTRUCTIONS:
-        1. **Answer the question directly FIRST** - Start with the exact information the user asked for
-        2. **Be specific to the query type** - Focus on what they actually want to know
-        3. **Use the most relevant data** - Prioritize results that directly answer their question
-        4. **Provide context secondarily** - Add related helpful information after the main answer
-        5. **Handle multiple results intelligently** - If multiple patients found, clarify which one or list them
-
-        RESPONSE STRUCTURE:
-        - **Direct Answer**: Start with the specific information requested
-        - **Context**: Add relevant supporting details (patient info, dates, etc.)
-        - **Closing**: Simple offer to help with more information
-
-        QUERY TYPE EXAMPLES:
-        - Insurance questions → Lead with insurance company name
-        - Diagnosis questions → Lead with diagnosis information  
-        - Patient lookup → Lead with patient identification details
-        - Doctor questions → Lead with physician information
-        - Date questions → Lead with relevant dates
-
-        FORMATTING RULES:
-        - **Tone**: Professional but conversational
-        - **Length**: 2-3 sentences maximum
-        - **Format**: Single paragraph, no bullet points
-        - **Names**: Use proper names and titles (Dr., Patient, etc.)
-        - **Null handling**: Skip any null/empty fields entirely
-        - **Multiple results**: Be clear about which patient/result you're referencing
-
-        If multiple patients match, either:
-        - Focus on the most relevant one if context makes it clear
-        - Briefly mention all matches if ambiguous
-
-        User Query: {query}
-        Query Results: {query_results}
-
-        Provide a direct, helpful response that answers their specific question:
-        """
+    def _create_completion(self, call_site: str, **kwargs):
+        """Call the chat completions API inside an llm.<call_site> span"""
+        prefix = f"llm.{call_site}"
+        metrics.register_ratio(
+            f"{prefix}.cache_hit_ratio",
+            f"{prefix}.cached_tokens",
+            f"{prefix}.prompt_tokens",
+        )
+        with tracer.start_span(prefix, **{"llm.model": kwargs.get("model")}) as span:
+            # SDK retries would run past the request deadline; the router
+            # escalates on errors instead
+            client = (
+                self.client
+                if remaining() is None
+                else self.client.with_options(max_retries=0)
+            )
+            start = time.perf_counter()
+            response = client.chat.completions.create(**kwargs)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            metrics.increment(f"{prefix}.calls")
+            metrics.observe(prefix, elapsed_ms)
+
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                details = getattr(usage, "prompt_tokens_details", None)
+                cached_tokens = getattr(details, "cached_tokens", None) or 0
+                span.set_attribute("llm.prompt_tokens", usage.prompt_tokens)
+                span.set_attribute("llm.completion_tokens", usage.completion_tokens)
+                span.set_attribute("llm.cached_tokens", cached_tokens)
+                metrics.increment(f"{prefix}.prompt_tokens", usage.prompt_tokens)
+                metrics.increment(
+                    f"{prefix}.completion_tokens", usage.completion_tokens
+                )
+                metrics.increment(f"{prefix}.cached_tokens", cached_tokens)
+                # Split latency by outcome to see what a cache hit is worth
+                metrics.observe(
+                    f"{prefix}.{'cache_hit' if cached_tokens else 'cache_miss'}",
+                    elapsed_ms,
+                )
+            return response
+
+    def _routed_completion(
+        self, call_site: str, validate=None, skip_small: bool = False, **kwargs
+    ):
+        """Run a call on the call site's routes, escalating unusable output"""
+        return self.router.complete(
+            call_site,
+            lambda route: self._create_completion(
+                call_site,
+                model=route.deployment,
+                max_tokens=route.max_tokens,
+                timeout=bounded_timeout(route.timeout, f"llm.{call_site}"),
+                **kwargs,
+            ),
+            validate,
+            skip_small,
+        )
 
     def format_response(self, query, query_results) -> str:
         try:
             self.logger.info("Starting Response Formatting")
-            prompt = self.response_prompt_template.format(
-                query=query, query_results=query_results
+            prompt = RESPONSE_TEMPLATE.format(query=query, query_results=query_results)
+
+            rows = (
+                len(query_results.get("data") or [])
+                if isinstance(query_results, dict)
+                else 0
             )
 
-            response = self.client.chat.completions.create(
-                model="healthcare-extractor",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a chatbot given query and query_results, give appropriate natural language response",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=1000,
+            def validate(candidate) -> bool:
+                content = (candidate.choices[0].message.content or "").strip()
+                if not content or _truncated(candidate):
+                    return False
+                return not (rows and NO_DATA_ANSWER.search(content))
+
+            # Long result sets go straight to the large deployment
+            response = self._routed_completion(
+                "format_response",
+                validate,
+                skip_small=rows > ROUTE_SMALL_MAX_ROWS,
+                messages=build_messages(RESPONSE_INSTRUCTIONS, prompt),
                 temperature=0.1,
             )
 
             openai_response = response.choices[0].message.content
-            self.logger.info(f"✅ OpenAI response received: {openai_response}")
+            self.logger.info(
+                f"✅ OpenAI response received: {len(openai_response)} characters"
+            )
+            sampled_debug(self.logger, f"Formatted response: {openai_response}")
             return openai_response
 
         except Exception as e:
             self.logger.info(f"Unable to Format Response in OpenAI: {e}")
             return "Error Formatting Response in OpenAIExtractor"
 
-    def extract_intent(self, query: str) -> list[Dict[str, Any]]:
+    def extract_intent(self, query: str, context: str = "") -> list[Dict[str, Any]]:
         try:
             self.logger.info("Starting INTENT & PARAMETER Extraction")
-            prompt = self.intent_detection_template.format(query=query)
-            response = self.client.chat.completions.create(
-                model="healthcare-extractor",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a intent & parameter extraction expert. Return only valid JSON.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=1000,
+            prompt = INTENT_DETECTION_TEMPLATE.format(
+                query=query, context=context or "None"
+            )
+            response = self._routed_completion(
+                "extract_intent",
+                _valid_intents,
+                messages=build_messages(INTENT_DETECTION_INSTRUCTIONS, prompt),
                 temperature=0.3,
+                response_format={"type": "json_object"},
             )
             openai_response = response.choices[0].message.content
-            self.logger.info(f"Raw OpenAI response: {openai_response}")
+            sampled_debug(self.logger, f"Raw OpenAI response: {openai_response}")
 
-            try:
-                extracted_intents = json.loads(openai_response)
-                self.logger.info(f"🎯 Extracted {len(extracted_intents)} intents")
-
-                # Log each intent
-                for intent_dict in extracted_intents:
-                    for intent, parameter in intent_dict.items():
-                        self.logger.info(f"  {intent}: {parameter}")
+            parsed = self._parse_json(
+                openai_response, "extract_intent", '{"intents": [{"intent": "value"}]}'
+            )
+            # Older prompts returned the bare array, accept both shapes
+            extracted_intents = (
+                parsed.get("intents", []) if isinstance(parsed, dict) else parsed
+            )
+            self.logger.info(f"🎯 Extracted {len(extracted_intents)} intents")
 
-                return extracted_intents
+            sampled_debug(self.logger, f"Extracted intents: {extracted_intents}")
 
-            except json.JSONDecodeError as json_error:
-                self.logger.error(f"❌ JSON parsing failed: {str(json_error)}")
-                self.logger.error(f"OpenAI response was: {openai_response}")
-                raise json_error
+            return extracted_intents
 
         except Exception as e:
-            self.logger.error(f"❌ Intent extraction failed for query: {query}")
+            self.logger.error(
+                f"❌ Intent extraction failed for a {len(query)}-character query: "
+                f"{type(e).__name__}"
+            )
+            sampled_debug(self.logger, f"Failed intent query: {query}")
             raise e
 
+    def prompt_tokens_saved(self, fields: List[str]) -> int:
+        """Estimated prompt tokens a partial extraction saves over the full one"""
+        full = estimate_message_tokens(extraction_messages(""))
+        partial = estimate_message_tokens(extraction_messages("", fields))
+        return max(full - partial, 0)
+
     def extract_data(
-        self, document_text: str, filename: str = "unknown"
+        self,
+        document_text: str,
+        filename: str = "unknown",
+        fields: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
+        """
+        Extract healthcare fields from document text
+
+        Args:
+            document_text: OCR text of the document
+            filename: Name of the file, for logging
+            fields: Only ask the model for these fields (defaults to all)
+        """
         try:
             self.logger.info(f"🤖 Starting data extraction for: {filename}")
 
             # Create the prompt
-            prompt = self.healthcare_prompt_template.format(document_text=document_text)
+            messages = extraction_messages(document_text, fields)
+            if fields:
+                schema_hint = json.dumps({field: "..." for field in fields})
+            else:
+                schema_hint = EXTRACTION_SCHEMA_HINT
 
             # Call OpenAI
-            response = self.client.chat.completions.create(
-                model="healthcare-extractor",  # Your deployment name
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a healthcare data extraction expert. Return only valid JSON.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=1000,
+            response = self._routed_completion(
+                "extract_data",
+                messages=messages,
                 temperature=0.1,  # Low temperature for consistent extraction
+                response_format={"type": "json_object"},
             )
 
             # Get response content
@@ -250,21 +548,78 @@ class OpenAIExtractor:
             )
 
             # Parse JSON
-            try:
-                extracted_data = json.loads(openai_response)
-
-                # Log extracted data
-                self.logger.info("🎯 EXTRACTED HEALTHCARE DATA:")
-                for key, value in extracted_data.items():
-                    self.logger.info(f"  {key}: {value}")
+            extracted_data = self._parse_json(
+                openai_response, "extract_data", schema_hint
+            )
 
-                return extracted_data
+            # Field values are PHI, so only field names are logged routinely
+            self.logger.info(
+                f"🎯 Extracted fields: {', '.join(sorted(extracted_data))}"
+            )
+            sampled_debug(self.logger, f"Extracted healthcare data: {extracted_data}")
 
-            except json.JSONDecodeError as json_error:
-                self.logger.error(f"❌ JSON parsing failed: {str(json_error)}")
-                self.logger.error(f"OpenAI response was: {openai_response}")
-                raise json_error
+            return extracted_data
 
         except Exception as e:
             self.logger.error(f"❌ Data extraction failed for {filename}: {str(e)}")
             raise e
+
+    def _parse_json(self, openai_response: str, call_site: str, schema_hint: str):
+        """
+        Parse a JSON model response, repairing it before giving up
+
+        Strict parsing is tried first, then the local tolerant parser, and
+        only then a short repair call to the model. Every recovered response
+        is counted as a failure avoided for its call site.
+
+        Raises:
+            json.JSONDecodeError: If the response cannot be recovered
+        """
+        prefix = f"json_parse.{call_site}"
+        metrics.increment(f"{prefix}.total")
+
+        try:
+            value = json.loads(openai_response)
+            metrics.increment(f"{prefix}.strict_ok")
+            return value
+        except json.JSONDecodeError:
+            pass
+
+        try:
+            value = parse_json_response(openai_response)
+            metrics.increment(f"{prefix}.local_repair")
+            metrics.increment(f"{prefix}.failures_avoided")
+            self.logger.warning(f"⚠️ Repaired {call_site} JSON locally")
+            return value
+        except json.JSONDecodeError:
+            pass
+
+        try:
+            value = parse_json_response(
+                self._repair_json(openai_response, schema_hint)
+            )
+            metrics.increment(f"{prefix}.repair_call")
+            metrics.increment(f"{prefix}.failures_avoided")
+            self.logger.warning(f"⚠️ Repaired {call_site} JSON with a repair call")
+            return value
+        except json.JSONDecodeError as json_error:
+            metrics.increment(f"{prefix}.failed")
+            self.logger.error(f"❌ JSON parsing failed: {str(json_error)}")
+            length = len(openai_response or "")
+            self.logger.error(f"OpenAI {call_site} response was {length} characters")
+            sampled_debug(self.logger, f"OpenAI response was: {openai_response}")
+            raise json_error
+
+    def _repair_json(self, broken_response: str, schema_hint: str) -> str:
+        """Ask the model to rewrite a malformed response as valid JSON"""
+        response = self._routed_completion(
+            "repair_json",
+            _valid_json,
+            messages=build_messages(
+                REPAIR_JSON_INSTRUCTIONS,
+                f"Shape: {schema_hint}\n\nText:\n{broken_response}",
+            ),
+            temperature=0,
+            response_format={"type": "json_object"},
+        )
+        return response.choices[0].message.content
@@ -0,0 +1,666 @@
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+from database import DatabaseConnection, DatabaseOperations
+from database.operations import EPISODE_COLUMNS, IDENTITY_COLUMNS
+from database.schema import (
+    PLACEHOLDER_MRNS,
+    SchemaMigrator,
+    _sqlite_column_type,
+    to_sqlite,
+)
+from database.text_store import DocumentTextStore, compress_text
+from shared import metrics, traced
+
+from .openai_extractor import EXTRACTION_FIELDS, OpenAIExtractor, extraction_version
+from .rule_extractor import RuleExtractor
+
+# Model calls in flight at once; keep it under the deployment's rate limit
+REEXTRACT_CONCURRENCY = int(os.environ.get("REEXTRACT_CONCURRENCY", "8"))
+# Documents read per page and written per transaction
+REEXTRACT_BATCH_SIZE = int(os.environ.get("REEXTRACT_BATCH_SIZE", "200"))
+
+# SQL Server allows 2100 parameters per statement
+MAX_PARAMETERS = 2000
+
+STALE_DOCUMENTS_QUERY = """
+    SELECT TOP {limit} d.DocumentID, d.Filename, d.ExtractedData,
+        (SELECT MIN(pd.PatientID) FROM PatientDocuments pd
+         WHERE pd.DocumentID = d.DocumentID) as PatientID
+    FROM Documents d
+    WHERE d.DocumentID > %s
+      AND (d.ExtractionVersion IS NULL OR d.ExtractionVersion <> %s)
+    ORDER BY d.DocumentID
+    """
+
+# One row per re-extracted document, in Patients and Insurance column form
+STAGING_COLUMNS = [
+    ("DocumentID", "INT NOT NULL PRIMARY KEY"),
+    ("PatientID", "INT NULL"),
+    ("DocumentType", "NVARCHAR(50) NULL"),
+    ("ExtractedData", "NVARCHAR(MAX) NULL"),
+    ("PatientName", "NVARCHAR(100) NULL"),
+    ("MedicalRecordNumber", "NVARCHAR(50) NULL"),
+    ("DateOfBirth", "DATE NULL"),
+    ("PrimaryDiagnosis", "NVARCHAR(200) NULL"),
+    ("AdmissionDate", "DATE NULL"),
+    ("DischargeDate", "DATE NULL"),
+    ("AttendingPhysician", "NVARCHAR(100) NULL"),
+    ("FacilityName", "NVARCHAR(100) NULL"),
+    ("InsuranceCompany", "NVARCHAR(100) NULL"),
+]
+
+
+def _is_placeholder(expression: str) -> str:
+    return (
+        f"LOWER(LTRIM(RTRIM({expression}))) IN ("
+        + ", ".join(f"'{placeholder}'" for placeholder in PLACEHOLDER_MRNS)
+        + ")"
+    )
+
+
+def _fill_identity(column: str) -> str:
+    # Legacy rows hold "null" or "" for a missing text value, which _clean
+    # now drops at ingest; dates can only be NULL
+    missing = f"{column} IS NULL"
+    if column != "DateOfBirth":
+        missing += f" OR {_is_placeholder(column)}"
+    # An MRN is only filled in when no other patient has it, nor is about
+    # to claim it in this batch; the lowest PatientID wins such a tie
+    unclaimed = (
+        " AND NOT EXISTS (SELECT 1 FROM Patients o "
+        "WHERE o.MedicalRecordNumber = r.MedicalRecordNumber)"
+        " AND NOT EXISTS (SELECT 1 FROM {staging} s "
+        "INNER JOIN Patients sp ON sp.PatientID = s.PatientID "
+        "WHERE s.MedicalRecordNumber = r.MedicalRecordNumber "
+        "AND s.PatientID < r.PatientID AND (sp.MedicalRecordNumber IS NULL OR "
+        f"{_is_placeholder('sp.MedicalRecordNumber')}))"
+        if column == "MedicalRecordNumber"
+        else ""
+    )
+    return (
+        f"{column} = CASE WHEN {missing} THEN (SELECT MIN(r.{column}) "
+        f"FROM {{staging}} r WHERE r.PatientID = Patients.PatientID{unclaimed}) "
+        f"ELSE {column} END"
+    )
+
+
+def _replace_episode(column: str) -> str:
+    return (
+        f"{column} = COALESCE((SELECT r.{column} FROM {{staging}} r "
+        "WHERE r.DocumentID = Patients.DocumentID "
+        f"AND r.PatientID = Patients.PatientID), {column})"
+    )
+
+
+# The ingest merge rules, applied to a whole batch per statement: identity
+# fields are only filled in when missing, episode fields are replaced when
+# the patient's episode came from a re-extracted document, and null values
+# never overwrite. Written in SQL both dialects accept.
+APPLY_STATEMENTS = [
+    """
+    UPDATE Documents SET
+        DocumentType = COALESCE((SELECT r.DocumentType FROM {staging} r
+                                 WHERE r.DocumentID = Documents.DocumentID), DocumentType),
+        ExtractedData = (SELECT r.ExtractedData FROM {staging} r
+                         WHERE r.DocumentID = Documents.DocumentID),
+        ExtractionVersion = %s
+    WHERE DocumentID IN (SELECT DocumentID FROM {staging})
+    """,
+    "UPDATE Patients SET "
+    + ", ".join(
+        [_fill_identity(column) for column in IDENTITY_COLUMNS]
+        + [_replace_episode(column) for column in EPISODE_COLUMNS]
+    )
+    + " WHERE PatientID IN (SELECT PatientID FROM {staging} WHERE PatientID IS NOT NULL)",
+    """
+    UPDATE Insurance SET
+        InsuranceCompany = (SELECT r.InsuranceCompany FROM {staging} r
+                            WHERE r.DocumentID = Insurance.DocumentID)
+    WHERE DocumentID IN (SELECT DocumentID FROM {staging}
+                         WHERE InsuranceCompany IS NOT NULL)
+      AND NOT EXISTS (SELECT 1 FROM Insurance i
+                      INNER JOIN {staging} r ON r.DocumentID = Insurance.DocumentID
+                      WHERE i.PatientID = Insurance.PatientID
+                        AND i.InsuranceCompanyNormalized
+                            = UPPER(LTRIM(RTRIM(r.InsuranceCompany))))
+    """,
+    """
+    INSERT INTO Insurance (PatientID, InsuranceCompany, DocumentID)
+    SELECT r.PatientID, r.InsuranceCompany, r.DocumentID FROM {staging} r
+    WHERE r.PatientID IS NOT NULL AND r.InsuranceCompany IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM Insurance i
+                      WHERE i.PatientID = r.PatientID
+                        AND i.InsuranceCompanyNormalized
+                            = UPPER(LTRIM(RTRIM(r.InsuranceCompany))))
+      AND r.DocumentID = (SELECT MIN(s.DocumentID) FROM {staging} s
+                          WHERE s.PatientID = r.PatientID
+                            AND UPPER(LTRIM(RTRIM(s.InsuranceCompany)))
+                                = UPPER(LTRIM(RTRIM(r.InsuranceCompany))))
+    """,
+]
+
+# Rows above are rewritten under DocumentIDs the read replica, name index
+# and lookup filter have already passed; they re-read what is logged here
+RECORD_CHANGES_STATEMENT = """
+    INSERT INTO ChangeLog (DocumentID, PatientID, ChangedDate)
+    SELECT DocumentID, PatientID, %s FROM {staging}
+    """
+
+
+def _comparable(value) -> Optional[str]:
+    if value is None or str(value).strip() in ("", "null", "None"):
+        return None
+    return str(value).strip()
+
+
+def diff_fields(old: Optional[dict], new: dict) -> Optional[Dict[str, list]]:
+    """
+    Extracted fields whose value changed, as [old, new]
+
+    Returns:
+        The changes, or None when there is no earlier data to compare with
+    """
+    if old is None:
+        return None
+    changes = {}
+    for field in EXTRACTION_FIELDS:
+        before, after = _comparable(old.get(field)), _comparable(new.get(field))
+        if before != after:
+            changes[field] = [before, after]
+    return changes
+
+
+class ReExtractionJob:
+    """Re-extracts stored OCR text for documents under an older extraction version"""
+
+    def __init__(
+        self,
+        connection,
+        cursor,
+        openai_extractor: Optional[OpenAIExtractor] = None,
+        concurrency: int = REEXTRACT_CONCURRENCY,
+        batch_size: int = REEXTRACT_BATCH_SIZE,
+        dry_run: bool = False,
+        diff_output=None,
+        dialect: str = "mssql",
+    ):
+        """
+        Initialize with an open connection
+
+        Args:
+            connection: pymssql or sqlite3 connection
+            cursor: Dict-row cursor on that connection
+            openai_extractor: Extractor to use (created on demand)
+            concurrency: Documents extracted at once
+            batch_size: Documents read per page and written per transaction
+            dry_run: Extract and diff without writing anything
+            diff_output: Text stream receiving one JSON line per changed document
+            dialect: "mssql" for Azure SQL, "sqlite" for the local stand-in
+        """
+        self.conn = connection
+        self.cursor = cursor
+        self.operations = DatabaseOperations(connection, cursor)
+        self.text_store = DocumentTextStore(connection, cursor)
+        self.openai_extractor = openai_extractor or OpenAIExtractor()
+        self.rule_extractor = RuleExtractor()
+        self.version = extraction_version(self.openai_extractor.router)
+        self.concurrency = max(1, concurrency)
+        # A page's DocumentIDs are sent as one IN list
+        self.batch_size = max(1, min(batch_size, MAX_PARAMETERS))
+        self.dry_run = dry_run
+        self.diff_output = diff_output
+        self.dialect = dialect
+        self.staging = "#ReExtracted" if dialect == "mssql" else "temp.ReExtracted"
+        self.logger = logging.getLogger(__name__)
+        self.summary = {
+            "version": self.version,
+            "documents": 0,
+            "failed": 0,
+            "no_text": 0,
+            "changed": 0,
+            "unchanged": 0,
+            "no_baseline": 0,
+            "linked": 0,
+            "field_changes": {},
+            "extract_seconds": 0.0,
+        }
+
+    def _stale_documents(self, limit: Optional[int]) -> Iterator[dict]:
+        """Yield stale documents with their text, one keyset page at a time"""
+        after, read = 0, 0
+        while limit is None or read < limit:
+            size = (
+                self.batch_size if limit is None else min(self.batch_size, limit - read)
+            )
+            self.cursor.execute(
+                STALE_DOCUMENTS_QUERY.format(limit=size), (after, self.version)
+            )
+            rows = self.cursor.fetchall()
+            if not rows:
+                return
+            after = int(rows[-1]["DocumentID"])
+            read += len(rows)
+
+            texts = self.text_store.load_many(int(row["DocumentID"]) for row in rows)
+            for row in rows:
+                document_id = int(row["DocumentID"])
+                if not texts.get(document_id):
+                    self.summary["no_text"] += 1
+                    metrics.increment("reextract.no_text")
+                    continue
+                yield {
+                    "document_id": document_id,
+                    "filename": row["Filename"],
+                    "patient_id": row["PatientID"],
+                    "old": (
+                        json.loads(row["ExtractedData"])
+                        if row["ExtractedData"]
+                        else None
+                    ),
+                    "text": texts[document_id],
+                }
+
+    def _extract(self, document: dict) -> tuple:
+        """Same rules-then-model path as ingest, on the stored text"""
+        start = time.perf_counter()
+        data = self.rule_extractor.extract_document(
+            document["text"], document["filename"], self.openai_extractor
+        )
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics.observe("reextract.document", elapsed_ms)
+        return data, elapsed_ms
+
+    def _collect(self, pending: dict, return_when) -> List[tuple]:
+        done, _ = wait(pending, return_when=return_when)
+        finished = []
+        for future in done:
+            document = pending.pop(future)
+            try:
+                data, elapsed_ms = future.result()
+            except Exception as e:
+                # Still stale, so the next run tries it again
+                self.summary["failed"] += 1
+                metrics.increment("reextract.failed")
+                self.logger.error(
+                    f"❌ Re-extraction failed for document {document['document_id']}: "
+                    f"{str(e)}"
+                )
+                continue
+            self.summary["extract_seconds"] += elapsed_ms / 1000
+            document.pop("text")
+            finished.append((document, data))
+        return finished
+
+    def _record_diff(self, document: dict, data: dict) -> None:
+        changes = diff_fields(document["old"], data)
+        if changes is None:
+            self.summary["no_baseline"] += 1
+            metrics.increment("reextract.no_baseline")
+            return
+        if not changes:
+            self.summary["unchanged"] += 1
+            metrics.increment("reextract.unchanged")
+            return
+
+        self.summary["changed"] += 1
+        metrics.increment("reextract.changed")
+        field_changes = self.summary["field_changes"]
+        for field in changes:
+            field_changes[field] = field_changes.get(field, 0) + 1
+            metrics.increment(f"reextract.field_changes.{field}")
+        # Values are PHI, so logs only name the fields
+        self.logger.info(
+            f"🔁 Document {document['document_id']}: {', '.join(sorted(changes))} changed"
+        )
+        if self.diff_output is not None:
+            self.diff_output.write(
+                json.dumps({"DocumentID": document["document_id"], "changes": changes})
+                + "\n"
+            )
+
+    def _link_patient(self, patient: dict, document_id: int) -> int:
+        """Upsert and link the patient of a document that had none before"""
+        patient_id = self.operations.upsert_patient(patient, document_id)
+        self.cursor.execute(
+            """
+            INSERT INTO PatientDocuments (PatientID, DocumentID, LinkedDate)
+            VALUES (%s, %s, %s)
+        """,
+            (patient_id, document_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        )
+        self.summary["linked"] += 1
+        return patient_id
+
+    def _stage(self, rows: List[tuple]) -> None:
+        """Create the staging table and fill it with multi-row inserts"""
+        if self.dialect == "mssql":
+            definitions = [f"{name} {ctype}" for name, ctype in STAGING_COLUMNS]
+        else:
+            definitions = [
+                f"{name} {_sqlite_column_type(ctype)}"
+                for name, ctype in STAGING_COLUMNS
+            ]
+        self.cursor.execute(f"CREATE TABLE {self.staging} ({', '.join(definitions)})")
+
+        names = ", ".join(name for name, _ in STAGING_COLUMNS)
+        row_values = f"({', '.join(['%s'] * len(STAGING_COLUMNS))})"
+        per_statement = min(1000, MAX_PARAMETERS // len(STAGING_COLUMNS))
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start : start + per_statement]
+            self.cursor.execute(
+                f"INSERT INTO {self.staging} ({names}) VALUES "
+                + ", ".join([row_values] * len(chunk)),
+                tuple(value for row in chunk for value in row),
+            )
+
+    def _apply(self, results: List[tuple]) -> None:
+        """Diff a batch and write it in one transaction of set-based statements"""
+        for document, data in results:
+            self._record_diff(document, data)
+        self.summary["documents"] += len(results)
+        metrics.increment("reextract.documents", len(results))
+        if self.dry_run:
+            return
+
+        with metrics.timer("reextract.apply"):
+            try:
+                rows = []
+                for document, data in results:
+                    document_id = document["document_id"]
+                    patient = self.operations.patient_columns(data)
+                    patient_id = document["patient_id"]
+                    if patient_id is None and patient is not None:
+                        patient_id = self._link_patient(patient, document_id)
+                    patient = patient or {}
+                    rows.append(
+                        (
+                            document_id,
+                            patient_id,
+                            self.operations.truncate_string(
+                                data.get("document_type"), 50
+                            ),
+                            json.dumps(data),
+                        )
+                        + tuple(
+                            patient.get(column)
+                            for column in IDENTITY_COLUMNS + EPISODE_COLUMNS
+                        )
+                        + (self.operations.insurance_column(data),)
+                    )
+
+                self._stage(rows)
+                for statement in APPLY_STATEMENTS:
+                    statement = statement.format(staging=self.staging)
+                    if "%s" in statement:
+                        self.cursor.execute(statement, (self.version,))
+                    else:
+                        self.cursor.execute(statement)
+                self.cursor.execute(
+                    RECORD_CHANGES_STATEMENT.format(staging=self.staging),
+                    (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),),
+                )
+                self.cursor.execute(f"DROP TABLE {self.staging}")
+                self.conn.commit()
+            except Exception as e:
+                self.logger.error(f"❌ Re-extraction batch write failed: {str(e)}")
+                self.conn.rollback()
+                raise
+
+    def run(self, limit: Optional[int] = None) -> dict:
+        """
+        Re-extract every stale document, or the first limit of them
+
+        Extraction runs on a thread pool while the next page is read and
+        finished batches are written. A document whose extraction fails
+        keeps its old version and is retried by the next run.
+
+        Returns:
+            Counts of documents and changed fields, and the throughput
+        """
+        self.logger.info(
+            f"🔁 Re-extracting documents not at version {self.version} "
+            f"({self.concurrency} at a time{', dry run' if self.dry_run else ''})"
+        )
+        start = time.perf_counter()
+        finished = []
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="reextract"
+        ) as executor:
+            pending = {}
+            for document in self._stale_documents(limit):
+                pending[executor.submit(traced(self._extract), document)] = document
+                # Enough queued to keep every worker busy, no more texts than that
+                while len(pending) >= self.concurrency * 2:
+                    finished.extend(self._collect(pending, FIRST_COMPLETED))
+                if len(finished) >= self.batch_size:
+                    self._apply(finished)
+                    finished = []
+                    self._log_progress(start)
+            if pending:
+                finished.extend(self._collect(pending, ALL_COMPLETED))
+        if finished:
+            self._apply(finished)
+
+        seconds = time.perf_counter() - start
+        self.summary["seconds"] = round(seconds, 2)
+        self.summary["extract_seconds"] = round(self.summary["extract_seconds"], 2)
+        self.summary["documents_per_hour"] = (
+            round(self.summary["documents"] / seconds * 3600) if seconds else 0
+        )
+        self.logger.info(
+            f"✅ Re-extracted {self.summary['documents']} documents in {seconds:.0f}s: "
+            f"{self.summary['changed']} changed, {self.summary['failed']} failed"
+        )
+        return self.summary
+
+    def _log_progress(self, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        self.logger.info(
+            f"📈 {self.summary['documents']} documents re-extracted, "
+            f"{self.summary['changed']} changed, "
+            f"{self.summary['documents'] / elapsed * 3600:.0f}/hour"
+        )
+
+
+class _StandInCursor:
+    """pymssql-style dict cursor over the SQLite stand-in"""
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, query: str, params: tuple = ()) -> None:
+        self.cursor.execute(to_sqlite(query), params)
+
+    def fetchone(self) -> Optional[dict]:
+        row = self.cursor.fetchone()
+        return dict(row) if row else None
+
+    def fetchall(self) -> list:
+        return [dict(row) for row in self.cursor.fetchall()]
+
+
+class _StandInClient:
+    """Chat completions stand-in that reads the answer out of the document"""
+
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        content = kwargs["messages"][-1]["content"]
+        requested = re.match(r"Fields: (.*)", content)
+        fields = requested.group(1).split(", ") if requested else EXTRACTION_FIELDS
+        answers = {
+            "primary_diagnosis": re.search(r"Assessment: (.*)", content).group(1),
+            "physician": re.search(r"Seen by (.*)", content).group(1),
+            "insurance_company": re.search(r"Coverage: (.*)", content).group(1),
+        }
+        answer = json.dumps({field: answers.get(field, "null") for field in fields})
+        return SimpleNamespace(
+            choices=[
+                SimpleNamespace(
+                    message=SimpleNamespace(content=answer), finish_reason="stop"
+                )
+            ],
+            usage=None,
+        )
+
+
+def _build_stand_in(documents: int, changed_share: float, seed: int = 7):
+    """Documents extracted under an older version, a share of them differently"""
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    SchemaMigrator(conn, conn.cursor(), dialect="sqlite").migrate()
+    rng = random.Random(seed)
+    diagnoses = ["Hypertension", "Type 2 Diabetes", "Asthma", "Pneumonia", "CHF"]
+    insurers = ["Aetna", "Cigna", "Humana", "Medicare"]
+    first_names = ["Mary", "John", "Linda", "James", "Maria", "Robert", "Susan"]
+    last_names = ["Smith", "Garcia", "Johnson", "Nguyen", "Brown", "Patel", "Lee"]
+
+    for document_id in range(1, documents + 1):
+        name = f"{rng.choice(first_names)} {rng.choice(last_names)}"
+        mrn = f"MRN{100000 + document_id}"
+        diagnosis, insurer = rng.choice(diagnoses), rng.choice(insurers)
+        old = {field: "null" for field in EXTRACTION_FIELDS}
+        old.update(
+            patient_name=name,
+            mrn=mrn,
+            dob="01/15/1970",
+            primary_diagnosis=diagnosis,
+            physician="Dr. Smith",
+            insurance_company=insurer,
+            document_type="Discharge Summary",
+        )
+        if rng.random() < changed_share:
+            old["primary_diagnosis"] = rng.choice(diagnoses)
+        text = (
+            f"DISCHARGE SUMMARY\nPatient Name: {name}\nMRN: {mrn}\n"
+            f"DOB: 01/15/1970\nAssessment: {diagnosis}\nSeen by Dr. Smith\n"
+            f"Coverage: {insurer}\n"
+        )
+        conn.execute(
+            "INSERT INTO Documents (DocumentID, Filename, DocumentType, "
+            "ProcessingStatus, CreatedDate, ExtractedData) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                document_id,
+                f"doc_{document_id}.pdf",
+                "Discharge Summary",
+                "Processed",
+                "2024-01-01 00:00:00",
+                json.dumps(old),
+            ),
+        )
+        codec, payload = compress_text(text)
+        conn.execute(
+            "INSERT INTO DocumentText (DocumentID, Codec, TextLength, CompressedText) "
+            "VALUES (?, ?, ?, ?)",
+            (document_id, codec, len(text), payload),
+        )
+        conn.execute(
+            "INSERT INTO Patients (PatientID, PatientName, MedicalRecordNumber, "
+            "DateOfBirth, PrimaryDiagnosis, AttendingPhysician, DocumentID) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                document_id,
+                name,
+                mrn,
+                "1970-01-15",
+                old["primary_diagnosis"],
+                "Dr. Smith",
+                document_id,
+            ),
+        )
+        conn.execute(
+            "INSERT INTO PatientDocuments (PatientID, DocumentID, LinkedDate) "
+            "VALUES (?, ?, ?)",
+            (document_id, document_id, "2024-01-01 00:00:00"),
+        )
+        conn.execute(
+            "INSERT INTO Insurance (PatientID, InsuranceCompany, DocumentID) "
+            "VALUES (?, ?, ?)",
+            (document_id, insurer, document_id),
+        )
+    conn.commit()
+    return conn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-extract documents whose data predates the current prompts and models"
+    )
+    parser.add_argument("--limit", type=int, help="Stop after this many documents")
+    parser.add_argument("--concurrency", type=int, default=REEXTRACT_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=REEXTRACT_BATCH_SIZE)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Extract and diff without writing"
+    )
+    parser.add_argument(
+        "--diff-output", help="Write changed values per document as JSON lines"
+    )
+    parser.add_argument(
+        "--stand-in",
+        type=int,
+        metavar="DOCUMENTS",
+        help="Benchmark on this many SQLite stand-in documents and a simulated model",
+    )
+    parser.add_argument(
+        "--llm-ms", type=float, default=1500, help="Simulated model latency"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.stand_in is None else logging.ERROR)
+    diff_output = (
+        open(args.diff_output, "w", encoding="utf-8") if args.diff_output else None
+    )
+    try:
+        if args.stand_in is not None:
+            conn = _build_stand_in(args.stand_in, changed_share=0.2)
+            job = ReExtractionJob(
+                conn,
+                _StandInCursor(conn),
+                OpenAIExtractor(client=_StandInClient(args.llm_ms)),
+                concurrency=args.concurrency,
+                batch_size=args.batch_size,
+                dry_run=args.dry_run,
+                diff_output=diff_output,
+                dialect="sqlite",
+            )
+        else:
+            conn, cursor = DatabaseConnection().connect_with_retry()
+            if not (conn and cursor):
+                sys.exit("Could not connect to the database")
+            job = ReExtractionJob(
+                conn,
+                cursor,
+                concurrency=args.concurrency,
+                batch_size=args.batch_size,
+                dry_run=args.dry_run,
+                diff_output=diff_output,
+            )
+        try:
+            summary = job.run(args.limit)
+        finally:
+            conn.close()
+    finally:
+        if diff_output is not None:
+            diff_output.close()
+
+    print(json.dumps(summary, indent=2))
+    if summary["seconds"]:
+        print(
+            f"{summary['documents_per_hour']} documents/hour, "
+            f"{summary['extract_seconds'] / summary['seconds']:.1f}x serial extraction"
+        )
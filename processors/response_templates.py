@@ -0,0 +1,218 @@
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional
+
+SHORT_LIST_LIMIT = int(os.environ.get("RESPONSE_TEMPLATE_LIST_LIMIT", "5"))
+
+# Questions that ask for judgement rather than a lookup go to the LLM
+REASONING_PATTERN = re.compile(
+    r"\b(why|how come|compare|comparison|explain|should|recommend|difference|"
+    r"trend|likely|better|worse|summari[sz]e|relationship)\b",
+    re.IGNORECASE,
+)
+
+# Patient fields in display order, with the words that ask for them
+PATIENT_FIELDS = [
+    ("MedicalRecordNumber", "MRN", r"\bmrn\b|record number"),
+    ("InsuranceCompany", "insurance", r"insur|payer|coverage"),
+    ("PrimaryDiagnosis", "diagnosis", r"diagnos|condition|illness"),
+    ("AttendingPhysician", "attending physician", r"physician|doctor|\bdr\b"),
+    ("DateOfBirth", "date of birth", r"birth|\bdob\b|born|\bage\b"),
+    ("AdmissionDate", "admitted", r"admi"),
+    ("DischargeDate", "discharged", r"discharg"),
+    ("FacilityName", "facility", r"facility|hospital|clinic"),
+]
+
+# Attribute intents map onto the patient field they ask about
+ATTRIBUTE_FIELDS = {
+    "diagnosis_search": "PrimaryDiagnosis",
+    "insurance_search": "InsuranceCompany",
+    "physician_search": "AttendingPhysician",
+}
+
+# Columns joined from a table with several rows per patient
+MULTI_VALUED_COLUMNS = {"InsuranceCompany"}
+
+SEARCH_DESCRIPTIONS = {
+    "patient_lookup": "named",
+    "mrn_lookup": "with MRN",
+    "diagnosis_search": "with a diagnosis matching",
+    "physician_search": "treated by",
+}
+
+
+def _display(value) -> Optional[str]:
+    """Render a column value, or None when it should be skipped"""
+    if value is None or str(value).strip() in ("", "null", "None"):
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _distinct_patients(rows: List[dict]) -> Optional[List[dict]]:
+    """
+    Collapse rows of the same patient
+
+    A patient has one row per insurer, so multi-valued columns keep every
+    distinct value, joined in row order. Any other column disagreeing
+    between rows of one patient returns None, for the LLM to explain.
+    """
+    patients = {}
+    for row in rows:
+        key = (row.get("PatientName"), row.get("MedicalRecordNumber"))
+        values = patients.setdefault(key, {})
+        for column, value in row.items():
+            seen = values.setdefault(column, {})
+            shown = _display(value)
+            if shown is not None:
+                seen.setdefault(shown, value)
+
+    collapsed = []
+    for values in patients.values():
+        patient = {}
+        for column, seen in values.items():
+            if len(seen) > 1 and column not in MULTI_VALUED_COLUMNS:
+                return None
+            if len(seen) > 1:
+                patient[column] = ", ".join(seen)
+            else:
+                patient[column] = next(iter(seen.values()), None)
+        collapsed.append(patient)
+    return collapsed
+
+
+class ResponseTemplates:
+    """Deterministic answers for lookups whose result needs no reasoning"""
+
+    def render(
+        self, query: str, intent_list: List[dict], query_results: dict
+    ) -> Optional[str]:
+        """
+        Build an answer without the LLM when the result is unambiguous
+
+        Args:
+            query: Original user question
+            intent_list: Detected [{intent: parameter}] pairs, in order
+            query_results: Combined results from ChatProcessor
+
+        Returns:
+            The answer text, or None when the LLM should write it
+        """
+        if REASONING_PATTERN.search(query):
+            return None
+
+        results = query_results.get("all_results", [])
+        if not results or len(results) != len(intent_list):
+            return None
+        if any(result.get("status") != "success" for result in results):
+            return None
+        # "Did you mean" answers need the LLM to explain the near match
+        if any(result.get("match") == "fuzzy" for result in results):
+            return None
+
+        intents = [list(pair.keys())[0] for pair in intent_list]
+        parameters = [list(pair.values())[0] for pair in intent_list]
+        primary, parameter = intents[0], parameters[0]
+
+        if primary not in SEARCH_DESCRIPTIONS:
+            return None
+
+        # Follow-on intents are only templated when they ask for an attribute
+        # of the patient(s) found by the first intent
+        requested = [self._requested_fields(query)]
+        for intent, extra_parameter in zip(intents[1:], parameters[1:]):
+            if (
+                intent not in ATTRIBUTE_FIELDS
+                or str(extra_parameter).strip().lower() != "all"
+            ):
+                return None
+            requested.append([ATTRIBUTE_FIELDS[intent]])
+        fields = list(dict.fromkeys(field for group in requested for field in group))
+
+        patients = _distinct_patients(results[0].get("data") or [])
+        if patients is None:
+            return None
+        description = f"{SEARCH_DESCRIPTIONS[primary]} \"{parameter}\""
+
+        if not patients:
+            return f"I couldn't find any patients {description}."
+
+        if len(patients) == 1:
+            return self._patient_card(patients[0], fields)
+
+        # Several people answering to one name is exactly the ambiguous case
+        if primary in ("patient_lookup", "mrn_lookup"):
+            return None
+
+        return self._short_list(patients, description, fields)
+
+    @staticmethod
+    def _requested_fields(query: str) -> List[str]:
+        return [
+            column
+            for column, _, pattern in PATIENT_FIELDS
+            if re.search(pattern, query, re.IGNORECASE)
+        ]
+
+    def _patient_card(self, patient: dict, fields: List[str]) -> str:
+        """Single-patient answer that leads with the requested fields"""
+        name = _display(patient.get("PatientName")) or "The patient"
+        labels = {column: label for column, label, _ in PATIENT_FIELDS}
+
+        lead = []
+        rest = []
+        missing = []
+        for column in fields + [column for column in labels if column not in fields]:
+            value = _display(patient.get(column))
+            if value is None:
+                if column in fields:
+                    missing.append(labels[column])
+            elif column in fields:
+                lead.append(f"{labels[column]}: {value}")
+            else:
+                rest.append(f"{labels[column]}: {value}")
+
+        if lead:
+            answer = f"{name}'s {'; '.join(lead)}."
+        elif missing:
+            answer = f"No {' or '.join(missing)} is on record for {name}."
+        elif rest:
+            return f"{name} — {'; '.join(rest)}."
+        else:
+            return f"I found {name}, but no further details are on record."
+
+        if lead and missing:
+            answer += f" No {' or '.join(missing)} is on record."
+        if rest:
+            answer += f" Other details on record: {'; '.join(rest)}."
+        return answer
+
+    def _short_list(
+        self, patients: List[dict], description: str, fields: List[str]
+    ) -> str:
+        """Inline list of up to SHORT_LIST_LIMIT matching patients"""
+        entries = []
+        for patient in patients[:SHORT_LIST_LIMIT]:
+            entry = _display(patient.get("PatientName")) or "Unnamed patient"
+            mrn = _display(patient.get("MedicalRecordNumber"))
+            extras = [
+                _display(patient.get(column))
+                for column in fields
+                if column != "MedicalRecordNumber"
+            ]
+            extras = [value for value in extras if value is not None]
+            if mrn:
+                extras.insert(0, f"MRN {mrn}")
+            if extras:
+                entry += f" ({', '.join(extras)})"
+            entries.append(entry)
+
+        answer = f"I found {len(patients)} patients {description}: {', '.join(entries)}"
+        remaining = len(patients) - len(entries)
+        if remaining > 0:
+            answer += f", and {remaining} more"
+        return answer + "."
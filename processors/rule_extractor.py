@@ -0,0 +1,242 @@
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared import metrics
+
+from .data_validator import DataValidator
+from .openai_extractor import (
+    EXTRACTION_FIELDS,
+    OpenAIExtractor,
+    estimate_message_tokens,
+    extraction_messages,
+)
+
+RULE_MIN_CONFIDENCE = float(os.environ.get("RULE_MIN_CONFIDENCE", "0.8"))
+RULE_SKIP_LLM = os.environ.get("RULE_SKIP_LLM", "true").lower() == "true"
+
+# Labels that introduce each field, most specific first
+FIELD_LABELS = {
+    "patient_name": [r"patient\s*name", r"name\s*of\s*patient", r"patient"],
+    "mrn": [r"medical\s*record\s*(?:number|no\.?|#)", r"\bmrn\b", r"\bmr\s*#"],
+    "dob": [r"date\s*of\s*birth", r"\bdob\b", r"birth\s*date"],
+    "admission_date": [r"admission\s*date", r"date\s*of\s*admission", r"admitted"],
+    "discharge_date": [r"discharge\s*date", r"date\s*of\s*discharge", r"discharged"],
+    "primary_diagnosis": [
+        r"primary\s*diagnosis",
+        r"principal\s*diagnosis",
+        r"admitting\s*diagnosis",
+        r"diagnosis",
+    ],
+    "physician": [
+        r"attending\s*physician",
+        r"attending",
+        r"physician",
+        r"provider",
+    ],
+    "insurance_company": [
+        r"insurance\s*(?:company|carrier|provider)",
+        r"insurance",
+        r"payer",
+    ],
+    "facility": [r"facility(?:\s*name)?", r"hospital", r"clinic"],
+}
+
+# Title lines that name the document type
+DOCUMENT_TYPES = [
+    (r"discharge\s+summary", "Discharge Summary"),
+    (r"admission\s+(?:note|record|form)", "Admission Note"),
+    (r"history\s+and\s+physical|\bh\s*&\s*p\b", "History and Physical"),
+    (r"progress\s+note", "Progress Note"),
+    (r"operative\s+report", "Operative Report"),
+    (r"consultation", "Consultation"),
+    (r"lab(?:oratory)?\s+report", "Lab Report"),
+    (r"radiology\s+report", "Radiology Report"),
+]
+
+DATE_FIELDS = {"dob", "admission_date", "discharge_date"}
+DATE_FORMATS = ["%m/%d/%Y", "%m-%d-%Y", "%Y-%m-%d", "%m/%d/%y", "%B %d, %Y", "%b %d, %Y"]
+
+# Value validators; a value that fails its check is kept at low confidence
+VALUE_PATTERNS = {
+    "patient_name": re.compile(r"^[A-Za-z][A-Za-z .,'\-]{1,99}$"),
+    "mrn": re.compile(r"^[A-Za-z0-9\-]{3,20}$"),
+    "physician": re.compile(r"^[A-Za-z][A-Za-z .,'\-]{1,99}$"),
+}
+
+# "Label: value" on one line, or a label alone with the value on the next.
+# Fields whose values are format-checked may also be separated by a space.
+_SEPARATOR = r"\s*(?::|#|-)\s*"
+_LOOSE_SEPARATOR = r"\s*(?::|#|-|\s)\s*"
+LOOSE_FIELDS = DATE_FIELDS | {"mrn"}
+
+
+def _normalize_date(value: str) -> Optional[str]:
+    """Return the date as MM/DD/YYYY, or None when it doesn't parse"""
+    cleaned = value.strip().rstrip(".")
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, date_format).strftime("%m/%d/%Y")
+        except ValueError:
+            continue
+    return None
+
+
+class RuleExtractor:
+    """Reads labeled fields from OCR text before (or instead of) the LLM"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.validator = DataValidator()
+        self._labels = {
+            field: [
+                re.compile(
+                    rf"^\s*{label}"
+                    rf"{_LOOSE_SEPARATOR if field in LOOSE_FIELDS else _SEPARATOR}(.*)$",
+                    re.IGNORECASE,
+                )
+                for label in labels
+            ]
+            for field, labels in FIELD_LABELS.items()
+        }
+        self._bare_labels = {
+            field: [
+                re.compile(rf"^\s*{label}\s*:?\s*$", re.IGNORECASE) for label in labels
+            ]
+            for field, labels in FIELD_LABELS.items()
+        }
+
+    def _clean_value(self, field: str, value: str) -> Tuple[Optional[str], float]:
+        """Normalize a captured value and return it with a confidence"""
+        value = re.sub(r"\s+", " ", value).strip(" .;,")
+        if not value:
+            return None, 0.0
+
+        if field in DATE_FIELDS:
+            # Dates are captured up to the first non-date text on the line
+            match = re.match(
+                r"([0-9]{1,4}[/\-][0-9]{1,2}[/\-][0-9]{1,4}|[A-Za-z]{3,9}\.? [0-9]{1,2}, [0-9]{4})",
+                value,
+            )
+            normalized = _normalize_date(match.group(1)) if match else None
+            return (normalized, 0.95) if normalized else (value, 0.3)
+
+        if field == "patient_name":
+            # Same cleaning rule the LLM prompt asks for
+            value = re.sub(r"\s+", " ", value.replace(".", " ")).strip()
+
+        pattern = VALUE_PATTERNS.get(field)
+        if pattern is not None and not pattern.match(value):
+            return value, 0.4
+        return value, 0.9
+
+    def _match_line(
+        self, field: str, lines: List[str], index: int
+    ) -> Tuple[Optional[str], float]:
+        line = lines[index]
+        for position, label in enumerate(self._labels[field]):
+            match = label.match(line)
+            if match:
+                value, confidence = self._clean_value(field, match.group(1))
+                if value is None:
+                    # "Patient:" alone; the value is on the next line
+                    break
+                # Generic labels ("patient", "attending") are less certain
+                if position > 0 and position == len(self._labels[field]) - 1:
+                    confidence -= 0.05
+                return value, confidence
+
+        for label in self._bare_labels[field]:
+            if label.match(line) and index + 1 < len(lines):
+                value, confidence = self._clean_value(field, lines[index + 1])
+                return value, confidence - 0.1
+
+        return None, 0.0
+
+    def extract(self, document_text: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """
+        Capture labeled fields from OCR text
+
+        Returns:
+            (data, confidence): data holds the fields at or above
+            RULE_MIN_CONFIDENCE; confidence has a score for every field seen
+        """
+        lines = [line.strip() for line in document_text.splitlines() if line.strip()]
+        data = {}
+        confidence = {}
+
+        for field in FIELD_LABELS:
+            for index in range(len(lines)):
+                value, score = self._match_line(field, lines, index)
+                if value is not None and score > confidence.get(field, 0):
+                    confidence[field] = round(score, 2)
+                    if score >= RULE_MIN_CONFIDENCE:
+                        data[field] = value
+                    if score >= 0.9:
+                        break
+
+        head = " ".join(lines[:10])
+        for pattern, document_type in DOCUMENT_TYPES:
+            if re.search(pattern, head, re.IGNORECASE):
+                data["document_type"] = document_type
+                confidence["document_type"] = 0.9
+                break
+
+        return data, confidence
+
+    def extract_document(
+        self,
+        document_text: str,
+        filename: str = "unknown",
+        openai_extractor: Optional[OpenAIExtractor] = None,
+    ) -> Dict[str, Any]:
+        """
+        Extract healthcare data, calling the LLM only for what rules missed
+
+        Args:
+            document_text: OCR text of the document
+            filename: Name of the file, for logging
+            openai_extractor: Extractor to use (created on demand)
+
+        Returns:
+            Extracted data in the same shape as OpenAIExtractor.extract_data
+        """
+        rule_data, confidence = self.extract(document_text)
+        self.logger.info(
+            f"📐 Rules captured {len(rule_data)}/{len(EXTRACTION_FIELDS)} fields "
+            f"for {filename}: {', '.join(sorted(rule_data)) or 'none'}"
+        )
+
+        _, rules_pass = self.validator.validate_data(rule_data)
+
+        if rules_pass and RULE_SKIP_LLM:
+            extracted_data = {
+                field: rule_data.get(field, "null") for field in EXTRACTION_FIELDS
+            }
+            prompt_tokens = estimate_message_tokens(extraction_messages(document_text))
+            self._record(extracted_data, "llm_skipped", prompt_tokens)
+            self.logger.info(f"⏭️ Skipped LLM extraction for {filename}")
+            return extracted_data
+
+        missing = [field for field in EXTRACTION_FIELDS if field not in rule_data]
+        openai_extractor = openai_extractor or OpenAIExtractor()
+        llm_data = openai_extractor.extract_data(
+            document_text, filename, fields=missing if rule_data else None
+        )
+
+        # High-confidence rule values win over the model's reading
+        extracted_data = {**llm_data, **rule_data}
+        saved = openai_extractor.prompt_tokens_saved(missing) if rule_data else 0
+        self._record(extracted_data, "llm_partial" if rule_data else "llm_full", saved)
+        return extracted_data
+
+    @staticmethod
+    def _record(extracted_data: Dict[str, Any], outcome: str, tokens_saved: int):
+        document_type = str(extracted_data.get("document_type") or "unknown")
+        slug = re.sub(r"[^a-z0-9]+", "_", document_type.lower()).strip("_")[:30]
+        prefix = f"rule_extraction.{slug or 'unknown'}"
+        metrics.increment(f"{prefix}.documents")
+        metrics.increment(f"{prefix}.{outcome}")
+        metrics.increment(f"{prefix}.tokens_saved", tokens_saved)
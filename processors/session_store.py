@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from database import encode_json
+from shared import metrics
+
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", "1000"))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_MAX_RESULTS = int(os.environ.get("SESSION_MAX_RESULTS", "20"))
+SESSION_MAX_TURNS = 5
+
+
+class ChatSession:
+    """Resolved entities, recent turns and cached row sets for one conversation"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.last_access = time.monotonic()
+        self.entities = {}
+        self.turns = []
+        self.results = OrderedDict()
+        self.size_bytes = 0
+
+    @staticmethod
+    def result_key(intent: str, parameter) -> tuple:
+        return intent, " ".join(str(parameter).lower().split())
+
+    def context_summary(self) -> str:
+        """Describe earlier turns so the intent model can resolve references"""
+        lines = []
+        if self.entities.get("patient_name"):
+            patient = self.entities["patient_name"]
+            if self.entities.get("mrn"):
+                patient += f" (MRN {self.entities['mrn']})"
+            lines.append(f"Patient currently being discussed: {patient}")
+        for message in self.turns[-SESSION_MAX_TURNS:]:
+            lines.append(f"Earlier question: {message}")
+        return "\n".join(lines)
+
+
+class SessionStore:
+    """In-memory LRU of chat sessions bounded by TTL, count and byte size"""
+
+    def __init__(
+        self,
+        ttl_seconds: int = SESSION_TTL_SECONDS,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def get_or_create(self, session_id: Optional[str]) -> ChatSession:
+        """Return the live session for session_id, or start a new one"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ChatSession(session_id or uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+                metrics.increment("session.created")
+            self._sessions.move_to_end(session.session_id)
+            session.last_access = time.monotonic()
+            self._evict()
+            return session
+
+    def get_result(
+        self, session: ChatSession, intent: str, parameter
+    ) -> Optional[dict]:
+        """Return a cached row set for (intent, parameter), counting hits"""
+        metrics.increment("session.lookups")
+        with self._lock:
+            key = ChatSession.result_key(intent, parameter)
+            cached = session.results.get(key)
+            if cached is None:
+                return None
+            session.results.move_to_end(key)
+
+        metrics.increment("session.hits")
+        metrics.increment("session.sql_round_trips_saved")
+        return cached[0]
+
+    def put_result(
+        self, session: ChatSession, intent: str, parameter, query_results: dict
+    ) -> None:
+        """Cache a successful row set, keeping the store under its byte cap"""
+        if query_results.get("status") != "success":
+            return
+
+        size = len(encode_json(query_results))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            key = ChatSession.result_key(intent, parameter)
+            previous = session.results.pop(key, None)
+            if previous:
+                self._release(session, previous[1])
+            session.results[key] = (query_results, size)
+            session.size_bytes += size
+            self.total_bytes += size
+
+            while len(session.results) > SESSION_MAX_RESULTS:
+                _, (_, dropped) = session.results.popitem(last=False)
+                self._release(session, dropped)
+
+            self._evict()
+
+    def remember_turn(
+        self, session: ChatSession, message: str, entities: dict
+    ) -> None:
+        with self._lock:
+            session.turns = (session.turns + [message])[-SESSION_MAX_TURNS:]
+            session.entities.update(
+                {key: value for key, value in entities.items() if value}
+            )
+
+    def _release(self, session: ChatSession, size: int) -> None:
+        session.size_bytes -= size
+        self.total_bytes -= size
+
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id)
+        self.total_bytes -= session.size_bytes
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl_seconds
+        # Sessions are kept in access order, so expired ones are at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access >= cutoff:
+                break
+            self._drop(session_id)
+            metrics.increment("session.expired")
+
+    def _evict(self) -> None:
+        while self._sessions and (
+            len(self._sessions) > self.max_sessions or self.total_bytes > self.max_bytes
+        ):
+            session_id = next(iter(self._sessions))
+            self._drop(session_id)
+            metrics.increment("session.evicted")
+
+
+# Shared per worker so follow-ups landing on this instance find their session
+session_store = SessionStore()
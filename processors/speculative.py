@@ -0,0 +1,152 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from shared import metrics, traced
+
+SPECULATIVE_RETRIEVAL_ENABLED = (
+    os.environ.get("SPECULATIVE_RETRIEVAL_ENABLED", "true").lower() == "true"
+)
+SPECULATIVE_MAX_WORKERS = int(os.environ.get("SPECULATIVE_MAX_WORKERS", "4"))
+
+# Entities that are unambiguous without the model, and the query each one
+# would be answered with
+MRN_PATTERN = re.compile(
+    r"\b(?:MRN|medical\s+record\s+(?:number|no\.?|#))"
+    # An MRN carries a digit, so "MRN for John" doesn't guess "for"
+    r"\s*[:#]?\s*((?=[A-Za-z\-]*\d)[A-Za-z0-9\-]{3,20})\b",
+    re.IGNORECASE,
+)
+QUOTED_NAME_PATTERN = re.compile(r"[\"“]([A-Za-z][A-Za-z .,'\-]{1,60}?)[\"”]")
+SPECULATIVE_QUERIES = {
+    "mrn_lookup": "_get_patient_by_mrn",
+    "patient_lookup": "_get_patient_by_name",
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=SPECULATIVE_MAX_WORKERS, thread_name_prefix="speculative"
+            )
+        return _executor
+
+
+def _key(intent: str, parameter) -> Tuple[str, str]:
+    # Same normalization as the session cache; SQL compares case-insensitively
+    return intent, " ".join(str(parameter).lower().split())
+
+
+def guess_intents(message: str) -> List[Tuple[str, str]]:
+    """MRNs and quoted patient names found in a message, as (intent, parameter)"""
+    guesses = [("mrn_lookup", match) for match in MRN_PATTERN.findall(message)]
+    guesses += [
+        ("patient_lookup", " ".join(match.split()))
+        for match in QUOTED_NAME_PATTERN.findall(message)
+    ]
+    return guesses
+
+
+class SpeculativeRetrieval:
+    """Runs likely queries during intent detection, keeping the confirmed ones"""
+
+    def __init__(self, retreive_data):
+        self.retreive_data = retreive_data
+        self.logger = logging.getLogger(__name__)
+        self.intent_done_at = None
+        # (intent, normalized parameter) -> (future, start/end times)
+        self._pending: Dict[Tuple[str, str], Tuple[Future, dict]] = {}
+
+    def start(self, message: str, skip=None) -> "SpeculativeRetrieval":
+        """
+        Submit the queries for entities guessed from the message
+
+        Args:
+            message: The user message
+            skip: Predicate on (intent, parameter) for results already cached
+        """
+        if not SPECULATIVE_RETRIEVAL_ENABLED:
+            return self
+
+        for intent, parameter in guess_intents(message):
+            key = _key(intent, parameter)
+            if key in self._pending or (skip is not None and skip(intent, parameter)):
+                continue
+            timing = {}
+            query = getattr(self.retreive_data, SPECULATIVE_QUERIES[intent])
+            future = _get_executor().submit(
+                traced(self._timed), query, parameter, timing
+            )
+            self._pending[key] = (future, timing)
+            metrics.increment("speculation.started")
+        return self
+
+    @staticmethod
+    def _timed(query, parameter, timing: dict) -> dict:
+        timing["start"] = time.perf_counter()
+        try:
+            return query(parameter)
+        finally:
+            timing["end"] = time.perf_counter()
+
+    def intent_done(self) -> None:
+        """Mark when the intent model answered; queries would start here"""
+        self.intent_done_at = time.perf_counter()
+
+    def take(self, intent: str, parameter) -> Optional[dict]:
+        """
+        Return the speculative result for a confirmed intent, if one was started
+
+        Waits for the query when it is still running.
+        """
+        pending = self._pending.pop(_key(intent, parameter), None)
+        if pending is None:
+            return None
+
+        future, timing = pending
+        try:
+            result = future.result()
+        except Exception as e:
+            self.logger.warning(f"⚠️ Speculative {intent} query failed: {str(e)}")
+            return None
+
+        # Without speculation the query would have started once the intent
+        # was known, so the overlap before that point is the time saved
+        duration = timing["end"] - timing["start"]
+        overlap = (self.intent_done_at or timing["start"]) - timing["start"]
+        saved_ms = max(0.0, min(duration, overlap)) * 1000
+        metrics.increment("speculation.hits")
+        metrics.increment("speculation.saved_ms", saved_ms)
+        metrics.observe("speculation.saved", saved_ms)
+        return result
+
+    def discard(self) -> None:
+        """Cancel speculative queries the intents did not confirm"""
+        for future, timing in self._pending.values():
+            if future.cancel():
+                metrics.increment("speculation.cancelled")
+                continue
+            future.add_done_callback(lambda _, timing=timing: self._wasted(timing))
+        self._pending.clear()
+
+    @staticmethod
+    def _wasted(timing: dict) -> None:
+        metrics.increment("speculation.wasted")
+        if "end" in timing:
+            metrics.increment(
+                "speculation.wasted_ms", (timing["end"] - timing["start"]) * 1000
+            )
+
+
+metrics.register_ratio(
+    "speculation.hit_rate", "speculation.hits", "speculation.started"
+)
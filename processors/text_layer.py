@@ -0,0 +1,236 @@
+import argparse
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import unicodedata
+from typing import IO, List, Optional, Union
+
+from shared import metrics
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - optional dependency
+    PdfReader = None
+
+TEXT_LAYER_ENABLED = os.environ.get("TEXT_LAYER_ENABLED", "true").lower() == "true"
+# A page's own text is used when it has at least this many visible
+# characters, nearly all of them valid and mostly letters or digits
+TEXT_LAYER_MIN_CHARS = int(os.environ.get("TEXT_LAYER_MIN_CHARS", "200"))
+TEXT_LAYER_MIN_VALID_RATIO = float(os.environ.get("TEXT_LAYER_MIN_VALID_RATIO", "0.98"))
+TEXT_LAYER_MIN_ALNUM_RATIO = float(os.environ.get("TEXT_LAYER_MIN_ALNUM_RATIO", "0.6"))
+# A page embedding an image this large (width x height pixels) goes to OCR
+# whatever its text layer holds: a scan with a stamped header, or a
+# scanned form next to typed fields. Logos and signatures stay below it.
+TEXT_LAYER_MAX_IMAGE_PIXELS = int(
+    os.environ.get("TEXT_LAYER_MAX_IMAGE_PIXELS", "250000")
+)
+
+# Form XObjects nest; deeper nesting than this is treated as a scan
+MAX_XOBJECT_DEPTH = 3
+
+# prebuilt-read list price (USD per page) and the per-page latency assumed
+# until this worker has timed an OCR call of its own
+OCR_COST_PER_PAGE = float(os.environ.get("OCR_COST_PER_PAGE", "0.0015"))
+OCR_MS_PER_PAGE = float(os.environ.get("OCR_MS_PER_PAGE", "1500"))
+
+# Broken font encodings come out as replacement or private-use characters
+INVALID_CATEGORIES = {"Co", "Cn", "Cs", "Cc"}
+
+_ocr_ms_per_page = OCR_MS_PER_PAGE
+_ocr_lock = threading.Lock()
+
+
+def text_layer_quality(text: str) -> tuple:
+    """
+    Measure a page's extracted text
+
+    Returns:
+        (visible characters, valid ratio, letter/digit ratio)
+    """
+    visible = [ch for ch in text if not ch.isspace()]
+    if not visible:
+        return 0, 0.0, 0.0
+    valid = sum(
+        1
+        for ch in visible
+        if ch != "\ufffd" and unicodedata.category(ch) not in INVALID_CATEGORIES
+    )
+    alnum = sum(1 for ch in visible if ch.isalnum())
+    return len(visible), valid / len(visible), alnum / len(visible)
+
+
+def is_usable_text(text: str) -> bool:
+    """True when a page's text layer can stand in for OCR"""
+    characters, valid_ratio, alnum_ratio = text_layer_quality(text)
+    return (
+        characters >= TEXT_LAYER_MIN_CHARS
+        and valid_ratio >= TEXT_LAYER_MIN_VALID_RATIO
+        and alnum_ratio >= TEXT_LAYER_MIN_ALNUM_RATIO
+    )
+
+
+def has_scanned_image(resources, depth: int = 0) -> bool:
+    """
+    True when page resources hold an image of TEXT_LAYER_MAX_IMAGE_PIXELS
+
+    Only image dictionaries are read, nothing is decoded; form XObjects
+    are searched for the images they draw.
+    """
+    if depth > MAX_XOBJECT_DEPTH:
+        return True
+    xobjects = resources.get_object().get("/XObject") if resources else None
+    if not xobjects:
+        return False
+    for reference in xobjects.get_object().values():
+        xobject = reference.get_object()
+        subtype = xobject.get("/Subtype")
+        if subtype == "/Image":
+            pixels = int(xobject.get("/Width", 0)) * int(xobject.get("/Height", 0))
+            if pixels >= TEXT_LAYER_MAX_IMAGE_PIXELS:
+                return True
+        elif subtype == "/Form" and has_scanned_image(
+            xobject.get("/Resources"), depth + 1
+        ):
+            return True
+    return False
+
+
+def normalize_lines(text: str) -> str:
+    """One stripped, non-empty line per line of text, like the OCR output"""
+    return "".join(line.strip() + "\n" for line in text.splitlines() if line.strip())
+
+
+def page_ranges(numbers: List[int]) -> str:
+    """Compact 1-based page list for the OCR pages option, e.g. 1-3,7"""
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ",".join(
+        str(low) if low == high else f"{low}-{high}" for low, high in ranges
+    )
+
+
+def read_text_layer(document: Union[bytes, IO[bytes]]) -> Optional[List[Optional[str]]]:
+    """
+    Read each page's embedded text with pypdf
+
+    Streams are rewound afterwards so they can still be sent to OCR.
+
+    Returns:
+        Per page, its normalized text or None when the page needs OCR
+        (unusable text, or a scanned image the text may not cover); None
+        when the PDF cannot be read locally
+    """
+    if PdfReader is None or not TEXT_LAYER_ENABLED:
+        return None
+
+    stream = (
+        io.BytesIO(document) if isinstance(document, (bytes, bytearray)) else document
+    )
+    if not stream.seekable():
+        return None
+
+    start = stream.tell()
+    try:
+        reader = PdfReader(stream)
+        if reader.is_encrypted:
+            return None
+        pages = []
+        for page in reader.pages:
+            if has_scanned_image(page.get("/Resources")):
+                pages.append(None)
+                continue
+            text = page.extract_text() or ""
+            pages.append(normalize_lines(text) if is_usable_text(text) else None)
+        return pages
+    except Exception as e:
+        # Anything pypdf cannot parse is left to Document Intelligence
+        logging.getLogger(__name__).warning(f"⚠️ Text layer unreadable: {str(e)}")
+        return None
+    finally:
+        stream.seek(start)
+
+
+def record_ocr_latency(pages: int, elapsed_ms: float) -> None:
+    """Fold a timed OCR call into the per-page latency estimate"""
+    global _ocr_ms_per_page
+    if pages <= 0:
+        return
+    with _ocr_lock:
+        _ocr_ms_per_page = 0.8 * _ocr_ms_per_page + 0.2 * (elapsed_ms / pages)
+
+
+def record_savings(total_pages: int, text_layer_pages: int, local_ms: float) -> dict:
+    """
+    Count pages that skipped OCR and estimate what that saved
+
+    The latency saved is the estimated OCR time of the skipped pages less
+    the time spent reading text layers locally.
+
+    Returns:
+        Per-document figures, for logs and span attributes
+    """
+    with _ocr_lock:
+        ms_per_page = _ocr_ms_per_page
+    latency_saved_ms = max(0.0, text_layer_pages * ms_per_page - local_ms)
+    cost_saved = text_layer_pages * OCR_COST_PER_PAGE
+
+    metrics.increment("ocr.documents")
+    metrics.increment("ocr.pages", total_pages)
+    metrics.increment("ocr.pages_text_layer", text_layer_pages)
+    metrics.increment("ocr.pages_ocr", total_pages - text_layer_pages)
+    if total_pages and text_layer_pages == total_pages:
+        metrics.increment("ocr.documents_skipped")
+    metrics.increment("ocr.latency_saved_ms", latency_saved_ms)
+    metrics.increment("ocr.cost_saved_usd", cost_saved)
+    metrics.observe("ocr.text_layer", local_ms)
+    return {
+        "pages": total_pages,
+        "text_layer_pages": text_layer_pages,
+        "latency_saved_ms": round(latency_saved_ms, 1),
+        "cost_saved_usd": round(cost_saved, 6),
+    }
+
+
+metrics.register_ratio("ocr.text_layer_rate", "ocr.pages_text_layer", "ocr.pages")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report which PDF pages would skip OCR and the estimated savings"
+    )
+    parser.add_argument("pdfs", nargs="+")
+    args = parser.parse_args()
+
+    if PdfReader is None:
+        sys.exit("pypdf is not installed")
+
+    logging.basicConfig(level=logging.ERROR)
+    totals = [0, 0, 0.0]
+    print(f"{'file':<40}{'pages':>6}{'text':>6}{'ms':>8}{'saved ms':>10}{'saved $':>9}")
+    for path in args.pdfs:
+        with open(path, "rb") as handle:
+            started = time.perf_counter()
+            pages = read_text_layer(handle) or []
+            local_ms = (time.perf_counter() - started) * 1000
+        usable = sum(1 for page in pages if page is not None)
+        saved = record_savings(len(pages), usable, local_ms)
+        totals[0] += len(pages)
+        totals[1] += usable
+        totals[2] += saved["cost_saved_usd"]
+        print(
+            f"{os.path.basename(path)[:39]:<40}{len(pages):>6}{usable:>6}"
+            f"{local_ms:>8.0f}{saved['latency_saved_ms']:>10.0f}"
+            f"{saved['cost_saved_usd']:>9.4f}"
+        )
+    if totals[0]:
+        print(
+            f"{totals[1]}/{totals[0]} pages ({totals[1] / totals[0]:.0%}) skip OCR, "
+            f"${totals[2]:.4f} saved"
+        )
@@ -0,0 +1,131 @@
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urlparse
+
+from azure.core.rest import HttpRequest
+
+from database import get_lookup_filter, get_name_index, get_pool, get_read_replica
+from shared import metrics
+
+from .document_intelligence import get_document_analysis_client
+from .openai_extractor import (
+    EXTRACTION_FIELDS,
+    INTENT_DETECTION_TEMPLATE,
+    RESPONSE_TEMPLATE,
+    extraction_messages,
+    get_openai_client,
+)
+
+WARMUP_DB_CONNECTIONS = int(os.environ.get("WARMUP_DB_CONNECTIONS", "2"))
+WARMUP_TLS_TIMEOUT = float(os.environ.get("WARMUP_TLS_TIMEOUT", "5"))
+
+
+class WorkerWarmup:
+    """Pays the cold-start costs of a worker before the first real request"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.timings = {}
+
+    def _step(self, name: str, func) -> None:
+        """Run one warm-up step, recording its duration and outcome"""
+        start = time.perf_counter()
+        try:
+            detail = func()
+            status = {"ok": True}
+            if detail is not None:
+                status["detail"] = detail
+        except Exception as e:
+            # A failed step only means that cost is paid by the first request
+            self.logger.warning(f"⚠️ Warm-up step {name} failed: {str(e)}")
+            status = {"ok": False, "error": str(e)}
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        status["ms"] = round(elapsed_ms, 1)
+        self.timings[name] = status
+        metrics.observe(f"warmup.{name}", elapsed_ms)
+
+    def _prime_tls(self, endpoint: str) -> str:
+        """Resolve DNS and complete a TLS handshake with an endpoint"""
+        host = urlparse(endpoint).hostname
+        socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
+        context = ssl.create_default_context()
+        with socket.create_connection((host, 443), timeout=WARMUP_TLS_TIMEOUT) as sock:
+            with context.wrap_socket(sock, server_hostname=host) as tls:
+                return tls.version()
+
+    def _warm_openai(self) -> None:
+        client = get_openai_client(
+            os.environ["AZURE_OPENAI_ENDPOINT"], os.environ["AZURE_OPENAI_KEY"]
+        )
+        # One cheap authenticated call leaves a live connection in the pool
+        client.with_options(max_retries=0, timeout=WARMUP_TLS_TIMEOUT).models.list()
+
+    def _warm_document_intelligence(self) -> None:
+        client = get_document_analysis_client(
+            os.environ["DOCUMENT_INTELLIGENCE_ENDPOINT"],
+            os.environ["DOCUMENT_INTELLIGENCE_KEY"],
+        )
+        client.send_request(HttpRequest("GET", "/formrecognizer/info"))
+
+    def _compile_prompts(self) -> int:
+        """Render each per-request template once to validate it"""
+        INTENT_DETECTION_TEMPLATE.format(query="", context="")
+        RESPONSE_TEMPLATE.format(query="", query_results="")
+        extraction_messages("")
+        extraction_messages("", EXTRACTION_FIELDS[:1])
+        return 4
+
+    def run(self) -> dict:
+        """
+        Run every warm-up step
+
+        Returns:
+            Mapping of step name to {"ok", "ms", ...} plus a "total" entry
+        """
+        start = time.perf_counter()
+        self.logger.info("🔥 Starting worker warm-up")
+
+        for name, variable in (
+            ("tls_openai", "AZURE_OPENAI_ENDPOINT"),
+            ("tls_document_intelligence", "DOCUMENT_INTELLIGENCE_ENDPOINT"),
+        ):
+            if os.environ.get(variable):
+                self._step(name, lambda v=variable: self._prime_tls(os.environ[v]))
+
+        self._step("openai_client", self._warm_openai)
+        self._step("document_intelligence_client", self._warm_document_intelligence)
+        self._step("prompt_templates", self._compile_prompts)
+        self._step("db_pool", lambda: get_pool().warm(WARMUP_DB_CONNECTIONS))
+        replica = get_read_replica()
+        if replica is not None:
+            self._step("read_replica", replica.sync)
+        name_index = get_name_index()
+        if name_index is not None:
+            self._step("name_index", name_index.refresh)
+        lookup_filter = get_lookup_filter()
+        if lookup_filter is not None:
+            self._step("lookup_filter", lookup_filter.build)
+
+        total_ms = (time.perf_counter() - start) * 1000
+        self.timings["total"] = {"ok": True, "ms": round(total_ms, 1)}
+        metrics.observe("warmup.total", total_ms)
+
+        summary = ", ".join(
+            f"{name}={step['ms']}ms" for name, step in self.timings.items()
+        )
+        self.logger.info(f"✅ Worker warm-up finished: {summary}")
+        return self.timings
+
+
+def warm_up_in_background() -> threading.Thread:
+    """Start warm-up on a daemon thread so worker start is not delayed"""
+    thread = threading.Thread(
+        target=lambda: WorkerWarmup().run(), name="worker-warmup", daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,45 @@
+from .deadline import (
+    AdmissionController,
+    DeadlineExceeded,
+    Overloaded,
+    bounded_timeout,
+    chat_admission,
+    check_deadline,
+    deadline,
+    remaining,
+    whole_seconds,
+)
+from .metrics import Metrics, metrics
+from .recorder import ChatRecorder, chat_recorder
+from .tracing import (
+    Span,
+    TracedCursor,
+    Tracer,
+    install_log_correlation,
+    sampled_debug,
+    traced,
+    tracer,
+)
+
+__all__ = [
+    "AdmissionController",
+    "bounded_timeout",
+    "ChatRecorder",
+    "chat_admission",
+    "chat_recorder",
+    "check_deadline",
+    "deadline",
+    "DeadlineExceeded",
+    "Metrics",
+    "metrics",
+    "Overloaded",
+    "remaining",
+    "Span",
+    "TracedCursor",
+    "Tracer",
+    "install_log_correlation",
+    "sampled_debug",
+    "traced",
+    "tracer",
+    "whole_seconds",
+]
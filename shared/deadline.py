@@ -0,0 +1,177 @@
+import contextvars
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from .metrics import metrics
+
+# Budget for one chat request, from arrival to response
+CHAT_DEADLINE_SECONDS = float(os.environ.get("CHAT_DEADLINE_SECONDS", "45"))
+
+# Per-instance admission: requests running at once, requests allowed to
+# wait for a slot, and the longest a request waits before being shed
+CHAT_MAX_CONCURRENT = int(os.environ.get("CHAT_MAX_CONCURRENT", "8"))
+CHAT_MAX_QUEUE = int(os.environ.get("CHAT_MAX_QUEUE", "16"))
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("CHAT_QUEUE_TIMEOUT_SECONDS", "5"))
+
+# Monotonic time the current request must finish by, None when unbounded
+_deadline: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before the named stage"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Overloaded(Exception):
+    """The instance is at capacity and the request was shed"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server busy, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Bound everything in the block, including threads started with traced()
+
+    A nested deadline can only shorten the one already in force.
+    """
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current budget, None outside any deadline"""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def check_deadline(stage: str) -> None:
+    """Raise DeadlineExceeded when no budget is left for the next stage"""
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.increment(f"deadline.exceeded.{stage}")
+        raise DeadlineExceeded(stage)
+
+
+def bounded_timeout(timeout: float, stage: str) -> float:
+    """
+    Shorten a call's own timeout to the budget left
+
+    Raises:
+        DeadlineExceeded: When the budget is already spent
+    """
+    check_deadline(stage)
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+def whole_seconds(timeout: float) -> int:
+    """Round a timeout up for drivers that only take whole seconds"""
+    return max(1, math.ceil(timeout))
+
+
+class AdmissionController:
+    """Caps concurrent requests, queueing a bounded number and shedding the rest"""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int = CHAT_MAX_CONCURRENT,
+        max_queue: int = CHAT_MAX_QUEUE,
+        queue_timeout: float = CHAT_QUEUE_TIMEOUT_SECONDS,
+    ):
+        """
+        Initialize an idle controller
+
+        Args:
+            name: Metric prefix, e.g. "chat.admission"
+            max_concurrent: Requests allowed to run at once
+            max_queue: Requests allowed to wait for a slot
+            queue_timeout: Longest wait for a slot, in seconds
+        """
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        # Recent time a request held its slot, for the Retry-After estimate
+        self._service_seconds = 1.0
+        self._condition = threading.Condition()
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new request would have drained"""
+        with self._condition:
+            backlog = self.active + self.waiting
+            estimate = backlog * self._service_seconds / self.max_concurrent
+        return whole_seconds(estimate)
+
+    def _shed(self, reason: str) -> Overloaded:
+        metrics.increment(f"{self.name}.rejected")
+        metrics.increment(f"{self.name}.rejected.{reason}")
+        return Overloaded(self.retry_after())
+
+    @contextmanager
+    def admit(self):
+        """
+        Hold a slot for the block, waiting in the queue if all are taken
+
+        The wait is bounded by both queue_timeout and the request deadline.
+
+        Raises:
+            Overloaded: When the queue is full or the wait timed out
+        """
+        with self._condition:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    raise self._shed("queue_full")
+
+                metrics.increment(f"{self.name}.queued")
+                left = remaining()
+                wait = (
+                    self.queue_timeout
+                    if left is None
+                    else min(self.queue_timeout, left)
+                )
+                self.waiting += 1
+                start = time.perf_counter()
+                try:
+                    admitted = self._condition.wait_for(
+                        lambda: self.active < self.max_concurrent, max(0.0, wait)
+                    )
+                finally:
+                    self.waiting -= 1
+                    metrics.observe(
+                        f"{self.name}.queue_wait", (time.perf_counter() - start) * 1000
+                    )
+                if not admitted:
+                    raise self._shed("queue_timeout")
+            self.active += 1
+
+        metrics.increment(f"{self.name}.admitted")
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - start
+            with self._condition:
+                self.active -= 1
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * held
+                self._condition.notify()
+
+
+chat_admission = AdmissionController("chat.admission")
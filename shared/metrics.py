@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+
+class Metrics:
+    """Process-wide counters and latency samples for the worker"""
+
+    def __init__(self, max_samples: int = 2048):
+        """
+        Initialize empty metric stores
+
+        Args:
+            max_samples: Most recent samples kept per timing for percentiles
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._timings: Dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=self.max_samples)
+        )
+        self._ratios: Dict[str, Tuple[str, str]] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name: str, value: float) -> None:
+        """Report the current value of a level, e.g. bytes held by a cache"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value_ms: float) -> None:
+        with self._lock:
+            self._timings[name].append(value_ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Record the wall-clock duration of the block in milliseconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def ratio(self, numerator: str, denominator: str) -> float:
+        """Return numerator / denominator counters, 0 when nothing recorded"""
+        with self._lock:
+            total = self._counters.get(denominator, 0)
+            return self._counters.get(numerator, 0) / total if total else 0.0
+
+    def register_ratio(self, name: str, numerator: str, denominator: str) -> None:
+        """Report numerator / denominator counters as name in snapshots"""
+        with self._lock:
+            self._ratios[name] = (numerator, denominator)
+
+    @staticmethod
+    def _pick(samples: list, percentile: float) -> float:
+        """Nearest-rank percentile of an already sorted sample list"""
+        return samples[int(round(percentile / 100 * (len(samples) - 1)))]
+
+    def percentile(self, name: str, percentile: float) -> float:
+        with self._lock:
+            samples = sorted(self._timings.get(name, ()))
+        return self._pick(samples, percentile) if samples else 0.0
+
+    def snapshot(self) -> dict:
+        """Return all counters, p50/p95/max for every timing, ratios and gauges"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            timings = {name: sorted(values) for name, values in self._timings.items()}
+            ratios = dict(self._ratios)
+
+        summary = {}
+        for name, samples in timings.items():
+            if not samples:
+                continue
+            summary[name] = {
+                "count": len(samples),
+                "p50_ms": round(self._pick(samples, 50), 2),
+                "p95_ms": round(self._pick(samples, 95), 2),
+                "max_ms": round(samples[-1], 2),
+            }
+
+        ratio_values = {
+            name: round(counters.get(numerator, 0) / counters[denominator], 4)
+            for name, (numerator, denominator) in ratios.items()
+            if counters.get(denominator)
+        }
+
+        return {
+            "counters": counters,
+            "timings": summary,
+            "ratios": ratio_values,
+            "gauges": gauges,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+# Shared instance; each Functions worker process keeps its own numbers
+metrics = Metrics()
@@ -0,0 +1,208 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from .tracing import Span, tracer
+
+CHAT_RECORD_PATH = os.environ.get("CHAT_RECORD_PATH")
+CHAT_RECORD_SAMPLE_RATE = float(os.environ.get("CHAT_RECORD_SAMPLE_RATE", "1.0"))
+# Without a fixed salt pseudonyms only line up within one worker's lifetime
+CHAT_RECORD_SALT = os.environ.get("CHAT_RECORD_SALT") or os.urandom(16).hex()
+
+RECORD_VERSION = 1
+
+# Intent parameters that identify a patient; everything else is kept as-is
+IDENTIFYING_INTENTS = {
+    "patient_lookup": "<patient>",
+    "mrn_lookup": "<mrn>",
+    "patient_documents": "<patient>",
+}
+PSEUDONYM_PREFIX = "anon:"
+# Stands in for a message whose identifiers could not be located
+REDACTED_MESSAGE = "<redacted>"
+
+_current_record: contextvars.ContextVar = contextvars.ContextVar(
+    "current_record", default=None
+)
+
+
+def pseudonymize(value) -> str:
+    """Stable salted pseudonym, so repeats of a value stay recognizable"""
+    digest = hashlib.blake2b(
+        " ".join(str(value).lower().split()).encode("utf-8"),
+        key=CHAT_RECORD_SALT.encode("utf-8")[:64],
+        digest_size=6,
+    )
+    return PSEUDONYM_PREFIX + digest.hexdigest()
+
+
+def statement_fingerprint(statement: str) -> str:
+    return hashlib.blake2b(statement.encode("utf-8"), digest_size=4).hexdigest()
+
+
+def anonymize(message: str, intents: Optional[list]) -> tuple:
+    """
+    Strip patient identifiers from a message and its intents
+
+    Identifying intent parameters become pseudonyms, their mentions in the
+    message become placeholders and any remaining digits become 9s. Each
+    word of a parameter is also replaced on its own, so "Doe, John" is
+    caught for "John Doe". Without intents nothing says where the
+    identifiers are, so the whole message is dropped.
+
+    Returns:
+        (message, intents)
+    """
+    if intents is None:
+        return REDACTED_MESSAGE, None
+
+    clean_intents = []
+    for intent_pair in intents:
+        clean_pair = {}
+        for intent, parameter in intent_pair.items():
+            placeholder = IDENTIFYING_INTENTS.get(intent)
+            if placeholder and parameter:
+                message = re.sub(
+                    re.escape(str(parameter)), placeholder, message, flags=re.IGNORECASE
+                )
+                for word in re.findall(r"\w{2,}", str(parameter)):
+                    message = re.sub(
+                        rf"\b{re.escape(word)}\b",
+                        placeholder,
+                        message,
+                        flags=re.IGNORECASE,
+                    )
+                parameter = pseudonymize(parameter)
+            clean_pair[intent] = parameter
+        clean_intents.append(clean_pair)
+    return re.sub(r"\d", "9", message), clean_intents
+
+
+class ChatRecorder:
+    """Appends one compact, anonymized line per recorded chat request"""
+
+    def __init__(
+        self,
+        path: Optional[str] = CHAT_RECORD_PATH,
+        sample_rate: float = CHAT_RECORD_SAMPLE_RATE,
+        sink: Optional[Callable[[dict], None]] = None,
+    ):
+        """
+        Initialize the recorder
+
+        Args:
+            path: JSON-lines file to append to (recording is off without one)
+            sample_rate: Fraction of requests recorded
+            sink: Receives each finished record instead of the file
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.sink)
+
+    @contextmanager
+    def record(self, message: str, session_id: Optional[str] = None):
+        """
+        Record the chat request handled inside the block
+
+        SQL and LLM spans finishing in the block (or in threads given the
+        context with shared.traced) are added to the record.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+
+        record = {
+            "v": RECORD_VERSION,
+            "ts": round(time.time(), 3),
+            "session": session_id,
+            "message": message,
+            "intents": None,
+            "rows": 0,
+            "status": "ok",
+            "ms": 0.0,
+            "sql": [],
+            "llm": [],
+        }
+        token = _current_record.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record["status"] = "error"
+            raise
+        finally:
+            record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+            _current_record.reset(token)
+            self._write(record)
+
+    @staticmethod
+    def annotate(**fields) -> None:
+        """Set fields on the chat request being recorded, if any"""
+        record = _current_record.get()
+        if record is not None:
+            record.update(fields)
+
+    def _write(self, record: dict) -> None:
+        record["message"], record["intents"] = anonymize(
+            record["message"], record["intents"]
+        )
+        if record["status"] != "ok":
+            # A failed request may not have parsed the identifiers it carried
+            record["message"] = REDACTED_MESSAGE
+        if record["session"]:
+            record["session"] = pseudonymize(record["session"])
+        if self.sink is not None:
+            self.sink(record)
+            return
+
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        try:
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as handle:
+                    handle.write(line + "\n")
+        except OSError as e:
+            # A full disk must not fail the chat request
+            self.logger.warning(f"⚠️ Chat record dropped: {str(e)}")
+
+
+def _on_span(span: Span) -> None:
+    record = _current_record.get()
+    if record is None:
+        return
+    if span.name == "sql":
+        record["sql"].append(
+            [
+                statement_fingerprint(span.attributes.get("db.statement", "")),
+                round(span.duration_ms, 2),
+                span.attributes.get("db.rowcount", -1),
+            ]
+        )
+    elif span.name.startswith("llm."):
+        record["llm"].append(
+            [
+                span.name[4:],
+                round(span.duration_ms, 2),
+                span.attributes.get("llm.prompt_tokens", 0),
+                span.attributes.get("llm.completion_tokens", 0),
+            ]
+        )
+
+
+tracer.add_listener(_on_span)
+
+# Shared recorder; records only when CHAT_RECORD_PATH is set
+chat_recorder = ChatRecorder()
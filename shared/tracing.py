@@ -0,0 +1,307 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH")
+TRACE_OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+TRACE_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "azure-ocr-rag-pipeline")
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    """One timed operation in a trace, shaped after the OpenTelemetry span"""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "status",
+        "sampled",
+    )
+
+    def __init__(
+        self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool
+    ):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.status = "OK"
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, error: Exception) -> None:
+        self.status = "ERROR"
+        self.attributes["exception.type"] = type(error).__name__
+        self.attributes["exception.message"] = str(error)[:500]
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        """Render the span in OTLP/JSON form"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2 if self.status == "ERROR" else 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileSpanExporter:
+    """Appends each finished trace as one OTLP/JSON line to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, payload: dict) -> None:
+        line = json.dumps(payload, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+
+
+class OtlpHttpSpanExporter:
+    """POSTs OTLP/JSON to a collector (or any stand-in speaking /v1/traces)"""
+
+    def __init__(self, endpoint: str, timeout: float = 2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, payload: dict) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+class Tracer:
+    """Creates spans, samples whole traces and exports them off the hot path"""
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, exporters=None):
+        self.sample_rate = sample_rate
+        self.exporters = exporters if exporters is not None else []
+        self.logger = logging.getLogger(__name__)
+        self._listeners: List[Callable[[Span], None]] = []
+        self._pending: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=1000)
+        self._worker = None
+
+    def add_listener(self, listener: Callable[[Span], None]) -> None:
+        """Call listener with every finished span, sampled or not"""
+        self._listeners.append(listener)
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def start_span(self, name: str, **attributes):
+        """Run the block inside a child of the current span (or a new trace)"""
+        parent = _current_span.get()
+        if parent is None:
+            span = Span(name, os.urandom(16).hex(), None, self._sample())
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, parent.sampled)
+        span.attributes.update(attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            self._finish(span)
+
+    def _sample(self) -> bool:
+        return bool(self.exporters) and random.random() < self.sample_rate
+
+    def _finish(self, span: Span) -> None:
+        for listener in self._listeners:
+            try:
+                listener(span)
+            except Exception as e:
+                self.logger.debug(f"Span listener failed: {str(e)}")
+
+        if not span.sampled:
+            return
+
+        # Spans are held until their root finishes, then exported together
+        with self._lock:
+            if len(self._pending) > 1000:
+                # Roots that never finished (e.g. a killed worker) would leak
+                self._pending.clear()
+            spans = self._pending.setdefault(span.trace_id, [])
+            spans.append(span)
+            if span.parent_id is not None:
+                return
+            del self._pending[span.trace_id]
+
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": TRACE_SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [item.to_otlp() for item in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        self._enqueue(payload)
+
+    def _enqueue(self, payload: dict) -> None:
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._export_loop, name="trace-exporter", daemon=True
+                    )
+                    self._worker.start()
+        try:
+            self._queue.put_nowait(payload)
+        except queue.Full:
+            # Dropping a trace is better than slowing down requests
+            pass
+
+    def _export_loop(self) -> None:
+        while True:
+            payload = self._queue.get()
+            for exporter in self.exporters:
+                try:
+                    exporter.export(payload)
+                except Exception as e:
+                    self.logger.debug(f"Trace export failed: {str(e)}")
+
+
+def traced(func: Callable) -> Callable:
+    """
+    Bind func to the caller's trace context for use in another thread
+
+    asyncio tasks copy context on their own; thread pools do not.
+    """
+    context = contextvars.copy_context()
+
+    def run_in_context(*args, **kwargs):
+        # Each call gets its own copy so concurrent calls don't collide
+        return context.copy().run(func, *args, **kwargs)
+
+    return run_in_context
+
+
+class TracedCursor:
+    """DB-API cursor proxy that wraps each execute in a SQL span"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, params=None):
+        statement = " ".join(query.split())
+        with tracer.start_span("sql", **{"db.statement": statement[:300]}) as span:
+            if params is None:
+                result = self._cursor.execute(query)
+            else:
+                result = self._cursor.execute(query, params)
+            span.set_attribute("db.rowcount", getattr(self._cursor, "rowcount", -1))
+            return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+def sampled_debug(logger: logging.Logger, message: str) -> None:
+    """Log bulky payloads at DEBUG for only a sample of calls"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.debug(message)
+
+
+def install_log_correlation() -> None:
+    """Tag every log record (and message) with the active trace id"""
+    default_factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = default_factory(*args, **kwargs)
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span else "-"
+        record.span_id = span.span_id if span else "-"
+        if span is not None:
+            record.msg = f"[trace={span.trace_id[:16]}] {record.msg}"
+        return record
+
+    logging.setLogRecordFactory(record_factory)
+
+
+def _configured_exporters() -> list:
+    exporters = []
+    if TRACE_EXPORT_PATH:
+        exporters.append(FileSpanExporter(TRACE_EXPORT_PATH))
+    if TRACE_OTLP_ENDPOINT:
+        exporters.append(OtlpHttpSpanExporter(TRACE_OTLP_ENDPOINT))
+    return exporters
+
+
+# Shared tracer; exports only when TRACE_EXPORT_PATH or an OTLP endpoint is set
+tracer = Tracer(exporters=_configured_exporters())